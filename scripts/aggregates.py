@@ -0,0 +1,375 @@
+"""
+This script contains the functions that read the 4 datasets (submissions, comments,
+tokens and entities) in chunks and reduce them into small aggregates.
+
+The aggregates are plain dictionaries of integers and pandas Series, they can be merged
+with each other so the datasets never need to fit in memory at once.
+
+The submissions and comments are counted by UTC hour, the conversion to a display
+timezone only happens when the weekday and hour counts are requested.
+"""
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+
+# How many rows are read from the csv files at a time.
+CHUNK_SIZE = 500000
+
+# The number of seconds in one hour, the size of the time buckets.
+HOUR = 3600
+
+# The number of seconds in one day, the size of the time series buckets.
+DAY = 86400
+
+# The entity labels that are used in the entities word cloud.
+ENTITY_LABELS = ["LOC", "ORG", "PER"]
+
+
+def new_activity_aggregates():
+    """Creates empty aggregates for the submissions or comments datasets.
+
+    Returns
+    -------
+    dict
+        The empty aggregates.
+
+    """
+
+    return {
+        "total": 0,
+        "hourly": pd.Series(dtype="int64"),
+        "authors": pd.Series(dtype="int64"),
+        "domains": pd.Series(dtype="int64")
+    }
+
+
+def merge_aggregates(left, right):
+    """Merges two aggregates of the same kind.
+
+    Parameters
+    ----------
+    left : dict
+        The first aggregates, they are not modified.
+
+    right : dict
+        The second aggregates, they are not modified.
+
+    Returns
+    -------
+    dict
+        The merged aggregates.
+
+    """
+
+    merged = dict()
+
+    for key in left.keys() | right.keys():
+
+        if key not in right:
+            merged[key] = left[key]
+        elif key not in left:
+            merged[key] = right[key]
+        elif isinstance(left[key], pd.Series):
+            merged[key] = left[key].add(
+                right[key], fill_value=0).astype("int64")
+        else:
+            merged[key] = left[key] + right[key]
+
+    return merged
+
+
+def update_activity_aggregates(aggregates, df):
+    """Adds the counts of a submissions or comments chunk to the aggregates.
+
+    Parameters
+    ----------
+    aggregates : dict
+        The aggregates that will be updated in place.
+
+    df : pandas.DataFrame
+        A chunk of the submissions or comments DataFrame with a created_utc column.
+
+    """
+
+    chunk = new_activity_aggregates()
+    chunk["total"] = len(df)
+
+    # We count the records by UTC hour, the buckets are the hours since the epoch.
+    chunk["hourly"] = (df["created_utc"] // HOUR).value_counts()
+    chunk["authors"] = df["author"].value_counts()
+
+    if "domain" in df.columns:
+        chunk["domains"] = df["domain"].value_counts()
+
+    aggregates.update(merge_aggregates(aggregates, chunk))
+
+
+def get_hourly_counts(aggregates, timezone="UTC"):
+    """Gets the hourly counts with timezone-aware timestamps.
+
+    Parameters
+    ----------
+    aggregates : dict
+        The submissions or comments aggregates.
+
+    timezone : str
+        The timezone of the returned timestamps.
+
+    Returns
+    -------
+    pandas.Series
+        The counts by hour.
+
+    """
+
+    hourly = aggregates["hourly"].sort_index()
+
+    index = pd.to_datetime(hourly.index.to_numpy(dtype="int64") * HOUR,
+                           unit="s", utc=True).tz_convert(timezone)
+
+    return pd.Series(hourly.to_numpy(), index=index)
+
+
+def get_weekday_counts(aggregates, timezone="UTC"):
+    """Gets the counts by weekday, from 0 (Monday) to 6 (Sunday).
+
+    Parameters
+    ----------
+    aggregates : dict
+        The submissions or comments aggregates.
+
+    timezone : str
+        The timezone used to get the weekdays.
+
+    Returns
+    -------
+    pandas.Series
+        The counts by weekday.
+
+    """
+
+    hourly = get_hourly_counts(aggregates, timezone)
+
+    return hourly.groupby(hourly.index.weekday).sum().reindex(
+        range(0, 7), fill_value=0)
+
+
+def get_hour_counts(aggregates, timezone="UTC"):
+    """Gets the counts by hour of the day, from 0 to 23.
+
+    Parameters
+    ----------
+    aggregates : dict
+        The submissions or comments aggregates.
+
+    timezone : str
+        The timezone used to get the hours.
+
+    Returns
+    -------
+    pandas.Series
+        The counts by hour of the day.
+
+    """
+
+    hourly = get_hourly_counts(aggregates, timezone)
+
+    return hourly.groupby(hourly.index.hour).sum().reindex(
+        range(0, 24), fill_value=0)
+
+
+def get_daily_counts(aggregates):
+    """Gets the daily counts in UTC, including the days without any records.
+
+    Parameters
+    ----------
+    aggregates : dict
+        The submissions or comments aggregates.
+
+    Returns
+    -------
+    pandas.Series
+        The counts by day.
+
+    """
+
+    hourly = get_hourly_counts(aggregates)
+
+    if len(hourly) == 0:
+        return hourly
+
+    return hourly.resample("D").sum()
+
+
+def intern(values, vocabulary):
+    """Converts values to integer ids, new values are added to the vocabulary.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        The values to convert.
+
+    vocabulary : dict
+        The id of each known value, it is updated in place.
+
+    Returns
+    -------
+    numpy.ndarray
+        The id of each value.
+
+    """
+
+    codes, uniques = pd.factorize(values)
+
+    ids = np.array([vocabulary.setdefault(value, len(vocabulary))
+                    for value in uniques], dtype="int64")
+
+    return ids[codes]
+
+
+def read_created_utc(df):
+    """Gets the UTC timestamps of a submissions or comments chunk.
+
+    Older csv files have a datetime column with ISO dates instead of
+    the created_utc column, we treat those dates as UTC.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        A chunk of the submissions or comments DataFrame.
+
+    Returns
+    -------
+    pandas.Series
+        The seconds since the epoch of each record.
+
+    """
+
+    if "created_utc" in df.columns:
+        return df["created_utc"].astype("int64")
+
+    dates = pd.to_datetime(df["datetime"], format="ISO8601")
+
+    return (dates - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+
+
+def read_activity_aggregates(file_path, chunksize=CHUNK_SIZE):
+    """Reads a submissions or comments csv file in chunks and aggregates it.
+
+    Only the created_utc, author and domain columns are loaded.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the submissions or comments csv file.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    dict
+        The aggregates of the whole file.
+
+    """
+
+    aggregates = new_activity_aggregates()
+
+    reader = pd.read_csv(file_path,
+                         usecols=lambda column: column in [
+                             "created_utc", "datetime", "author", "domain"],
+                         chunksize=chunksize)
+
+    for df in reader:
+        df["created_utc"] = read_created_utc(df)
+        update_activity_aggregates(aggregates, df)
+        metrics.increment("rows_read_total", len(df), reader="activity")
+
+    return aggregates
+
+
+def read_tokens_aggregates(file_path, chunksize=CHUNK_SIZE):
+    """Reads the tokens csv file in chunks and counts its lemmas.
+
+    We only count the lemmas that are not numbers, are not stop words
+    and are longer than one character.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the tokens csv file.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    dict
+        The aggregates with the lemma counts.
+
+    """
+
+    aggregates = {"total": 0, "lemmas": pd.Series(dtype="int64")}
+
+    reader = pd.read_csv(file_path,
+                         usecols=["lemma_lower", "is_alphabet", "is_stopword"],
+                         dtype={"lemma_lower": "str"},
+                         keep_default_na=False,
+                         chunksize=chunksize)
+
+    for df in reader:
+
+        lemmas = df[
+            (df["is_alphabet"] == True) &
+            (df["is_stopword"] == False) &
+            (df["lemma_lower"].str.len() > 1)
+        ]["lemma_lower"].value_counts()
+
+        aggregates = merge_aggregates(
+            aggregates, {"total": len(df), "lemmas": lemmas})
+        metrics.increment("rows_read_total", len(df), reader="tokens")
+
+    return aggregates
+
+
+def read_entities_aggregates(file_path, chunksize=CHUNK_SIZE):
+    """Reads the entities csv file in chunks and counts its entities.
+
+    We only count the entities that are longer than one character
+    and are in the Location, Organization or Person categories.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the entities csv file.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    dict
+        The aggregates with the entity counts.
+
+    """
+
+    aggregates = {"total": 0, "entities": pd.Series(dtype="int64")}
+
+    reader = pd.read_csv(file_path, usecols=["text", "label"],
+                         dtype={"text": "str"}, keep_default_na=False,
+                         chunksize=chunksize)
+
+    for df in reader:
+
+        entities = df[
+            (df["label"].isin(ENTITY_LABELS)) &
+            (df["text"].str.len() > 1)]["text"].value_counts()
+
+        aggregates = merge_aggregates(
+            aggregates, {"total": len(df), "entities": entities})
+        metrics.increment("rows_read_total", len(df), reader="entities")
+
+    return aggregates
@@ -0,0 +1,618 @@
+"""
+This script benchmarks the pipeline on synthetic data (see synthetic.py), it times each stage:
+writing the datasets, loading the csv files, the NLP pipeline, each aggregation and each
+step3.py chart.
+
+Each stage runs in a new process, this way nothing is shared between stages. The memory
+of a stage is the peak resident set size of its timed part minus the memory the process
+already used before it, the setup of the stage (e.g. converting its input files) is not
+counted. The results can be saved as a baseline and later runs are compared against it.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# The resource module is not available on Windows, the peak memory is not measured there.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import aggregates
+import synthetic
+
+
+# The folder of the repository, the step3.py assets are relative to it.
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The folder of the scripts, the startup stages import them from there.
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# A stage is a regression when it is this much slower than the baseline,
+# and at least MIN_DIFFERENCE seconds slower.
+TOLERANCE = 0.2
+MIN_DIFFERENCE = 0.05
+
+# How many comments the NLP stage processes.
+NLP_COMMENTS = 1000
+
+# The modules that each script must not import at startup, only the stages
+# that need them import them.
+LAZY_MODULES = {
+    "step2": ["spacy", "tokencorpus", "scipy", "pandas", "numpy"],
+    "step3": ["matplotlib", "seaborn", "wordcloud", "PIL", "scipy", "pandas"]
+}
+
+
+class SkipStage(Exception):
+    """Raised when a stage can't run in this environment, e.g. a missing library."""
+
+
+def get_import_times(module):
+    """Imports a module in a new interpreter with -X importtime.
+
+    Parameters
+    ----------
+    module : str
+        The name of the module, e.g. step3
+
+    Returns
+    -------
+    dict
+        The cumulative import time in seconds of every module that was imported,
+        including its own imports.
+
+    """
+
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                             cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+
+    times = dict()
+
+    # Each line is: import time: self [us] | cumulative | imported package
+    for line in process.stderr.splitlines():
+
+        columns = line.replace("import time:", "").split("|")
+
+        if len(columns) == 3 and columns[1].strip().isdigit():
+            times[columns[2].strip()] = int(columns[1]) / 1e6
+
+    return times
+
+
+def reset_peak_memory():
+    """Resets the peak resident set size of this process, only on Linux.
+
+    Returns
+    -------
+    bool
+        True if the peak was reset.
+
+    """
+
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def get_memory():
+    """Gets the current and peak resident set size of this process.
+
+    On Linux both come from /proc/self/status, on other systems only the peak
+    is known (ru_maxrss) and it is also returned as the current size.
+
+    Returns
+    -------
+    tuple
+        The current and peak memory in MB, None when they can't be measured.
+
+    """
+
+    try:
+        with open("/proc/self/status", "r") as status_file:
+            fields = dict(line.split(":", 1) for line in status_file if ":" in line)
+
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        pass
+
+    if resource is None:
+        return None, None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+    return peak, peak
+
+
+def get_files(work_dir, extension=".csv"):
+    """Gets the paths of the files used by the stages.
+
+    Parameters
+    ----------
+    work_dir : str
+        The folder where the files are saved.
+
+    extension : str
+        The extension of the csv files, .csv.gz and .csv.zst are compressed.
+
+    Returns
+    -------
+    dict
+        The path of each file.
+
+    """
+
+    files = {name: os.path.join(work_dir, "synthetic-{}{}".format(name, extension))
+             for name in ["submissions", "comments", "tokens"]}
+
+    files["parquet"] = os.path.join(work_dir, "synthetic-comments.parquet")
+    files["corpus"] = os.path.join(work_dir, "synthetic-corpus")
+    files["nlp"] = os.path.join(work_dir, "nlp-tokens.csv")
+
+    return files
+
+
+def load_result(work_dir, stage):
+    """Loads the result saved by an aggregation stage.
+
+    Parameters
+    ----------
+    work_dir : str
+        The folder where the results are saved.
+
+    stage : str
+        The name of the stage.
+
+    Returns
+    -------
+    object
+        The result of the stage.
+
+    """
+
+    file_path = os.path.join(work_dir, stage + ".pickle")
+
+    if not os.path.exists(file_path):
+        raise SkipStage("{} didn't run".format(stage))
+
+    with open(file_path, "rb") as result_file:
+        return pickle.load(result_file)
+
+
+# Each stage prepares what it needs and returns the function that is timed,
+# the results of the aggregation stages are saved for the chart stages.
+
+def write_submissions(files, options):
+    """Writes the synthetic submissions."""
+
+    return lambda: synthetic.generate_submissions(
+        files["submissions"], max(1, options["rows"] // 10), options["seed"])
+
+
+def write_comments(files, options):
+    """Writes the synthetic comments."""
+
+    return lambda: synthetic.generate_comments(
+        files["comments"], options["rows"], options["seed"])
+
+
+def write_tokens(files, options):
+    """Tokenizes the first synthetic comments."""
+
+    os.chdir(REPOSITORY_DIR)
+
+    return lambda: synthetic.generate_tokens(
+        files["comments"], files["tokens"], options["tokens_comments"], options["seed"])
+
+
+def load_csv(files, options):
+    """Loads the whole comments csv file."""
+
+    return lambda: pd.read_csv(files["comments"])
+
+
+def load_parquet(files, options):
+    """Loads the comments from a parquet file, it needs pyarrow."""
+
+    try:
+        import pyarrow
+    except ImportError:
+        raise SkipStage("pyarrow is not installed")
+
+    pd.read_csv(files["comments"]).to_parquet(files["parquet"])
+
+    return lambda: pd.read_parquet(files["parquet"])
+
+
+def run_nlp(files, options):
+    """Passes some comments into the step2.py NLP pipeline, it needs spaCy."""
+
+    import step2
+
+    try:
+        step2.load_model()
+    except ImportError:
+        raise SkipStage("spaCy is not installed")
+    except OSError:
+        raise SkipStage("{} is not installed".format(step2.MODEL))
+
+    df = pd.read_csv(files["comments"], nrows=NLP_COMMENTS, dtype="str", keep_default_na=False)
+    corpus = df[["id", "created_utc", "body"]].to_dict("records")
+
+    return lambda: step2.save_tokens(step2.extract_features(corpus)[0], file_path=files["nlp"])
+
+
+def aggregate_submissions(files, options):
+    """Aggregates the submissions csv file."""
+
+    return lambda: aggregates.read_activity_aggregates(files["submissions"])
+
+
+def aggregate_comments(files, options):
+    """Aggregates the comments csv file."""
+
+    return lambda: aggregates.read_activity_aggregates(files["comments"])
+
+
+def aggregate_tokens(files, options):
+    """Counts the lemmas of the tokens csv file."""
+
+    return lambda: aggregates.read_tokens_aggregates(files["tokens"])
+
+
+def aggregate_corpus(files, options):
+    """Counts the lemmas of the binary corpus (see tokencorpus.py)."""
+
+    import tokencorpus
+
+    tokencorpus.convert_tokens(files["tokens"], files["corpus"])
+
+    return lambda: tokencorpus.read_tokens_aggregates(files["corpus"])
+
+
+def aggregate_ngrams(files, options):
+    """Counts the n-grams of the tokens csv file."""
+
+    import ngrams
+
+    return lambda: ngrams.count_ngrams(files["tokens"])
+
+
+def get_startup_stage(module):
+    """Creates the stage that imports a script in a new interpreter.
+
+    Parameters
+    ----------
+    module : str
+        The name of the script, e.g. step3
+
+    Returns
+    -------
+    callable
+        The stage.
+
+    """
+
+    def startup(files, options):
+        """Times the import of the script, its heavy dependencies must be imported lazily."""
+
+        # The first import also compiles the bytecode, it is not timed.
+        eager = [name for name in LAZY_MODULES[module] if name in get_import_times(module)]
+
+        if len(eager) > 0:
+            raise RuntimeError("{} imports {} at startup".format(module, ", ".join(eager)))
+
+        return lambda: get_import_times(module)
+
+    return startup
+
+
+def get_chart_stage(figure):
+    """Creates the stage of a step3.py figure.
+
+    Parameters
+    ----------
+    figure : str
+        The name of the figure.
+
+    Returns
+    -------
+    callable
+        The stage.
+
+    """
+
+    def chart(files, options):
+        """Renders the figure from the saved aggregates."""
+
+        import step3
+
+        # The figures are saved to the work folder, the assets are in the repository.
+        for name in ["MASK_FILE", "FONT_FILE", "EN_STOPWORDS", "ES_STOPWORDS"]:
+            setattr(step3, name, os.path.join(REPOSITORY_DIR, getattr(step3, name)))
+
+        # The font is not included in the repository (see assets/font.txt),
+        # without it the word clouds use the default font.
+        if not os.path.exists(step3.FONT_FILE):
+            step3.FONT_FILE = None
+
+        os.chdir(options["work_dir"])
+
+        # matplotlib is imported before the timer starts, only the rendering is timed.
+        step3.get_pyplot()
+
+        function, keys = step3.FIGURES[figure]
+        data = {"timezone": step3.DISPLAY_TIMEZONE}
+
+        for key in keys:
+            if key != "timezone":
+                data[key] = load_result(options["work_dir"], "aggregate-" + key)
+
+        return lambda: function(*[data[key] for key in keys])
+
+    return chart
+
+
+# The stages in the order they run, the entities figure is not benchmarked
+# because the synthetic data doesn't have entities.
+STAGES = {
+    "startup-step2": get_startup_stage("step2"),
+    "startup-step3": get_startup_stage("step3"),
+    "write-submissions": write_submissions,
+    "write-comments": write_comments,
+    "write-tokens": write_tokens,
+    "load-csv": load_csv,
+    "load-parquet": load_parquet,
+    "nlp": run_nlp,
+    "aggregate-submissions": aggregate_submissions,
+    "aggregate-comments": aggregate_comments,
+    "aggregate-tokens": aggregate_tokens,
+    "aggregate-corpus": aggregate_corpus,
+    "aggregate-ngrams": aggregate_ngrams
+}
+
+for figure in ["weekday", "hour", "daily", "submissionsbyuser", "commentsbyuser", "words", "phrases"]:
+    STAGES["chart-" + figure] = get_chart_stage(figure)
+
+
+def run_stage(name, files, options):
+    """Runs one stage, this is called in a new process.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+
+    files : dict
+        The path of each file.
+
+    options : dict
+        The benchmark options.
+
+    Returns
+    -------
+    dict
+        The seconds and peak memory (MB) of the stage, or why it was skipped.
+
+    """
+
+    try:
+        function = STAGES[name](files, options)
+    except SkipStage as error:
+        return {"skipped": str(error)}
+
+    # Only the memory used by the timed part is measured, the peak of the setup is
+    # forgotten when it can be reset, otherwise the memory above it is measured.
+    if not reset_peak_memory():
+        _, before = get_memory()
+    else:
+        before, _ = get_memory()
+
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+
+    _, peak = get_memory()
+
+    # The aggregates are saved for the chart stages.
+    if name.startswith("aggregate-"):
+        with open(os.path.join(options["work_dir"], name + ".pickle"), "wb") as result_file:
+            pickle.dump(result, result_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    peak_mb = max(peak - before, 0.0) if peak is not None else None
+
+    return {"seconds": seconds, "peak_mb": peak_mb}
+
+
+def run_benchmark(stages, options):
+    """Runs the stages one after the other, each one in a new process.
+
+    Parameters
+    ----------
+    stages : list
+        The names of the stages.
+
+    options : dict
+        The benchmark options.
+
+    Returns
+    -------
+    dict
+        The results of each stage.
+
+    """
+
+    os.makedirs(options["work_dir"], exist_ok=True)
+    files = get_files(os.path.abspath(options["work_dir"]), options["extension"])
+    options = dict(options, work_dir=os.path.abspath(options["work_dir"]))
+
+    # A spawned process starts empty, a forked one would start with the
+    # memory of this process.
+    context = multiprocessing.get_context("spawn")
+    results = dict()
+
+    for name in stages:
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                results[name] = executor.submit(run_stage, name, files, options).result()
+            except Exception as error:
+                results[name] = {"failed": "{}: {}".format(type(error).__name__, error)}
+
+        if "seconds" in results[name]:
+            print("{}: {:.3f} seconds, {} MB".format(
+                name, results[name]["seconds"], round(results[name]["peak_mb"] or 0)))
+        else:
+            print("{}: {}".format(name, results[name].get("skipped") or results[name].get("failed")))
+
+    return results
+
+
+def compare_results(results, baseline, tolerance=TOLERANCE):
+    """Compares the results with a baseline.
+
+    Parameters
+    ----------
+    results : dict
+        The results of each stage.
+
+    baseline : dict
+        The baseline results of each stage.
+
+    tolerance : float
+        How much slower a stage can be before it is a regression.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The seconds and peak memory of each stage and its baseline,
+        the change in time and if it is a regression. A stage that
+        failed is always a regression.
+
+    """
+
+    rows = list()
+
+    for name, result in results.items():
+
+        base = baseline.get(name, dict())
+
+        if "failed" in result:
+            rows.append({"stage": name, "seconds": None, "baseline_seconds": base.get("seconds"),
+                         "change": None, "peak_mb": None, "baseline_peak_mb": base.get("peak_mb"),
+                         "regression": True})
+            continue
+
+        if "seconds" not in result or "seconds" not in base:
+            continue
+
+        difference = result["seconds"] - base["seconds"]
+
+        rows.append({"stage": name,
+                     "seconds": result["seconds"], "baseline_seconds": base["seconds"],
+                     "change": difference / base["seconds"] if base["seconds"] > 0 else 0.0,
+                     "peak_mb": result["peak_mb"], "baseline_peak_mb": base.get("peak_mb"),
+                     "regression": difference > max(base["seconds"] * tolerance, MIN_DIFFERENCE)})
+
+    return pd.DataFrame(rows, columns=["stage", "seconds", "baseline_seconds", "change",
+                                       "peak_mb", "baseline_peak_mb", "regression"]).set_index("stage")
+
+
+def main():
+    """Parses the command line arguments and runs the benchmark."""
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the pipeline stages on synthetic data.")
+
+    parser.add_argument("stages", nargs="*", metavar="stage",
+                        help="The stages to run (or their prefixes, e.g. chart), by default all of them: "
+                        + ", ".join(STAGES.keys()))
+
+    parser.add_argument("--rows", type=int, default=100000,
+                        help="The number of comments, there are 10 times fewer submissions.")
+
+    parser.add_argument("--tokens-comments", type=int, default=50000,
+                        help="How many comments are tokenized.")
+
+    parser.add_argument("--extension", default=".csv",
+                        help="The extension of the csv files, .csv.gz and .csv.zst are compressed.")
+
+    parser.add_argument("--seed", type=int, default=0,
+                        help="The random seed of the synthetic data.")
+
+    parser.add_argument("--work-dir", default="./benchmark",
+                        help="The folder where the synthetic data and the figures are saved.")
+
+    parser.add_argument("--save",
+                        help="Save the results to this json file, e.g. to use them as a baseline.")
+
+    parser.add_argument("--baseline",
+                        help="Compare the results with this json file, the exit code is 1 if there are regressions "
+                        "(the exit code is always 1 if a stage fails).")
+
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="How much slower (0.2 = 20%%) a stage can be before it is a regression.")
+
+    args = parser.parse_args()
+
+    stages = [name for name in STAGES if len(args.stages) == 0 or
+              any(name == stage or name.startswith(stage + "-") for stage in args.stages)]
+
+    if len(stages) == 0:
+        parser.error("no stages match: {}".format(", ".join(args.stages)))
+
+    options = {"rows": args.rows, "tokens_comments": args.tokens_comments,
+               "extension": args.extension, "seed": args.seed, "work_dir": args.work_dir}
+
+    results = run_benchmark(stages, options)
+
+    report = {"options": options, "python": platform.python_version(),
+              "platform": platform.platform(), "stages": results}
+
+    if args.save is not None:
+        with open(args.save, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
+
+        print("Saved:", args.save)
+
+    if args.baseline is not None:
+
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+
+        if baseline["options"]["rows"] != args.rows:
+            print("Warning: the baseline has {:,} rows".format(baseline["options"]["rows"]))
+
+        comparison = compare_results(results, baseline["stages"], args.tolerance)
+        print(comparison.to_string(float_format="{:.3f}".format))
+
+        if comparison["regression"].any():
+            sys.exit(1)
+
+    # A failed stage, e.g. a startup stage that found an eager import, fails the run.
+    failed = [name for name, result in results.items() if "failed" in result]
+
+    if len(failed) > 0:
+        print("Failed:", ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    main()
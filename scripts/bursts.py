@@ -0,0 +1,539 @@
+"""
+This script finds the days with unusual activity (spikes) in the submissions and comments
+and the lemmas and entities that drive them.
+
+Each day is compared with the days before it: its z-score is how many standard deviations it
+is above the mean of the previous WINDOW days. The same rolling z-scores are computed for the
+daily counts of every lemma and entity at once, they are columns of a day x term matrix, and
+the terms with the highest z-scores during a spike are the ones that burst with it.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import aggregates
+import cache
+import cooccurrence
+import fileio
+import metrics
+import tokencorpus
+from aggregates import DAY, intern
+
+
+# The default subreddit, its submissions and comments are read from
+# <subreddit>-submissions.csv and <subreddit>-comments.csv
+SUBREDDIT = "mexico"
+
+# How many previous days each day is compared with.
+WINDOW = 28
+
+# A day needs this many previous days before it can be a spike.
+MIN_HISTORY = 7
+
+# The z-score a day needs to be a spike, and a term to be bursting.
+THRESHOLD = 3.0
+
+# A term needs this many mentions during a spike to be reported.
+MIN_COUNT = 5
+
+# How many terms are scored at a time, this bounds the memory of the dense day x term blocks.
+BLOCK_SIZE = 1000
+
+
+def get_rolling_z_scores(counts, window=WINDOW, min_history=MIN_HISTORY):
+    """Computes the z-score of each day against the previous days, for all the columns at once.
+
+    The means and variances of every window come from cumulative sums,
+    there is no loop over the days or the columns.
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        The daily counts, one row for each day and one column for each series.
+
+    window : int
+        How many previous days each day is compared with, the day itself is not included.
+
+    min_history : int
+        The days with fewer previous days get a z-score of 0.
+
+    Returns
+    -------
+    numpy.ndarray
+        The z-scores, the same shape as the counts.
+
+    """
+
+    counts = np.asarray(counts, dtype="float64")
+    one_series = counts.ndim == 1
+
+    if one_series:
+        counts = counts[:, None]
+
+    zeros = np.zeros((1, counts.shape[1]))
+    sums = np.concatenate([zeros, np.cumsum(counts, axis=0)])
+    squares = np.concatenate([zeros, np.cumsum(counts ** 2, axis=0)])
+
+    # The window of day t are the days from t - window to t - 1.
+    days = np.arange(len(counts))
+    starts = np.maximum(days - window, 0)
+    history = (days - starts)[:, None]
+
+    mean = (sums[days] - sums[starts]) / np.maximum(history, 1)
+    variance = (squares[days] - squares[starts]) / np.maximum(history, 1) - mean ** 2
+
+    # A series that was always flat has no variance, the standard deviation
+    # is at least 1 so a handful of mentions of a new term is not a burst.
+    z_scores = (counts - mean) / np.sqrt(np.maximum(variance, 1.0))
+    z_scores[history[:, 0] < min_history] = 0.0
+
+    return z_scores[:, 0] if one_series else z_scores
+
+
+def find_spikes(daily, window=WINDOW, threshold=THRESHOLD, min_history=MIN_HISTORY):
+    """Finds the spikes of a daily series, consecutive spike days are a single spike.
+
+    Parameters
+    ----------
+    daily : pandas.Series
+        The counts by day, including the days without any records.
+
+    window : int
+        How many previous days each day is compared with.
+
+    threshold : float
+        The z-score a day needs to be a spike.
+
+    min_history : int
+        A day needs this many previous days before it can be a spike.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The first and last day of each spike, its peak day, the count and
+        the expected count (the mean of the previous days) of the peak
+        and the z-score of the peak.
+
+    """
+
+    columns = ["start", "end", "peak", "count", "expected", "z_score"]
+
+    if len(daily) == 0:
+        return pd.DataFrame(columns=columns)
+
+    z_scores = get_rolling_z_scores(daily.to_numpy(), window, min_history)
+    expected = daily.shift(1).rolling(window, min_periods=1).mean().fillna(0).to_numpy()
+
+    # Each run of consecutive spike days gets its own number.
+    is_spike = z_scores >= threshold
+    runs = np.cumsum(is_spike & ~np.concatenate([[False], is_spike[:-1]]))
+
+    rows = list()
+
+    for run in np.unique(runs[is_spike]):
+
+        positions = np.flatnonzero(is_spike & (runs == run))
+        peak = positions[np.argmax(z_scores[positions])]
+
+        rows.append({"start": daily.index[positions[0]], "end": daily.index[positions[-1]],
+                     "peak": daily.index[peak], "count": int(daily.iloc[peak]),
+                     "expected": expected[peak], "z_score": z_scores[peak]})
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+def get_activity_spikes(submissions, comments, window=WINDOW, threshold=THRESHOLD):
+    """Finds the spikes of the submissions and comments together.
+
+    Parameters
+    ----------
+    submissions : dict
+        The submissions aggregates.
+
+    comments : dict
+        The comments aggregates.
+
+    window : int
+        How many previous days each day is compared with.
+
+    threshold : float
+        The z-score a day needs to be a spike.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The spikes, see find_spikes().
+
+    """
+
+    daily = aggregates.get_daily_counts(submissions).add(
+        aggregates.get_daily_counts(comments), fill_value=0)
+
+    return find_spikes(daily.asfreq("D", fill_value=0), window, threshold)
+
+
+def print_activity_spikes(submissions, comments, window=WINDOW, threshold=THRESHOLD):
+    """Prints the days with unusual activity.
+
+    Parameters
+    ----------
+    submissions : dict
+        The submissions aggregates.
+
+    comments : dict
+        The comments aggregates.
+
+    window : int
+        How many previous days each day is compared with.
+
+    threshold : float
+        The z-score a day needs to be a spike.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The spikes, see find_spikes().
+
+    """
+
+    spikes = get_activity_spikes(submissions, comments, window, threshold)
+
+    print("Activity spikes (z-score >= {} against the previous {} days):\n".format(threshold, window))
+
+    if len(spikes) == 0:
+        print("None")
+        return spikes
+
+    df = spikes.copy()
+
+    for column in ["start", "end", "peak"]:
+        df[column] = df[column].dt.strftime("%Y-%m-%d")
+
+    print(df.round(2).to_string(index=False))
+
+    return spikes
+
+
+def read_lemma_series(file_path, chunksize=aggregates.CHUNK_SIZE):
+    """Reads the tokens csv file in chunks and counts each lemma by day.
+
+    We use the same lemmas as the tokens aggregates, the ones that are not
+    numbers, are not stop words and are longer than one character.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the tokens csv file, it must have the created_utc column.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    dict
+        The lemmas, the first day and the day x lemma counts matrix.
+
+    """
+
+    lemmas = dict()
+
+    lemma_ids = list()
+    days = list()
+
+    reader = pd.read_csv(file_path,
+                         usecols=["lemma_lower", "is_alphabet", "is_stopword", "created_utc"],
+                         dtype={"lemma_lower": "str"}, keep_default_na=False,
+                         chunksize=chunksize)
+
+    for df in reader:
+
+        df = df[
+            (df["is_alphabet"] == True) &
+            (df["is_stopword"] == False) &
+            (df["lemma_lower"].str.len() > 1)
+        ]
+
+        # The tokens of comments without a timestamp can't be placed on a day.
+        created_utc = pd.to_numeric(df["created_utc"], errors="coerce")
+        df = df[created_utc.notna()]
+
+        lemma_ids.append(intern(df["lemma_lower"], lemmas))
+        days.append(created_utc.dropna().to_numpy(dtype="int64") // DAY)
+        metrics.increment("rows_read_total", len(df), reader="lemma-series")
+
+    lemma_ids = np.concatenate(lemma_ids)
+    days = np.concatenate(days)
+
+    first_day = int(days.min()) if len(days) > 0 else 0
+
+    daily = sparse.csr_matrix(
+        (np.ones(len(lemma_ids), dtype="int64"), (days - first_day, lemma_ids)),
+        shape=(int(days.max()) - first_day + 1 if len(days) > 0 else 0, len(lemmas)))
+
+    return {"terms": pd.Index(list(lemmas.keys())), "first_day": first_day, "daily": daily}
+
+
+def read_corpus_series(directory, min_count=MIN_COUNT):
+    """Counts each lemma of a binary corpus by day (see tokencorpus.py).
+
+    Parameters
+    ----------
+    directory : str
+        The folder of the corpus.
+
+    min_count : int
+        The lemmas with fewer tokens are not counted.
+
+    Returns
+    -------
+    dict
+        The lemmas, the first day and the day x lemma counts matrix.
+
+    """
+
+    corpus = tokencorpus.load_corpus(directory)
+    mask = tokencorpus.get_word_mask(corpus)
+
+    counts = tokencorpus.get_lemma_counts(corpus, mask)
+    df = tokencorpus.get_daily_counts(corpus, list(counts[counts >= min_count].index), mask)
+
+    first_day = int(df.index[0].timestamp()) // DAY if len(df) > 0 else 0
+
+    return {"terms": df.columns, "first_day": first_day,
+            "daily": sparse.csr_matrix(df.to_numpy(dtype="int64"))}
+
+
+def load_term_series(kind, file_path, chunksize=aggregates.CHUNK_SIZE, cache_dir=cache.CACHE_DIR):
+    """Loads the daily counts of the lemmas or entities from the cache or computes them.
+
+    Parameters
+    ----------
+    kind : str
+        Either lemmas or entities.
+
+    file_path : str
+        The tokens csv file or corpus folder, or the entities csv file.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    cache_dir : str
+        The folder where the counts are memoized, None disables the cache.
+
+    Returns
+    -------
+    dict
+        The terms, the first day and the day x term counts matrix.
+
+    """
+
+    if kind == "entities":
+        index = cooccurrence.load_index(file_path, cache_dir)
+        return {"terms": index["entities"], "first_day": index["first_day"], "daily": index["daily"]}
+
+    if os.path.isdir(file_path):
+        return cache.load_or_compute("lemma-series", tokencorpus.get_corpus_files(file_path),
+                                     lambda: read_corpus_series(file_path), cache_dir=cache_dir)
+
+    return cache.load_or_compute("lemma-series", [file_path],
+                                 lambda: read_lemma_series(file_path, chunksize), cache_dir=cache_dir)
+
+
+def get_bursting_terms(series, spikes, window=WINDOW, threshold=THRESHOLD,
+                       min_count=MIN_COUNT, top=10):
+    """Finds the terms that burst during each spike.
+
+    The rolling z-scores of all the terms are computed at once, BLOCK_SIZE
+    terms at a time. The score of a term in a spike is its highest z-score
+    in the days of the spike.
+
+    Parameters
+    ----------
+    series : dict
+        The terms, the first day and the day x term counts matrix.
+
+    spikes : pandas.DataFrame
+        The spikes from find_spikes().
+
+    window : int
+        How many previous days each day is compared with.
+
+    threshold : float
+        The z-score a term needs to be bursting.
+
+    min_count : int
+        A term needs this many mentions during a spike.
+
+    top : int
+        The number of terms of each spike.
+
+    Returns
+    -------
+    list
+        A DataFrame for each spike with the z-score and count of its top terms.
+
+    """
+
+    daily = series["daily"].tocsc()
+    number_of_days = daily.shape[0]
+
+    dates = pd.to_datetime((series["first_day"] + np.arange(number_of_days)) * DAY,
+                           unit="s", utc=True)
+
+    # The days of each spike in the timeline of the terms, which can be shorter.
+    spike_days = [np.flatnonzero((dates >= start) & (dates <= end))
+                  for start, end in zip(spikes["start"], spikes["end"])]
+
+    # Only the terms that could reach min_count in a spike are scored.
+    totals = np.asarray(daily.sum(axis=0)).ravel()
+    candidates = np.flatnonzero(totals >= min_count)
+
+    results = [list() for _ in spike_days]
+
+    for start in range(0, len(candidates), BLOCK_SIZE):
+
+        columns = candidates[start:start + BLOCK_SIZE]
+        counts = daily[:, columns].toarray()
+        z_scores = get_rolling_z_scores(counts, window)
+
+        for results_list, days in zip(results, spike_days):
+
+            if len(days) == 0:
+                continue
+
+            best = z_scores[days].max(axis=0)
+            mentions = counts[days].sum(axis=0)
+            found = np.flatnonzero((best >= threshold) & (mentions >= min_count))
+
+            results_list.append(pd.DataFrame({"z_score": best[found], "count": mentions[found]},
+                                             index=series["terms"][columns[found]]))
+
+    terms = list()
+
+    for results_list in results:
+        df = pd.concat(results_list) if len(results_list) > 0 else \
+            pd.DataFrame({"z_score": pd.Series(dtype="float64"), "count": pd.Series(dtype="int64")})
+        terms.append(df.nlargest(top, "z_score"))
+
+    return terms
+
+
+def print_spikes_report(submissions, comments, term_files=None, chunksize=None,
+                        cache_dir=cache.CACHE_DIR, window=WINDOW, threshold=THRESHOLD,
+                        min_count=MIN_COUNT, top=10):
+    """Prints the days with unusual activity and the terms that burst during them.
+
+    Parameters
+    ----------
+    submissions : dict
+        The submissions aggregates.
+
+    comments : dict
+        The comments aggregates.
+
+    term_files : dict
+        The tokens csv file or corpus folder of the lemmas and the entities csv file,
+        the ones that don't exist are skipped.
+
+    chunksize : int
+        How many rows are read at a time, by default aggregates.CHUNK_SIZE.
+
+    cache_dir : str
+        The folder where the counts are memoized, None disables the cache.
+
+    window : int
+        How many previous days each day is compared with.
+
+    threshold : float
+        The z-score a day needs to be a spike, and a term to be bursting.
+
+    min_count : int
+        A term needs this many mentions during a spike.
+
+    top : int
+        The number of terms of each spike.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The spikes, see find_spikes().
+
+    """
+
+    spikes = print_activity_spikes(submissions, comments, window, threshold)
+
+    terms = dict()
+
+    for kind, file_path in (term_files or dict()).items():
+        if len(spikes) > 0 and file_path is not None and os.path.exists(file_path):
+            series = load_term_series(kind, file_path, chunksize or aggregates.CHUNK_SIZE, cache_dir)
+            terms[kind] = get_bursting_terms(series, spikes, window, threshold, min_count, top)
+
+    for position, spike in enumerate(spikes.itertuples()):
+        for kind, spike_terms in terms.items():
+            print("\nBursting {} from {:%Y-%m-%d} to {:%Y-%m-%d}:\n".format(kind, spike.start, spike.end))
+            print(spike_terms[position].round(2) if len(spike_terms[position]) > 0 else "None")
+
+    return spikes
+
+
+def main():
+    """Parses the command line arguments and prints the spikes and their bursting terms."""
+
+    parser = argparse.ArgumentParser(
+        description="Finds the activity spikes of a subreddit and the lemmas and entities that drive them.")
+
+    parser.add_argument("--subreddit", default=SUBREDDIT,
+                        help="The subreddit, its submissions and comments are read from "
+                        "<subreddit>-submissions.csv and <subreddit>-comments.csv")
+
+    parser.add_argument("--tokens", default="tokens.csv",
+                        help="The tokens csv file or corpus folder (see tokencorpus.py), skipped if it doesn't exist.")
+
+    parser.add_argument("--entities", default="entities.csv",
+                        help="The entities csv file, skipped if it doesn't exist.")
+
+    parser.add_argument("--window", type=int, default=WINDOW,
+                        help="How many previous days each day is compared with.")
+
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="The z-score a day needs to be a spike, and a term to be bursting.")
+
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT,
+                        help="A term needs this many mentions during a spike.")
+
+    parser.add_argument("--top", type=int, default=10,
+                        help="The number of terms of each spike.")
+
+    parser.add_argument("--chunksize", type=int, default=aggregates.CHUNK_SIZE,
+                        help="How many rows are read at a time.")
+
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always read the csv files.")
+
+    args = parser.parse_args()
+
+    cache_dir = None if args.no_cache else cache.CACHE_DIR
+
+    # The same cache names as step3.py, the aggregates are shared.
+    data = dict()
+
+    for name in ["submissions", "comments"]:
+        file_path = fileio.find_file("{}-{}.csv".format(args.subreddit, name))
+        data[name] = cache.load_or_compute(
+            name, [file_path], lambda: aggregates.read_activity_aggregates(file_path, args.chunksize),
+            cache_dir=cache_dir)
+
+    term_files = {"lemmas": fileio.find_file(args.tokens), "entities": fileio.find_file(args.entities)}
+
+    print_spikes_report(data["submissions"], data["comments"], term_files, args.chunksize, cache_dir,
+                        args.window, args.threshold, args.min_count, args.top)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,127 @@
+"""
+This script contains the functions that memoize intermediate results on disk.
+
+Each result is keyed by the fingerprints of the files it was computed from, so it is
+only computed again when one of those files changes.
+"""
+
+import hashlib
+import os
+import pickle
+
+import metrics
+
+
+CACHE_DIR = "./.cache"
+
+# Increase this number when the format of the cached results changes.
+CACHE_VERSION = 2
+
+
+def get_file_fingerprint(file_path):
+    """Gets a cheap fingerprint of a file without reading its contents.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    Returns
+    -------
+    str
+        The absolute path, size and modification time of the file.
+
+    """
+
+    stat = os.stat(file_path)
+
+    return "{}:{}:{}".format(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+
+def get_cache_key(name, file_paths, params=None):
+    """Gets the key of a result from the files and parameters it depends on.
+
+    Parameters
+    ----------
+    name : str
+        The name of the result.
+
+    file_paths : list
+        The paths of the files the result is computed from.
+
+    params : dict
+        Extra parameters that change the result.
+
+    Returns
+    -------
+    str
+        A hex digest that identifies the result.
+
+    """
+
+    key = hashlib.sha256()
+    key.update("{}:{}".format(name, CACHE_VERSION).encode("utf-8"))
+
+    for file_path in file_paths:
+        key.update(get_file_fingerprint(file_path).encode("utf-8"))
+
+    if params is not None:
+        key.update(repr(sorted(params.items())).encode("utf-8"))
+
+    return key.hexdigest()
+
+
+def load_or_compute(name, file_paths, function, params=None, cache_dir=CACHE_DIR):
+    """Loads a result from the cache or computes it and saves it to the cache.
+
+    Parameters
+    ----------
+    name : str
+        The name of the result.
+
+    file_paths : list
+        The paths of the files the result is computed from.
+
+    function : callable
+        A function without arguments that computes the result.
+
+    params : dict
+        Extra parameters that change the result.
+
+    cache_dir : str
+        The folder where the results are saved, None disables the cache.
+
+    Returns
+    -------
+    object
+        The result.
+
+    """
+
+    if cache_dir is None:
+        return function()
+
+    cache_file = os.path.join(cache_dir, "{}-{}.pickle".format(
+        name, get_cache_key(name, file_paths, params)))
+
+    if os.path.exists(cache_file):
+        metrics.increment("cache_lookups_total", dataset=name, result="hit")
+
+        with open(cache_file, "rb") as result_file:
+            return pickle.load(result_file)
+
+    metrics.increment("cache_lookups_total", dataset=name, result="miss")
+
+    result = function()
+
+    # We first write to a temporary file, this way an interrupted run
+    # never leaves a broken result in the cache.
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+
+    with open(temp_file, "wb") as result_file:
+        pickle.dump(result, result_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(temp_file, cache_file)
+
+    return result
@@ -0,0 +1,356 @@
+"""
+This script compares several subreddits, each one of them is aggregated in its own process
+with the same functions as step3.py (and the same cache) and the aggregates are compared.
+
+It creates an activity by hour figure with one line per subreddit, the author overlap
+matrices between subreddits and the most distinctive lemmas of each subreddit.
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import aggregates
+import cache
+import fileio
+import step3
+from aggregates import intern
+
+
+# The lemmas with fewer occurrences in all the subreddits are not ranked.
+MIN_COUNT = 5
+
+# These authors are not counted in the overlap matrices.
+EXCLUDED_AUTHORS = ["[deleted]", "AutoModerator"]
+
+
+def get_subreddit_files(subreddit, tokens=None):
+    """Gets the files of a subreddit, the same names as the step3.py defaults.
+
+    The tokens are read from the given file, or from <subreddit>-tokens.csv or the
+    <subreddit>-corpus folder (see tokencorpus.py), they are optional. The csv files
+    can also be compressed (see fileio.py).
+
+    Parameters
+    ----------
+    subreddit : str
+        The subreddit.
+
+    tokens : str
+        The tokens csv file or corpus folder of the subreddit.
+
+    Returns
+    -------
+    dict
+        The file of each dataset.
+
+    """
+
+    files = {name: fileio.find_file(step3.DATASETS[name][1].format(subreddit))
+             for name in ["submissions", "comments"]}
+
+    if tokens is not None:
+        candidates = [fileio.find_file(tokens)]
+    else:
+        candidates = [fileio.find_file("{}-tokens.csv".format(subreddit)), "{}-corpus".format(subreddit)]
+
+    for file_path in candidates:
+        if os.path.exists(file_path):
+            files["tokens"] = file_path
+
+    return files
+
+
+def load_subreddits(subreddits, chunksize=aggregates.CHUNK_SIZE, cache_dir=cache.CACHE_DIR,
+                    workers=None, tokens=None):
+    """Aggregates each subreddit in its own process.
+
+    Parameters
+    ----------
+    subreddits : list
+        The subreddits.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    cache_dir : str
+        The folder where the aggregates are memoized, None disables the cache.
+
+    workers : int
+        The number of processes to use.
+
+    tokens : dict
+        The tokens csv file or corpus folder of some subreddits.
+
+    Returns
+    -------
+    dict
+        The aggregates of each subreddit, the same as step3.load_data().
+
+    """
+
+    if tokens is None:
+        tokens = dict()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        futures = dict()
+
+        for subreddit in subreddits:
+            files = get_subreddit_files(subreddit, tokens.get(subreddit))
+            futures[subreddit] = executor.submit(
+                step3.load_data, list(files.keys()), files, chunksize, cache_dir)
+
+        return {subreddit: future.result() for subreddit, future in futures.items()}
+
+
+def get_author_overlap(data):
+    """Counts the authors that the subreddits have in common.
+
+    The authors are interned to integer ids and each subreddit is a row of a
+    sparse subreddit x author bitmap, the intersections of every pair of
+    subreddits are a single matrix product.
+
+    Parameters
+    ----------
+    data : dict
+        The aggregates of each subreddit.
+
+    Returns
+    -------
+    tuple
+        The number of authors in common and their Jaccard similarity,
+        both as subreddit x subreddit DataFrames.
+
+    """
+
+    subreddits = list(data.keys())
+    vocabulary = dict()
+
+    rows = list()
+    columns = list()
+
+    for position, subreddit in enumerate(subreddits):
+
+        authors = data[subreddit]["submissions"]["authors"].index.union(
+            data[subreddit]["comments"]["authors"].index)
+
+        authors = authors[~authors.isin(EXCLUDED_AUTHORS)]
+
+        columns.append(intern(pd.Series(authors, dtype="object"), vocabulary))
+        rows.append(np.full(len(authors), position))
+
+    bitmap = sparse.csr_matrix(
+        (np.ones(sum(len(ids) for ids in columns), dtype="int64"),
+         (np.concatenate(rows), np.concatenate(columns))),
+        shape=(len(subreddits), len(vocabulary)))
+
+    # The diagonal has the number of authors of each subreddit.
+    overlap = (bitmap @ bitmap.T).toarray()
+    sizes = overlap.diagonal()
+
+    jaccard = overlap / np.maximum(sizes[:, None] + sizes[None, :] - overlap, 1)
+
+    return (pd.DataFrame(overlap, index=subreddits, columns=subreddits),
+            pd.DataFrame(jaccard, index=subreddits, columns=subreddits))
+
+
+def get_distinctive_terms(data, top=20, min_count=MIN_COUNT):
+    """Ranks the lemmas that are most distinctive of each subreddit.
+
+    We use the log-odds ratio with an informative Dirichlet prior (Monroe et al.)
+    of each subreddit against the rest of them, the prior is the counts of
+    all the subreddits together.
+
+    Parameters
+    ----------
+    data : dict
+        The aggregates of each subreddit, the ones without tokens are skipped.
+
+    top : int
+        The number of lemmas of each subreddit.
+
+    min_count : int
+        The lemmas with fewer occurrences in all the subreddits are not ranked.
+
+    Returns
+    -------
+    dict
+        The z-scores and counts of the top lemmas of each subreddit.
+
+    """
+
+    counts = pd.DataFrame({subreddit: subreddit_data["tokens"]["lemmas"]
+                           for subreddit, subreddit_data in data.items()
+                           if "tokens" in subreddit_data}).fillna(0)
+
+    prior = counts.sum(axis=1)
+    counts = counts[prior >= min_count]
+    prior = prior[prior >= min_count].to_numpy()[:, None]
+
+    if len(counts.columns) < 2:
+        return dict()
+
+    # All the subreddits are scored at once, the rest is the prior minus the subreddit.
+    own = counts.to_numpy(dtype="float64")
+    rest = prior - own
+
+    own_total = own.sum(axis=0)
+    rest_total = rest.sum(axis=0)
+    prior_total = prior.sum()
+
+    delta = np.log((own + prior) / (own_total + prior_total - own - prior)) - \
+        np.log((rest + prior) / (rest_total + prior_total - rest - prior))
+
+    scores = pd.DataFrame(delta / np.sqrt(1 / (own + prior) + 1 / (rest + prior)),
+                          index=counts.index, columns=counts.columns)
+
+    terms = dict()
+
+    for subreddit in scores.columns:
+        best = scores[subreddit].nlargest(top)
+        terms[subreddit] = pd.DataFrame(
+            {"z_score": best, "count": counts.loc[best.index, subreddit].astype("int64")})
+
+    return terms
+
+
+def plot_activity_by_hour(data, timezone=step3.DISPLAY_TIMEZONE):
+    """Creates a line plot with the percentage of submissions and comments
+    by hour of the day, one line for each subreddit.
+
+    Parameters
+    ----------
+    data : dict
+        The aggregates of each subreddit.
+
+    timezone : str
+        The timezone used to get the hours.
+
+    """
+
+    plt = step3.get_pyplot()
+
+    fig, ax = plt.subplots()
+
+    for subreddit, subreddit_data in data.items():
+
+        hours = aggregates.get_hour_counts(subreddit_data["submissions"], timezone) + \
+            aggregates.get_hour_counts(subreddit_data["comments"], timezone)
+
+        ax.plot(hours.index, hours / max(hours.sum(), 1) * 100, linewidth=2, label=subreddit)
+
+    # We remove the top and right spines.
+    ax.spines["top"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+
+    ax.set_xticks(range(0, 24))
+    ax.set_xticklabels(["{:02d}:00".format(hour) for hour in range(0, 24)], rotation=45)
+
+    # We add final customizations.
+    ax.set_xlabel("Hour of the Day")
+    ax.set_ylabel("Percentage")
+    ax.set_title("Submissions and comments by Hour")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig("comparisonbyhour.png", facecolor="#222222")
+    plt.close(fig)
+
+
+def plot_author_overlap(jaccard):
+    """Creates a heatmap with the Jaccard similarity of the authors of each pair of subreddits.
+
+    Parameters
+    ----------
+    jaccard : pandas.DataFrame
+        The subreddit x subreddit Jaccard similarities.
+
+    """
+
+    # get_pyplot() also selects the Agg backend and the plots style for seaborn.
+    plt = step3.get_pyplot()
+    import seaborn as sns
+
+    fig, ax = plt.subplots()
+
+    sns.heatmap(jaccard * 100, annot=True, fmt=".1f", cmap="viridis",
+                linewidths=0, ax=ax, cbar_kws={"label": "Percentage"})
+
+    ax.set_title("Authors in Common")
+    fig.tight_layout()
+    fig.savefig("authoroverlap.png", facecolor="#222222")
+    plt.close(fig)
+
+
+def main():
+    """Parses the command line arguments and compares the subreddits."""
+
+    parser = argparse.ArgumentParser(
+        description="Compares the activity, authors and lemmas of several subreddits.")
+
+    parser.add_argument("subreddits", nargs="+",
+                        help="The subreddits, their files are <subreddit>-submissions.csv, "
+                        "<subreddit>-comments.csv and optionally <subreddit>-tokens.csv")
+
+    parser.add_argument("--tokens", nargs="+", metavar="file",
+                        help="The tokens csv file or corpus folder of each subreddit, in the same order, "
+                        "e.g. the tokens.csv of step2.py.")
+
+    parser.add_argument("--top", type=int, default=20,
+                        help="The number of distinctive lemmas of each subreddit.")
+
+    parser.add_argument("--timezone", default=step3.DISPLAY_TIMEZONE,
+                        help="The timezone used for the activity by hour plot.")
+
+    parser.add_argument("--workers", type=int,
+                        help="How many processes are used to aggregate the subreddits.")
+
+    parser.add_argument("--chunksize", type=int, default=aggregates.CHUNK_SIZE,
+                        help="How many rows are read at a time.")
+
+    parser.add_argument("--cache-dir", default=cache.CACHE_DIR,
+                        help="The folder where the aggregates are memoized.")
+
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always read the csv files.")
+
+    args = parser.parse_args()
+
+    tokens = dict()
+
+    if args.tokens is not None:
+
+        if len(args.tokens) != len(args.subreddits):
+            parser.error("--tokens needs one file for each subreddit")
+
+        tokens = dict(zip(args.subreddits, args.tokens))
+
+    data = load_subreddits(args.subreddits, args.chunksize,
+                           None if args.no_cache else args.cache_dir, args.workers, tokens)
+
+    plot_activity_by_hour(data, args.timezone)
+
+    overlap, jaccard = get_author_overlap(data)
+    plot_author_overlap(jaccard)
+
+    print("Authors in common:\n")
+    print(overlap)
+    print("\nJaccard similarity:\n")
+    print(jaccard.round(3))
+
+    for subreddit, subreddit_data in data.items():
+        if "tokens" not in subreddit_data:
+            print("\nNo tokens for {}, its distinctive lemmas are skipped (see --tokens).".format(subreddit))
+
+    for subreddit, terms in get_distinctive_terms(data, args.top).items():
+        print("\nDistinctive lemmas of {}:\n".format(subreddit))
+        print(terms)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,255 @@
+"""
+This script builds an index of which entities are mentioned together in the same comment
+and how many times each entity is mentioned per day, from the entities csv file of step2.py
+
+Both are sparse matrices built in one pass over the file, the related entities of any
+entity are then a single row of the co-occurrence matrix.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import aggregates
+import cache
+from aggregates import DAY, intern
+
+
+def drop_unlinked_rows(df, file_path):
+    """Drops the rows that are not linked to a comment.
+
+    The files written before the comment_id and created_utc columns were
+    filled have empty values, all of their rows would become a single comment.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        A chunk of the tokens or entities csv file.
+
+    file_path : str
+        The path of the file, it is shown in the message.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The rows with a comment id and a numeric created_utc.
+
+    """
+
+    created_utc = pd.to_numeric(df["created_utc"], errors="coerce")
+    linked = (df["comment_id"] != "") & created_utc.notna()
+
+    if not linked.all():
+        print("Skipped {:,} rows of {} without comment_id or created_utc, run step2.py again to link them.".format(
+            int((~linked).sum()), file_path))
+
+    df = df[linked].copy()
+    df["created_utc"] = created_utc[linked].astype("int64")
+
+    return df
+
+
+def build_index(file_path, labels=aggregates.ENTITY_LABELS, chunksize=aggregates.CHUNK_SIZE):
+    """Builds the co-occurrence matrix and daily series of the entities.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the entities csv file, it must have the comment_id
+        and created_utc columns.
+
+    labels : list
+        Only use the entities with these labels.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    dict
+        The entities names, the entity x entity co-occurrence matrix,
+        the first day and the day x entity counts matrix.
+
+    """
+
+    entities = dict()
+    comments = dict()
+
+    entity_ids = list()
+    comment_ids = list()
+    days = list()
+
+    reader = pd.read_csv(file_path,
+                         usecols=["text_lower", "label",
+                                  "comment_id", "created_utc"],
+                         dtype={"text_lower": "str", "comment_id": "str"},
+                         keep_default_na=False, chunksize=chunksize)
+
+    # We only keep 3 integer arrays in memory, the strings are interned.
+    for df in reader:
+
+        df = df[(df["label"].isin(labels)) & (df["text_lower"].str.len() > 1)]
+        df = drop_unlinked_rows(df, file_path)
+
+        entity_ids.append(intern(df["text_lower"], entities))
+        comment_ids.append(intern(df["comment_id"], comments))
+        days.append(df["created_utc"].to_numpy(dtype="int64") // DAY)
+
+    entity_ids = np.concatenate(entity_ids)
+    comment_ids = np.concatenate(comment_ids)
+    days = np.concatenate(days)
+
+    # The comment x entity matrix, an entity mentioned twice in the
+    # same comment is only counted once.
+    mentions = sparse.csr_matrix(
+        (np.ones(len(entity_ids), dtype="int64"), (comment_ids, entity_ids)),
+        shape=(len(comments), len(entities)))
+
+    mentions.data[:] = 1
+
+    # The diagonal has the number of comments that mention each entity.
+    cooccurrence = (mentions.T @ mentions).tocsr()
+
+    first_day = int(days.min()) if len(days) > 0 else 0
+
+    daily = sparse.csr_matrix(
+        (np.ones(len(entity_ids), dtype="int64"), (days - first_day, entity_ids)),
+        shape=(int(days.max()) - first_day + 1 if len(days) > 0 else 0, len(entities)))
+
+    return {"entities": pd.Index(list(entities.keys())), "cooccurrence": cooccurrence,
+            "first_day": first_day, "daily": daily}
+
+
+def load_index(file_path, cache_dir=cache.CACHE_DIR):
+    """Loads the index from the cache or builds it.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the entities csv file.
+
+    cache_dir : str
+        The folder where the index is memoized, None disables the cache.
+
+    Returns
+    -------
+    dict
+        The entities index.
+
+    """
+
+    return cache.load_or_compute("cooccurrence", [file_path],
+                                 lambda: build_index(file_path), cache_dir=cache_dir)
+
+
+def get_related_entities(index, entity, top=20):
+    """Gets the entities that are most often mentioned with an entity.
+
+    Parameters
+    ----------
+    index : dict
+        The entities index.
+
+    entity : str
+        The entity, the search is case insensitive.
+
+    top : int
+        The number of related entities.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The number of comments that mention both entities and their
+        Jaccard similarity, sorted by the number of comments.
+
+    """
+
+    position = index["entities"].get_loc(entity.lower())
+    cooccurrence = index["cooccurrence"]
+    frequencies = cooccurrence.diagonal()
+
+    row = cooccurrence.getrow(position)
+    columns = row.indices[row.indices != position]
+    counts = row.data[row.indices != position]
+
+    # We only sort the top values instead of the whole row.
+    if len(counts) > top:
+        best = np.argpartition(-counts, top)[:top]
+        columns = columns[best]
+        counts = counts[best]
+
+    jaccard = counts / (frequencies[position] + frequencies[columns] - counts)
+
+    df = pd.DataFrame({"comments": counts, "jaccard": jaccard},
+                      index=index["entities"][columns])
+
+    return df.sort_values("comments", ascending=False)
+
+
+def get_entity_series(index, entity):
+    """Gets the daily mentions of an entity.
+
+    Parameters
+    ----------
+    index : dict
+        The entities index.
+
+    entity : str
+        The entity, the search is case insensitive.
+
+    Returns
+    -------
+    pandas.Series
+        The mentions by day (UTC), including the days without mentions.
+
+    """
+
+    position = index["entities"].get_loc(entity.lower())
+    daily = index["daily"]
+
+    dates = pd.to_datetime((index["first_day"] + np.arange(daily.shape[0])) * DAY,
+                           unit="s", utc=True)
+
+    return pd.Series(daily.getcol(position).toarray().ravel(), index=dates)
+
+
+def main():
+    """Parses the command line arguments and prints the related entities."""
+
+    parser = argparse.ArgumentParser(
+        description="Prints the entities mentioned together with the given entities.")
+
+    parser.add_argument("entities", nargs="+",
+                        help="The entities to look for.")
+
+    parser.add_argument("--file", default="entities.csv",
+                        help="The entities csv file.")
+
+    parser.add_argument("--top", type=int, default=20,
+                        help="The number of related entities.")
+
+    parser.add_argument("--daily", action="store_true",
+                        help="Also print the daily mentions of each entity.")
+
+    args = parser.parse_args()
+
+    index = load_index(args.file)
+
+    for entity in args.entities:
+
+        if entity.lower() not in index["entities"]:
+            print("Not found:", entity)
+            continue
+
+        print("\nRelated to {}:\n".format(entity))
+        print(get_related_entities(index, entity, args.top))
+
+        if args.daily:
+            print(get_entity_series(index, entity).to_string())
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,505 @@
+"""
+This script finds copy-pasted, bot and other duplicated comments before they are sent
+to the NLP pipeline of step2.py
+
+Exact duplicates are found by hashing the normalized comment bodies, near duplicates are
+found with MinHash signatures and LSH banding. The signatures are computed in parallel
+over chunks of the comments csv file and reduced to one key per band, the keys are added
+to the buckets of each band as they arrive. The duplicates are saved to a report that
+step2.py can use to drop or down-weight them (see its --dedup option).
+"""
+
+import argparse
+import csv
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import fileio
+
+
+# The number of MinHash values of each comment, split in BANDS bands of ROWS values.
+# Two comments become candidates when all the values of one band are equal, with
+# 16 bands of 4 rows the pairs with a Jaccard similarity over 0.5 are very likely found.
+BANDS = 16
+ROWS = 4
+
+# The candidates with a lower estimated Jaccard similarity are not duplicates, it is
+# estimated from the number of bands where they are in the same bucket.
+THRESHOLD = 0.8
+
+# The number of words of each shingle.
+SHINGLE_SIZE = 3
+
+# Shorter comments (e.g. 'gracias' or 'jajaja') are never marked as duplicates.
+MIN_LENGTH = 30
+
+# The parameters of the hash functions, they are fixed so the signatures
+# of different runs and chunks can be compared.
+RANDOM_STATE = np.random.RandomState(42)
+HASH_A = RANDOM_STATE.randint(1, 2 ** 63, size=BANDS * ROWS, dtype="int64").astype("uint64") | np.uint64(1)
+HASH_B = RANDOM_STATE.randint(0, 2 ** 63, size=BANDS * ROWS, dtype="int64").astype("uint64")
+
+
+def normalize(body):
+    """Normalizes a comment body so small differences don't matter.
+
+    Parameters
+    ----------
+    body : str
+        The comment body.
+
+    Returns
+    -------
+    str
+        The body in lowercase, without links and with single spaces.
+
+    """
+
+    body = re.sub(r"https?://\S+", " ", body.lower())
+
+    return " ".join(re.findall(r"\w+", body))
+
+
+def get_signatures(bodies, min_length=MIN_LENGTH):
+    """Computes the exact hashes and MinHash signatures of many comments.
+
+    Parameters
+    ----------
+    bodies : list
+        The comment bodies.
+
+    min_length : int
+        Shorter comments (after normalizing them) are skipped.
+
+    Returns
+    -------
+    tuple
+        Which bodies were long enough, the exact hash of each one of them
+        and a (len(hashes), BANDS * ROWS) array with their MinHash signatures.
+
+    """
+
+    bodies = [normalize(body) for body in bodies]
+    long_enough = np.array([len(body) >= min_length for body in bodies], dtype="bool")
+    bodies = [body for body in bodies if len(body) >= min_length]
+
+    if len(bodies) == 0:
+        return long_enough, np.empty(0, dtype="uint64"), np.empty((0, BANDS * ROWS), dtype="uint32")
+
+    exact = pd.util.hash_array(np.array(bodies, dtype="object"))
+
+    # We get the shingles of all the comments in a single flat list,
+    # the offsets tell where the shingles of each comment start.
+    shingles = list()
+    offsets = list()
+
+    for body in bodies:
+
+        words = body.split()
+        offsets.append(len(shingles))
+
+        if len(words) <= SHINGLE_SIZE:
+            shingles.append(body)
+        else:
+            shingles.extend(" ".join(words[i:i + SHINGLE_SIZE])
+                            for i in range(len(words) - SHINGLE_SIZE + 1))
+
+    shingle_hashes = pd.util.hash_array(np.array(shingles, dtype="object"))
+
+    signatures = np.empty((len(bodies), BANDS * ROWS), dtype="uint32")
+
+    # Each hash function is a multiply-shift hash, the minimum of each
+    # comment is taken with a single reduceat() call.
+    for i in range(BANDS * ROWS):
+        values = (shingle_hashes * HASH_A[i] + HASH_B[i]) >> np.uint64(32)
+        signatures[:, i] = np.minimum.reduceat(values, offsets).astype("uint32")
+
+    return long_enough, exact, signatures
+
+
+def find_root(parents, node):
+    """Finds the representative of a cluster in the union-find forest.
+
+    Parameters
+    ----------
+    parents : dict
+        The parent of each node, it is compressed in place.
+
+    node : int
+        The node.
+
+    Returns
+    -------
+    int
+        The representative node.
+
+    """
+
+    root = node
+
+    while parents.get(root, root) != root:
+        root = parents[root]
+
+    while node != root:
+        parents[node], node = root, parents.get(node, node)
+
+    return root
+
+
+def get_band_keys(bodies, min_length=MIN_LENGTH):
+    """Computes the exact hashes and the LSH band keys of many comments.
+
+    Only the keys leave the worker processes, the signatures are reduced
+    to one 32-bit key for each band as soon as they are computed.
+
+    Parameters
+    ----------
+    bodies : list
+        The comment bodies.
+
+    min_length : int
+        Shorter comments (after normalizing them) are skipped.
+
+    Returns
+    -------
+    tuple
+        Which bodies were long enough, the exact hash of each one of them
+        and a (len(hashes), BANDS) array with their band keys.
+
+    """
+
+    long_enough, exact, signatures = get_signatures(bodies, min_length)
+
+    keys = np.empty((len(signatures), BANDS), dtype="uint32")
+
+    for band in range(BANDS):
+        keys[:, band] = pd.util.hash_pandas_object(pd.DataFrame(
+            signatures[:, band * ROWS:(band + 1) * ROWS]), index=False).to_numpy().astype("uint32")
+
+    return long_enough, exact, keys
+
+
+def assign_buckets(table, keys, rows):
+    """Finds the first row of the bucket of each key and adds the new buckets to the table.
+
+    Parameters
+    ----------
+    table : tuple
+        The sorted keys of the known buckets and the row of the first
+        comment of each one.
+
+    keys : numpy.ndarray
+        The keys of the new comments.
+
+    rows : numpy.ndarray
+        The rows of the new comments, in increasing order.
+
+    Returns
+    -------
+    tuple
+        The first row of the bucket of each new comment and the updated table.
+
+    """
+
+    table_keys, table_rows = table
+
+    unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    # We look up the keys with a binary search, the new ones are inserted in order.
+    positions = np.searchsorted(table_keys, unique)
+    found = positions < len(table_keys)
+    found[found] = table_keys[positions[found]] == unique[found]
+
+    owners = rows[first]
+    owners[found] = table_rows[positions[found]]
+
+    table = (np.insert(table_keys, positions[~found], unique[~found]),
+             np.insert(table_rows, positions[~found], owners[~found]))
+
+    return owners[inverse], table
+
+
+def get_near_duplicates(buckets, keys, rows, threshold=THRESHOLD):
+    """Adds a chunk of comments to the LSH buckets and finds their near duplicates.
+
+    Each comment is paired with the first comment of each one of its buckets,
+    the similarity of a pair is estimated from the share of bands where they
+    are in the same bucket: two comments with a Jaccard similarity s share
+    a band with a probability of s ** ROWS.
+
+    Parameters
+    ----------
+    buckets : list
+        The bucket table of each band, see assign_buckets(). It is updated in place.
+
+    keys : numpy.ndarray
+        The band keys of the comments.
+
+    rows : numpy.ndarray
+        The rows of the comments.
+
+    threshold : float
+        The minimum estimated Jaccard similarity.
+
+    Returns
+    -------
+    tuple
+        The rows of the first and second comments of each pair.
+
+    """
+
+    firsts = list()
+    seconds = list()
+
+    for band in range(BANDS):
+
+        owners, buckets[band] = assign_buckets(buckets[band], keys[:, band], rows)
+        paired = owners != rows
+
+        firsts.append(owners[paired])
+        seconds.append(rows[paired])
+
+    pairs = pd.DataFrame({"first": np.concatenate(firsts), "second": np.concatenate(seconds)})
+    bands = pairs.value_counts()
+
+    similarity = (bands.to_numpy() / BANDS) ** (1 / ROWS)
+    pairs = bands.index.to_frame(index=False)[similarity >= threshold]
+
+    return pairs["first"].to_numpy(dtype="int64"), pairs["second"].to_numpy(dtype="int64")
+
+
+def find_duplicates(file_path, workers=None, chunksize=100000, min_length=MIN_LENGTH,
+                    threshold=THRESHOLD):
+    """Finds the exact and near duplicates of a comments csv file.
+
+    The comments are added to the exact and LSH buckets one chunk at a time,
+    only the bucket tables and the duplicates found so far are kept in memory.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the comments csv file.
+
+    workers : int
+        The number of processes that compute the signatures.
+
+    chunksize : int
+        How many comments are sent to each process at a time.
+
+    min_length : int
+        Shorter comments are never marked as duplicates.
+
+    threshold : float
+        The minimum estimated Jaccard similarity of near duplicates.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row for each comment that belongs to a cluster of duplicates
+        with its row number, id, cluster (the row of the comment that is
+        kept), kind (first, exact or near) and the size of its cluster.
+
+    """
+
+    # The buckets of the exact hashes and of each band, the rows are stored as
+    # 32-bit numbers, half the memory of the signatures they replace.
+    exact_table = [(np.empty(0, dtype="uint64"), np.empty(0, dtype="uint32"))]
+    buckets = [(np.empty(0, dtype="uint32"), np.empty(0, dtype="uint32")) for _ in range(BANDS)]
+
+    # The exact duplicates and their first comment, and the near duplicate pairs.
+    exact_rows = list()
+    exact_clusters = list()
+    near_firsts = list()
+    near_seconds = list()
+
+    reader = pd.read_csv(file_path, usecols=["body"], dtype="str",
+                         keep_default_na=False, chunksize=chunksize)
+
+    def collect(pending):
+        """Waits for the oldest chunk and adds it to the buckets."""
+
+        future, chunk_rows = pending.popleft()
+        long_enough, exact, keys = future.result()
+
+        rows = chunk_rows[long_enough].astype("uint32")
+
+        # The exact duplicates are grouped first, only the first comment
+        # of each group is compared with the rest of the comments.
+        owners, exact_table[0] = assign_buckets(exact_table[0], exact, rows)
+        duplicated = owners != rows
+
+        exact_rows.append(rows[duplicated])
+        exact_clusters.append(owners[duplicated])
+
+        firsts, seconds = get_near_duplicates(buckets, keys[~duplicated], rows[~duplicated], threshold)
+        near_firsts.append(firsts)
+        near_seconds.append(seconds)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        # Only a few chunks are sent to the processes at a time, this way
+        # the comment bodies don't pile up in memory.
+        pending = deque()
+        max_pending = 2 * (workers or os.cpu_count())
+        offset = 0
+
+        for df in reader:
+
+            pending.append((executor.submit(get_band_keys, df["body"].tolist(), min_length),
+                            np.arange(offset, offset + len(df))))
+
+            offset += len(df)
+
+            if len(pending) >= max_pending:
+                collect(pending)
+
+        while len(pending) > 0:
+            collect(pending)
+
+    exact_rows = np.concatenate(exact_rows).astype("int64")
+    exact_clusters = np.concatenate(exact_clusters).astype("int64")
+
+    parents = dict()
+
+    for first, second in zip(np.concatenate(near_firsts), np.concatenate(near_seconds)):
+        parents[find_root(parents, second)] = find_root(parents, first)
+
+    # Every comment of a cluster, the exact duplicates are in the cluster of their first comment.
+    rows = np.unique(np.concatenate([exact_rows, exact_clusters, list(parents.keys()),
+                                     list(parents.values())]).astype("int64"))
+
+    first_rows = pd.Series(exact_clusters, index=exact_rows).reindex(rows)
+    first_rows = first_rows.fillna(pd.Series(rows, index=rows)).to_numpy(dtype="int64")
+
+    # Only the comments linked to a near duplicate change their cluster.
+    clusters = np.array([find_root(parents, row) for row in first_rows], dtype="int64")
+
+    df = pd.DataFrame({"row": rows, "id": read_ids(file_path, rows, chunksize), "cluster": clusters,
+                       "kind": np.where(clusters == first_rows, "exact", "near")})
+
+    df["size"] = df.groupby("cluster")["row"].transform("size")
+    df = df[df["size"] > 1]
+
+    # The first comment of each cluster is the one that is kept.
+    df.loc[df["row"] == df["cluster"], "kind"] = "first"
+
+    return df.sort_values(["size", "cluster", "row"], ascending=[False, True, True])
+
+
+def read_ids(file_path, rows, chunksize=100000):
+    """Reads the ids of some comments, the ones in the duplicates report.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the comments csv file.
+
+    rows : numpy.ndarray
+        The sorted row numbers of the comments.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    numpy.ndarray
+        The id of each comment, empty when the file has no id column.
+
+    """
+
+    ids = np.full(len(rows), "", dtype="object")
+
+    if len(rows) == 0:
+        return ids
+
+    offset = 0
+
+    for df in pd.read_csv(file_path, usecols=lambda column: column == "id", dtype="str",
+                          keep_default_na=False, chunksize=chunksize):
+
+        if "id" not in df.columns:
+            break
+
+        found = (rows >= offset) & (rows < offset + len(df))
+        ids[found] = df["id"].to_numpy()[rows[found] - offset]
+        offset += len(df)
+
+    return ids
+
+
+def read_report(file_path, mode):
+    """Reads a duplicates report and gets the weight of each comment.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the report.
+
+    mode : str
+        With 'drop' only the first comment of each cluster is kept, with
+        'weight' each comment of a cluster gets a weight of 1 / cluster size.
+
+    Returns
+    -------
+    dict
+        The weight of each duplicated comment keyed by its row number,
+        the comments that are not in the report have a weight of 1.
+
+    """
+
+    df = pd.read_csv(file_path, usecols=["row", "kind", "size"])
+
+    if mode == "drop":
+        weights = np.where(df["kind"] == "first", 1.0, 0.0)
+    else:
+        weights = 1 / df["size"].to_numpy()
+
+    return dict(zip(df["row"].tolist(), weights.tolist()))
+
+
+def main():
+    """Parses the command line arguments and saves the duplicates report."""
+
+    parser = argparse.ArgumentParser(
+        description="Finds exact and near duplicate comments with MinHash and LSH.")
+
+    parser.add_argument("file", nargs="?", default="mexico-comments.csv",
+                        help="The comments csv file.")
+
+    parser.add_argument("--report", default="mexico-dedup.csv",
+                        help="The duplicates report file.")
+
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="The minimum estimated Jaccard similarity of near duplicates.")
+
+    parser.add_argument("--min-length", type=int, default=MIN_LENGTH,
+                        help="Shorter comments are never marked as duplicates.")
+
+    parser.add_argument("--workers", type=int,
+                        help="The number of processes that compute the signatures.")
+
+    parser.add_argument("--chunksize", type=int, default=100000,
+                        help="How many comments are sent to each process at a time.")
+
+    args = parser.parse_args()
+
+    df = find_duplicates(args.file, args.workers, args.chunksize,
+                         args.min_length, args.threshold)
+
+    df.to_csv(args.report, index=False, quoting=csv.QUOTE_MINIMAL,
+              compression=fileio.get_pandas_compression(args.report))
+
+    print("Exact duplicates:", (df["kind"] == "exact").sum())
+    print("Near duplicates:", (df["kind"] == "near").sum())
+    print("Clusters:", df["cluster"].nunique())
+    print("Saved:", args.report)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,139 @@
+"""
+This script contains the functions that open the csv files of the pipeline, the compression
+is chosen by the file extension: .gz uses gzip, .zst uses Zstandard and any other extension
+is not compressed.
+
+The files are compressed and decompressed on the fly while they are written and read,
+no temporary files are created. pandas already does the same when reading, the chunked
+readers only need the path of the compressed file.
+"""
+
+import gzip
+import io
+import os
+
+
+# The gzip level, 6 is much faster than the default (9) and almost as small.
+GZIP_LEVEL = 6
+
+# The Zstandard level and the number of compression threads, -1 uses all the cores.
+ZSTD_LEVEL = 3
+ZSTD_THREADS = -1
+
+# The compression of each extension.
+EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+
+
+def get_compression(file_path):
+    """Gets the compression of a file from its extension.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    Returns
+    -------
+    str
+        Either gzip, zstd or None.
+
+    """
+
+    return EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+
+
+def find_file(file_path):
+    """Finds a file or its compressed version.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the uncompressed file, e.g. mexico-comments.csv
+
+    Returns
+    -------
+    str
+        The first path that exists of the file, the file plus .zst and
+        the file plus .gz, or the original path when none of them exists.
+
+    """
+
+    for path in [file_path] + [file_path + extension for extension in EXTENSIONS]:
+        if os.path.exists(path):
+            return path
+
+    return file_path
+
+
+def open_text(file_path, mode="r"):
+    """Opens a text file, compressed or not, for reading, writing or appending.
+
+    Appending to a compressed file adds a new gzip member or Zstandard frame,
+    both are read as a single stream. The file must be closed (a 'with' block)
+    so the end of the compressed stream is written.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    mode : str
+        Either r, w or a.
+
+    Returns
+    -------
+    io.TextIOBase
+        The file object, in UTF-8 and without newline translation so it
+        can be used with the csv module.
+
+    """
+
+    compression = get_compression(file_path)
+
+    if compression == "gzip":
+        return gzip.open(file_path, mode + "t", compresslevel=GZIP_LEVEL,
+                         encoding="utf-8", newline="")
+
+    if compression == "zstd":
+
+        # Zstandard is optional, it is only needed for .zst files.
+        import zstandard
+
+        raw_file = open(file_path, mode + "b")
+
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                raw_file, read_across_frames=True, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS).stream_writer(
+                raw_file, closefd=True)
+
+        return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+    return open(file_path, mode, encoding="utf-8", newline="")
+
+
+def get_pandas_compression(file_path):
+    """Gets the compression argument of DataFrame.to_csv() for a file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    Returns
+    -------
+    dict
+        The same compression settings as open_text().
+
+    """
+
+    compression = get_compression(file_path)
+
+    if compression == "gzip":
+        return {"method": "gzip", "compresslevel": GZIP_LEVEL}
+
+    if compression == "zstd":
+        return {"method": "zstd", "level": ZSTD_LEVEL, "threads": ZSTD_THREADS}
+
+    return None
@@ -0,0 +1,439 @@
+"""
+This script builds an index of the links posted in the submissions csv file: how many times
+each domain is posted per day, which domains each author posts and which urls are posted
+more than once.
+
+The domains and authors are interned to integer ids in one pass over the file and the daily
+series and author profiles are sparse matrices. The urls are not kept as strings, each one is
+reduced to a 64-bit hash of its normalized form and the repeated urls are found by grouping
+the hashes, only their text is read again at the end.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import aggregates
+import cache
+import fileio
+from aggregates import DAY, intern
+
+
+# The default subreddit, its submissions are read from ./<subreddit>-submissions.csv
+SUBREDDIT = "mexico"
+
+# The self posts don't link to anything.
+EXCLUDED_DOMAINS = ["self-post"]
+
+# The scheme, the www. prefix, the case of the host, the fragment and the trailing
+# slash don't change where a url points to, they are removed before hashing it.
+URL_PATTERN = r"^\s*(?:[A-Za-z][A-Za-z0-9+.-]*://)?(?:www\.)?([^/?#]*)([^#]*)"
+
+
+def hash_urls(urls):
+    """Normalizes the urls and hashes them.
+
+    Parameters
+    ----------
+    urls : pandas.Series
+        The urls.
+
+    Returns
+    -------
+    numpy.ndarray
+        The 64-bit hash of each url.
+
+    """
+
+    parts = urls.fillna("").str.extract(URL_PATTERN).fillna("")
+    normalized = parts[0].str.lower() + parts[1].str.rstrip("/")
+
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+
+def build_index(file_path, chunksize=aggregates.CHUNK_SIZE):
+    """Builds the daily series of the domains, the domain profile of each author
+    and the table of repeated urls.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the submissions csv file, it must have the url and domain columns.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    dict
+        The domains and authors names, the first day, the day x domain counts matrix,
+        the author x domain counts matrix and the repeated urls.
+
+    """
+
+    domains = dict()
+    authors = dict()
+
+    domain_ids = list()
+    author_ids = list()
+    timestamps = list()
+    hashes = list()
+
+    reader = pd.read_csv(file_path,
+                         usecols=lambda column: column in [
+                             "created_utc", "datetime", "author", "url", "domain"],
+                         dtype={"author": "str", "url": "str", "domain": "str"},
+                         keep_default_na=False, chunksize=chunksize)
+
+    # We only keep 4 integer arrays in memory, the strings are interned or hashed.
+    for df in reader:
+
+        df = df[~df["domain"].isin(EXCLUDED_DOMAINS)]
+
+        domain_ids.append(intern(df["domain"], domains))
+        author_ids.append(intern(df["author"], authors))
+        timestamps.append(aggregates.read_created_utc(df).to_numpy(dtype="int64"))
+        hashes.append(hash_urls(df["url"]))
+
+    domain_ids = np.concatenate(domain_ids)
+    author_ids = np.concatenate(author_ids)
+    timestamps = np.concatenate(timestamps)
+    hashes = np.concatenate(hashes)
+
+    days = timestamps // DAY
+    first_day = int(days.min()) if len(days) > 0 else 0
+    ones = np.ones(len(domain_ids), dtype="int64")
+
+    daily = sparse.csr_matrix(
+        (ones, (days - first_day, domain_ids)),
+        shape=(int(days.max()) - first_day + 1 if len(days) > 0 else 0, len(domains)))
+
+    profiles = sparse.csr_matrix(
+        (ones, (author_ids, domain_ids)), shape=(len(authors), len(domains)))
+
+    domain_names = pd.Index(list(domains.keys()))
+    author_names = pd.Index(list(authors.keys()))
+
+    return {"domains": domain_names, "authors": author_names, "first_day": first_day,
+            "daily": daily, "profiles": profiles,
+            "repeated": get_repeated_urls(file_path, hashes, domain_ids, author_ids, timestamps,
+                                          domain_names, chunksize)}
+
+
+def get_repeated_urls(file_path, hashes, domain_ids, author_ids, timestamps, domain_names,
+                      chunksize=aggregates.CHUNK_SIZE):
+    """Finds the urls that were posted more than once.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the submissions csv file.
+
+    hashes : numpy.ndarray
+        The hash of the url of each submission.
+
+    domain_ids : numpy.ndarray
+        The domain id of each submission.
+
+    author_ids : numpy.ndarray
+        The author id of each submission.
+
+    timestamps : numpy.ndarray
+        The created_utc of each submission.
+
+    domain_names : pandas.Index
+        The name of each domain id.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The url, domain, number of posts and authors and the first and last
+        UTC time of each repeated url, indexed by the url hash.
+
+    """
+
+    # The hash index, a sorted array of every url hash and its number of posts.
+    unique, counts = np.unique(hashes, return_counts=True)
+    repeated = unique[counts > 1]
+
+    positions = np.flatnonzero(np.isin(hashes, repeated))
+
+    df = pd.DataFrame({"hash": hashes[positions], "domain_id": domain_ids[positions],
+                       "author_id": author_ids[positions], "created_utc": timestamps[positions]})
+
+    df = df.groupby("hash").agg(
+        domain_id=("domain_id", "first"), posts=("author_id", "size"),
+        authors=("author_id", "nunique"), first_posted=("created_utc", "min"),
+        last_posted=("created_utc", "max"))
+
+    df.insert(0, "domain", domain_names[df.pop("domain_id").to_numpy()])
+
+    for column in ["first_posted", "last_posted"]:
+        df[column] = pd.to_datetime(df[column], unit="s", utc=True)
+
+    # Only the text of the repeated urls is read again, the first time each one was seen.
+    urls = dict()
+
+    if len(df) > 0:
+        for chunk in pd.read_csv(file_path, usecols=["url", "domain"], dtype="str",
+                                 keep_default_na=False, chunksize=chunksize):
+
+            chunk = chunk[~chunk["domain"].isin(EXCLUDED_DOMAINS)]
+            chunk_hashes = hash_urls(chunk["url"])
+            found = np.isin(chunk_hashes, df.index.to_numpy())
+
+            for url_hash, url in zip(chunk_hashes[found], chunk["url"].to_numpy()[found]):
+                urls.setdefault(url_hash, url)
+
+    df.insert(0, "url", df.index.map(urls))
+
+    return df.sort_values("posts", ascending=False)
+
+
+def load_index(file_path, chunksize=aggregates.CHUNK_SIZE, cache_dir=cache.CACHE_DIR):
+    """Loads the index from the cache or builds it.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the submissions csv file.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    cache_dir : str
+        The folder where the index is memoized, None disables the cache.
+
+    Returns
+    -------
+    dict
+        The links index.
+
+    """
+
+    return cache.load_or_compute("links", [file_path],
+                                 lambda: build_index(file_path, chunksize), cache_dir=cache_dir)
+
+
+def has_links(index):
+    """Checks if any link was posted, the self posts are not links.
+
+    Parameters
+    ----------
+    index : dict
+        The links index.
+
+    Returns
+    -------
+    bool
+        True when the index has at least one domain and one day.
+
+    """
+
+    return len(index["domains"]) > 0 and index["daily"].shape[0] > 0
+
+
+def get_top_sources(index, top=20):
+    """Gets the domains that are posted the most.
+
+    Parameters
+    ----------
+    index : dict
+        The links index.
+
+    top : int
+        The number of domains.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The number of posts, authors and active days of each domain and the share
+        of its posts made by its top author, sorted by the number of posts,
+        empty when no links were posted.
+
+    """
+
+    # The matrices of a subreddit without links have no rows, they can't be reduced.
+    if not has_links(index):
+        return pd.DataFrame({"posts": pd.Series(dtype="int64"), "authors": pd.Series(dtype="int64"),
+                             "days": pd.Series(dtype="int64"),
+                             "top_author_share": pd.Series(dtype="float64")},
+                            index=index["domains"][:0])
+
+    profiles = index["profiles"].tocsc()
+    daily = index["daily"].tocsc()
+
+    posts = np.asarray(profiles.sum(axis=0)).ravel()
+
+    # The number of rows with a value in each column.
+    authors = np.diff(profiles.indptr)
+    days = np.diff(daily.indptr)
+    top_author = profiles.max(axis=0).toarray().ravel()
+
+    df = pd.DataFrame({"posts": posts, "authors": authors, "days": days,
+                       "top_author_share": top_author / np.maximum(posts, 1)},
+                      index=index["domains"])
+
+    return df.sort_values("posts", ascending=False)[:top]
+
+
+def get_domain_series(index, domains=None, top=10):
+    """Gets the daily posts of some domains.
+
+    Parameters
+    ----------
+    index : dict
+        The links index.
+
+    domains : list
+        The domains, by default the most posted ones.
+
+    top : int
+        The number of domains when they are not given.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The posts of each domain by day (UTC), including the days without posts,
+        empty when no links were posted.
+
+    """
+
+    if not has_links(index):
+        return pd.DataFrame(index=pd.DatetimeIndex(list(), tz="UTC"))
+
+    if domains is None:
+        domains = get_top_sources(index, top).index
+
+    positions = index["domains"].get_indexer(domains)
+    daily = index["daily"]
+
+    dates = pd.to_datetime((index["first_day"] + np.arange(daily.shape[0])) * DAY,
+                           unit="s", utc=True)
+
+    return pd.DataFrame(daily[:, positions].toarray(), index=dates, columns=list(domains))
+
+
+def get_author_profile(index, author, top=10):
+    """Gets the domains that an author posts the most.
+
+    Parameters
+    ----------
+    index : dict
+        The links index.
+
+    author : str
+        The author.
+
+    top : int
+        The number of domains.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The posts of the author in each domain and their share of all the
+        author posts, sorted by the number of posts, empty when the author
+        didn't post any link.
+
+    """
+
+    if not has_links(index) or author not in index["authors"]:
+        return pd.DataFrame({"posts": pd.Series(dtype="int64"), "share": pd.Series(dtype="float64")},
+                            index=index["domains"][:0])
+
+    row = index["profiles"].getrow(index["authors"].get_loc(author))
+
+    df = pd.DataFrame({"posts": row.data, "share": row.data / max(row.data.sum(), 1)},
+                      index=index["domains"][row.indices])
+
+    return df.sort_values("posts", ascending=False)[:top]
+
+
+def get_links_report(index, top=20):
+    """Prints the top link sources and the most repeated urls.
+
+    Parameters
+    ----------
+    index : dict
+        The links index.
+
+    top : int
+        The number of domains and urls.
+
+    """
+
+    if not has_links(index):
+        print("No links were posted, all the submissions are self posts.")
+        return
+
+    print("Top link sources:\n")
+    print(get_top_sources(index, top))
+
+    repeated = index["repeated"]
+
+    print("\n{:,} urls were posted more than once, the most repeated:\n".format(len(repeated)))
+    print(repeated[:top].to_string(index=False))
+
+
+def main():
+    """Parses the command line arguments and prints the links report."""
+
+    parser = argparse.ArgumentParser(
+        description="Prints the link sources, repeated urls and domain profiles of the submissions.")
+
+    parser.add_argument("--subreddit", default=SUBREDDIT,
+                        help="The subreddit, its submissions are read from ./<subreddit>-submissions.csv (or .csv.zst / .csv.gz)")
+
+    parser.add_argument("--file",
+                        help="The submissions csv file, it overrides --subreddit.")
+
+    parser.add_argument("--top", type=int, default=20,
+                        help="The number of domains and urls.")
+
+    parser.add_argument("--domains", nargs="*", metavar="domain",
+                        help="Print the daily posts of these domains, by default of the 10 most posted ones.")
+
+    parser.add_argument("--authors", nargs="+", default=list(), metavar="author",
+                        help="Print the domain profile of these authors.")
+
+    parser.add_argument("--chunksize", type=int, default=aggregates.CHUNK_SIZE,
+                        help="How many rows are read at a time.")
+
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always read the csv file.")
+
+    args = parser.parse_args()
+
+    file_path = args.file or fileio.find_file("./{}-submissions.csv".format(args.subreddit))
+    index = load_index(file_path, args.chunksize, None if args.no_cache else cache.CACHE_DIR)
+
+    get_links_report(index, args.top)
+
+    if args.domains is not None:
+
+        domains = [domain for domain in args.domains if domain in index["domains"]] or None
+
+        for domain in set(args.domains) - set(domains or list()):
+            print("Not found:", domain)
+
+        print("\nDaily posts:\n")
+        print(get_domain_series(index, domains).to_string())
+
+    for author in args.authors:
+
+        if author not in index["authors"]:
+            print("Not found:", author)
+            continue
+
+        print("\nDomains of {}:\n".format(author))
+        print(get_author_profile(index, author, args.top))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,473 @@
+"""
+This script keeps the submissions and comments aggregates of a subreddit up to date by
+polling a Pushshift compatible API for the items newer than the last ones it has seen.
+
+The new items are requested and parsed with the same functions as the downloaders and
+added to the aggregates in place (see aggregates.py), the history is never processed
+again. The aggregates, the watermark and the new rows are saved together after every
+poll, before the rows are appended to the csv files, and the step3.py figures that
+are built from them (weekday, hour, daily, submissionsbyuser and commentsbyuser) can be
+rendered again after every poll, this works as a near real-time dashboard.
+"""
+
+import argparse
+import csv
+import os
+import pickle
+import time
+
+import pandas as pd
+import requests
+
+import aggregates
+import fileio
+import metrics
+import step3
+import store
+import subreddit_comments
+import subreddit_submissions
+
+
+# How many seconds we wait between polls.
+POLL_INTERVAL = 60
+
+# The maximum number of items of each request.
+PAGE_SIZE = 500
+
+# The function that requests a page of items, the function that converts each
+# item to a csv row and the csv columns of each kind of item.
+KINDS = {
+    "submissions": (subreddit_submissions.get_page, subreddit_submissions.parse_submission,
+                    ["created_utc", "author", "title", "url", "domain"]),
+    "comments": (subreddit_comments.get_page, subreddit_comments.parse_comment,
+                 ["created_utc", "author", "body", "id"])
+}
+
+
+def new_state(subreddit, since):
+    """Creates the state of a subreddit without any items.
+
+    Parameters
+    ----------
+    subreddit : str
+        The subreddit.
+
+    since : int
+        Only the items created after this UTC timestamp are downloaded.
+
+    Returns
+    -------
+    dict
+        The aggregates and the watermark of each kind of item, the new rows
+        that are not written yet and the size of the csv files before them.
+
+    """
+
+    return {
+        "subreddit": subreddit,
+        "aggregates": {kind: aggregates.new_activity_aggregates() for kind in KINDS},
+        "watermarks": {kind: {"created_utc": since, "ids": set()} for kind in KINDS},
+        "pending": {kind: list() for kind in KINDS},
+        "offsets": dict()
+    }
+
+
+def seed_state(state, kind, file_path, chunksize=aggregates.CHUNK_SIZE):
+    """Starts the aggregates and the watermark of one kind from its csv file.
+
+    Parameters
+    ----------
+    state : dict
+        The state that will be updated in place.
+
+    kind : str
+        Either submissions or comments.
+
+    file_path : str
+        The path of the submissions or comments csv file.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    """
+
+    state["aggregates"][kind] = aggregates.read_activity_aggregates(file_path, chunksize)
+
+    latest = 0
+
+    for df in pd.read_csv(file_path, usecols=lambda column: column in ["created_utc", "datetime"],
+                          chunksize=chunksize):
+        latest = max(latest, int(aggregates.read_created_utc(df).max()))
+
+    # The ids of the latest second are not known, some items of that second could be
+    # counted twice, we start from the next second instead.
+    state["watermarks"][kind] = {"created_utc": latest + 1, "ids": set()}
+
+
+def load_state(file_path):
+    """Loads a saved state.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the state file.
+
+    Returns
+    -------
+    dict
+        The state.
+
+    """
+
+    with open(file_path, "rb") as state_file:
+        return pickle.load(state_file)
+
+
+def save_state(state, file_path):
+    """Saves the state, an interrupted save never leaves a broken file.
+
+    Parameters
+    ----------
+    state : dict
+        The state.
+
+    file_path : str
+        The path of the state file.
+
+    """
+
+    temp_file = "{}.{}.tmp".format(file_path, os.getpid())
+
+    with open(temp_file, "wb") as state_file:
+        pickle.dump(state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(temp_file, file_path)
+
+
+def fetch_new_items(base_url, kind, subreddit, watermark):
+    """Downloads the items created at or after the watermark, oldest first.
+
+    Parameters
+    ----------
+    base_url : str
+        The base url of the API.
+
+    kind : str
+        Either submissions or comments.
+
+    subreddit : str
+        The subreddit.
+
+    watermark : dict
+        The created_utc of the latest item and the ids of the items
+        created in that same second, these are skipped.
+
+    Returns
+    -------
+    list
+        The new items.
+
+    """
+
+    get_page = KINDS[kind][0]
+
+    seen = set(watermark["ids"])
+    items = list()
+
+    # The 'after' parameter is exclusive, we ask for the items of the watermark
+    # second again so the ones that arrived late are not lost.
+    after = watermark["created_utc"] - 1
+
+    while True:
+
+        params = {"subreddit": subreddit, "sort": "asc",
+                  "sort_type": "created_utc", "size": PAGE_SIZE, "after": after}
+
+        page = get_page(params, base_url)
+
+        new_items = [item for item in page if item["id"] not in seen]
+        metrics.increment("downloaded_items_total", len(new_items), kind=kind)
+
+        seen.update(item["id"] for item in new_items)
+        items.extend(new_items)
+
+        if len(page) < PAGE_SIZE or len(new_items) == 0:
+            break
+
+        after = page[-1]["created_utc"] - 1
+
+    return items
+
+
+def update_watermark(watermark, items):
+    """Moves the watermark to the latest of the new items.
+
+    Parameters
+    ----------
+    watermark : dict
+        The watermark that will be updated in place.
+
+    items : list
+        The new items.
+
+    """
+
+    if len(items) == 0:
+        return
+
+    latest = max(item["created_utc"] for item in items)
+    ids = {item["id"] for item in items if item["created_utc"] == latest}
+
+    if latest == watermark["created_utc"]:
+        watermark["ids"].update(ids)
+    elif latest > watermark["created_utc"]:
+        watermark["created_utc"] = latest
+        watermark["ids"] = ids
+
+
+def poll(state, base_url=subreddit_comments.BASE_URL):
+    """Downloads the new items and adds them to the aggregates.
+
+    The new rows are kept in the state until write_pending() saves them.
+
+    Parameters
+    ----------
+    state : dict
+        The state that will be updated in place.
+
+    base_url : str
+        The base url of the API.
+
+    Returns
+    -------
+    dict
+        The number of new items of each kind.
+
+    """
+
+    counts = dict()
+
+    for kind, (_, parse, columns) in KINDS.items():
+
+        watermark = state["watermarks"][kind]
+        items = fetch_new_items(base_url, kind, state["subreddit"], watermark)
+        rows = [parse(item) for item in items]
+
+        if len(rows) > 0:
+            aggregates.update_activity_aggregates(
+                state["aggregates"][kind], pd.DataFrame(rows, columns=columns))
+
+        state["pending"][kind].extend(rows)
+
+        update_watermark(watermark, items)
+        counts[kind] = len(rows)
+
+    return counts
+
+
+def get_file_size(file_path):
+    """Gets the size of a file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    Returns
+    -------
+    int
+        The size in bytes, 0 when the file doesn't exist.
+
+    """
+
+    return os.path.getsize(file_path) if os.path.exists(file_path) else 0
+
+
+def write_pending(state, files=None, connection=None):
+    """Appends the new rows of the state to the csv files and the database.
+
+    The state must be saved before, with the size of each csv file before
+    its new rows (see save_pending()). If a previous write was interrupted
+    the file is truncated to that size first, so no row is written twice.
+
+    Parameters
+    ----------
+    state : dict
+        The state, its new rows are cleared.
+
+    files : dict
+        Optional csv files of each kind.
+
+    connection : sqlite3.Connection
+        An optional database connection that will also save the new rows.
+
+    """
+
+    for kind, rows in state["pending"].items():
+
+        if len(rows) == 0:
+            continue
+
+        if files is not None:
+
+            offset = state["offsets"][kind]
+
+            if get_file_size(files[kind]) > offset:
+                with open(files[kind], "r+b") as csv_file:
+                    csv_file.truncate(offset)
+
+            # The file is closed after every poll, a compressed file gets
+            # a complete gzip member or Zstandard frame each time.
+            with fileio.open_text(files[kind], "a") as csv_file:
+
+                writer = csv.writer(csv_file)
+
+                if offset == 0:
+                    writer.writerow(KINDS[kind][2])
+
+                writer.writerows(rows)
+
+        if connection is not None:
+            store.insert_rows(connection, kind, state["subreddit"], rows)
+
+    state["pending"] = {kind: list() for kind in KINDS}
+    state["offsets"] = dict()
+
+
+def save_pending(state, state_file, files=None):
+    """Saves the state with its new rows and the size of the csv files before them.
+
+    Parameters
+    ----------
+    state : dict
+        The state.
+
+    state_file : str
+        The path of the state file.
+
+    files : dict
+        Optional csv files of each kind.
+
+    """
+
+    if files is not None:
+        for kind, rows in state["pending"].items():
+            if len(rows) > 0:
+                state["offsets"].setdefault(kind, get_file_size(files[kind]))
+
+    save_state(state, state_file)
+
+
+def main():
+    """Parses the command line arguments and polls the API until it is stopped."""
+
+    figures = ["weekday", "hour", "daily", "submissionsbyuser", "commentsbyuser"]
+
+    parser = argparse.ArgumentParser(
+        description="Keeps the activity aggregates of a subreddit up to date.")
+
+    parser.add_argument("subreddit", nargs="?", default="mexico",
+                        help="The subreddit.")
+
+    parser.add_argument("--base-url", default=subreddit_comments.BASE_URL,
+                        help="The base url of a Pushshift compatible API.")
+
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help="How many seconds we wait between polls.")
+
+    parser.add_argument("--state",
+                        help="The state file, by default <subreddit>-live.pickle.")
+
+    parser.add_argument("--since",
+                        help="When there is no state file, start from this UTC date (YYYY-MM-DD) instead of now.")
+
+    parser.add_argument("--seed", action="store_true",
+                        help="When there is no state file, start from the submissions and comments csv files.")
+
+    parser.add_argument("--append", action="store_true",
+                        help="Also append the new rows to the submissions and comments csv files.")
+
+    parser.add_argument("--database",
+                        help="Also save the new rows to this SQLite database.")
+
+    parser.add_argument("--figures", nargs="*", default=list(), metavar="figure",
+                        help="Render these figures after every poll: " + ", ".join(figures))
+
+    parser.add_argument("--timezone", default=step3.DISPLAY_TIMEZONE,
+                        help="The timezone used for the weekday and hour figures.")
+
+    parser.add_argument("--polls", type=int,
+                        help="Stop after this many polls.")
+
+    parser.add_argument("--metrics",
+                        help="Save the request latencies and item counts to this file after every poll, "
+                        ".prom files use the Prometheus text format (see metrics.py).")
+
+    args = parser.parse_args()
+
+    for name in args.figures:
+        if name not in figures:
+            parser.error("invalid figure: {}".format(name))
+
+    state_file = args.state or "./{}-live.pickle".format(args.subreddit)
+    files = {kind: fileio.find_file("./{}-{}.csv".format(args.subreddit, kind)) for kind in KINDS}
+
+    if os.path.exists(state_file):
+        state = load_state(state_file)
+
+        # The states saved by older versions don't have the new rows.
+        state.setdefault("pending", {kind: list() for kind in KINDS})
+        state.setdefault("offsets", dict())
+    else:
+        since = step3.get_utc_timestamp(args.since) or int(time.time())
+        state = new_state(args.subreddit, since)
+
+        if args.seed:
+            for kind, file_path in files.items():
+                seed_state(state, kind, file_path)
+
+    connection = store.connect(args.database) if args.database else None
+
+    if args.metrics:
+        metrics.configure(args.metrics)
+
+    # The rows of a poll that was interrupted while they were written.
+    write_pending(state, files if args.append else None, connection)
+    save_state(state, state_file)
+
+    polls = 0
+
+    while args.polls is None or polls < args.polls:
+
+        if polls > 0:
+            time.sleep(args.interval)
+
+        polls += 1
+
+        # A failed poll is retried on the next one, the watermark didn't move.
+        try:
+            with metrics.span("poll"):
+                counts = poll(state, args.base_url)
+        except (requests.RequestException, ValueError, KeyError) as error:
+            print("Poll failed:", error)
+            metrics.flush()
+            continue
+
+        # The watermark and the new rows are saved together, then the rows are written.
+        save_pending(state, state_file, files if args.append else None)
+        write_pending(state, files if args.append else None, connection)
+        save_state(state, state_file)
+
+        print("New: {} submissions, {} comments (total: {} submissions, {} comments)".format(
+            counts["submissions"], counts["comments"],
+            state["aggregates"]["submissions"]["total"], state["aggregates"]["comments"]["total"]))
+
+        data = dict(state["aggregates"], timezone=args.timezone)
+        step3.render_figures(data, args.figures, workers=len(args.figures))
+
+        metrics.flush()
+
+
+if __name__ == "__main__":
+
+    main()
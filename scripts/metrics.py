@@ -0,0 +1,396 @@
+"""
+This script contains a small instrumentation layer for the pipeline: counters, timers
+and spans (timed blocks of code with labels).
+
+It is disabled by default and then every function returns right away. It is enabled by
+calling configure() (the --metrics option of the scripts) or by setting the
+SUBREDDIT_METRICS environment variable to a file path, the processes started by the
+scripts inherit it. When the file ends in .prom the counters and timers are written in
+the Prometheus text format (for the node exporter textfile collector), any other file
+is a JSON-lines log with one line per span and a snapshot of the metrics on every flush.
+"""
+
+import contextlib
+import json
+import os
+import time
+
+
+# The environment variable that enables the metrics in any script.
+ENVIRONMENT_VARIABLE = "SUBREDDIT_METRICS"
+
+# The prefix of the Prometheus metric names.
+PREFIX = "subreddit_analyzer"
+
+# The counters and timers, keyed by (name, labels). The counters are numbers
+# and the timers are [count, sum, max] lists of seconds.
+COUNTERS = dict()
+TIMERS = dict()
+
+# The path of the metrics file and the open JSON-lines log, None when disabled.
+METRICS_FILE = None
+LOG_FILE = None
+
+# The names of the spans that are open right now, the innermost one is the
+# parent of a new span.
+OPEN_SPANS = list()
+
+
+def configure(file_path):
+    """Enables the metrics.
+
+    Parameters
+    ----------
+    file_path : str
+        The metrics file, .prom files use the Prometheus text format and
+        any other file is a JSON-lines log. None disables the metrics.
+
+    """
+
+    global METRICS_FILE, LOG_FILE
+
+    if LOG_FILE is not None:
+        LOG_FILE.close()
+
+    METRICS_FILE = file_path
+    LOG_FILE = None
+
+    if file_path is None:
+        os.environ.pop(ENVIRONMENT_VARIABLE, None)
+        return
+
+    # The processes that are spawned later also write their spans.
+    os.environ[ENVIRONMENT_VARIABLE] = file_path
+
+    if not is_prometheus():
+        # Line buffered, every event is a single write to the end of the file,
+        # the worker processes can append to the same log.
+        LOG_FILE = open(file_path, "a", encoding="utf-8", buffering=1)
+
+
+def is_enabled():
+    """Checks if the metrics are enabled.
+
+    Returns
+    -------
+    bool
+        True when a metrics file is configured.
+
+    """
+
+    return METRICS_FILE is not None
+
+
+def is_prometheus():
+    """Checks if the metrics file uses the Prometheus text format.
+
+    Returns
+    -------
+    bool
+        True when the metrics file ends in .prom
+
+    """
+
+    return METRICS_FILE is not None and METRICS_FILE.endswith(".prom")
+
+
+def get_key(name, labels):
+    """Gets the key of a metric, the labels are sorted by name.
+
+    Parameters
+    ----------
+    name : str
+        The name of the metric.
+
+    labels : dict
+        The labels of the metric.
+
+    Returns
+    -------
+    tuple
+        The name and the labels as a tuple of pairs.
+
+    """
+
+    return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+
+def increment(name, value=1, **labels):
+    """Adds a value to a counter.
+
+    Parameters
+    ----------
+    name : str
+        The name of the counter, e.g. downloaded_items_total
+
+    value : int
+        The value to add.
+
+    labels : dict
+        The labels of the counter.
+
+    """
+
+    if METRICS_FILE is None:
+        return
+
+    key = get_key(name, labels)
+    COUNTERS[key] = COUNTERS.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Adds a duration to a timer.
+
+    Parameters
+    ----------
+    name : str
+        The name of the timer, e.g. http_request_seconds
+
+    seconds : float
+        The duration.
+
+    labels : dict
+        The labels of the timer.
+
+    """
+
+    if METRICS_FILE is None:
+        return
+
+    key = get_key(name, labels)
+    timer = TIMERS.setdefault(key, [0, 0.0, 0.0])
+
+    timer[0] += 1
+    timer[1] += seconds
+    timer[2] = max(timer[2], seconds)
+
+
+def write_event(event):
+    """Writes an event to the JSON-lines log, if there is one.
+
+    Parameters
+    ----------
+    event : dict
+        The event, it must be JSON serializable.
+
+    """
+
+    if LOG_FILE is not None:
+        LOG_FILE.write(json.dumps(event, default=str) + "\n")
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """Times a block of code, the duration is added to the <name>_seconds timer.
+
+    The block receives a dict where it can add fields to the span event,
+    e.g. the number of items that it processed.
+
+    Parameters
+    ----------
+    name : str
+        The name of the span, e.g. http_request
+
+    labels : dict
+        The labels of the span and its timer.
+
+    """
+
+    fields = dict()
+
+    if METRICS_FILE is None:
+        yield fields
+        return
+
+    parent = OPEN_SPANS[-1] if len(OPEN_SPANS) > 0 else None
+    OPEN_SPANS.append(name)
+
+    start = time.time()
+    start_counter = time.perf_counter()
+    error = None
+
+    try:
+        yield fields
+    except GeneratorExit:
+        raise
+    except BaseException as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start_counter
+        OPEN_SPANS.pop()
+
+        observe(name + "_seconds", seconds, **labels)
+
+        if error is not None:
+            increment(name + "_errors_total", error=error, **labels)
+
+        write_event(dict(fields, type="span", name=name, labels=labels, start=start,
+                         seconds=seconds, parent=parent, error=error, pid=os.getpid()))
+
+
+def collect(function, *args):
+    """Calls a function and also returns the counters and timers it recorded.
+
+    It is used inside worker processes, the caller merges the metrics
+    of each worker with merge().
+
+    Parameters
+    ----------
+    function : callable
+        The function.
+
+    args : list
+        The arguments of the function.
+
+    Returns
+    -------
+    tuple
+        The result of the function and its counters and timers.
+
+    """
+
+    if METRICS_FILE is None:
+        return function(*args), None
+
+    # A forked worker starts with a copy of the parent metrics, they are put aside.
+    counters = dict(COUNTERS)
+    timers = {key: list(value) for key, value in TIMERS.items()}
+
+    COUNTERS.clear()
+    TIMERS.clear()
+
+    try:
+        result = function(*args)
+        snapshot = (dict(COUNTERS), {key: list(value) for key, value in TIMERS.items()})
+    finally:
+        COUNTERS.clear()
+        COUNTERS.update(counters)
+        TIMERS.clear()
+        TIMERS.update(timers)
+
+    return result, snapshot
+
+
+def merge(snapshot):
+    """Adds the counters and timers of another process.
+
+    Parameters
+    ----------
+    snapshot : tuple
+        The counters and timers from collect(), it can be None.
+
+    """
+
+    if METRICS_FILE is None or snapshot is None:
+        return
+
+    counters, timers = snapshot
+
+    for key, value in counters.items():
+        COUNTERS[key] = COUNTERS.get(key, 0) + value
+
+    for key, (count, total, maximum) in timers.items():
+        timer = TIMERS.setdefault(key, [0, 0.0, 0.0])
+        timer[0] += count
+        timer[1] += total
+        timer[2] = max(timer[2], maximum)
+
+
+def format_labels(labels):
+    """Formats the labels of a metric in the Prometheus text format.
+
+    Parameters
+    ----------
+    labels : tuple
+        The pairs of label names and values.
+
+    Returns
+    -------
+    str
+        The labels between braces, or an empty string.
+
+    """
+
+    if len(labels) == 0:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+                          for key, value in labels) + "}"
+
+
+def get_prometheus_text():
+    """Gets the counters and timers in the Prometheus text format.
+
+    The counters are Prometheus counters and the timers are summaries
+    (count and sum) plus a gauge with their maximum.
+
+    Returns
+    -------
+    str
+        The metrics.
+
+    """
+
+    lines = list()
+
+    for name in sorted({key[0] for key in COUNTERS}):
+        metric = "{}_{}".format(PREFIX, name)
+        lines.append("# TYPE {} counter".format(metric))
+
+        for (key_name, labels), value in sorted(COUNTERS.items()):
+            if key_name == name:
+                lines.append("{}{} {}".format(metric, format_labels(labels), value))
+
+    for name in sorted({key[0] for key in TIMERS}):
+        metric = "{}_{}".format(PREFIX, name)
+        lines.append("# TYPE {} summary".format(metric))
+
+        for (key_name, labels), (count, total, _) in sorted(TIMERS.items()):
+            if key_name == name:
+                lines.append("{}_count{} {}".format(metric, format_labels(labels), count))
+                lines.append("{}_sum{} {:.6f}".format(metric, format_labels(labels), total))
+
+        lines.append("# TYPE {}_max gauge".format(metric))
+
+        for (key_name, labels), (_, _, maximum) in sorted(TIMERS.items()):
+            if key_name == name:
+                lines.append("{}_max{} {:.6f}".format(metric, format_labels(labels), maximum))
+
+    return "\n".join(lines) + "\n"
+
+
+def flush():
+    """Writes the current counters and timers to the metrics file.
+
+    The Prometheus file is replaced atomically so a scraper never reads
+    half of it, the JSON-lines log gets a metrics event.
+
+    """
+
+    if METRICS_FILE is None:
+        return
+
+    if is_prometheus():
+        temp_file = "{}.{}.tmp".format(METRICS_FILE, os.getpid())
+
+        with open(temp_file, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(get_prometheus_text())
+
+        os.replace(temp_file, METRICS_FILE)
+        return
+
+    write_event({
+        "type": "metrics",
+        "time": time.time(),
+        "pid": os.getpid(),
+        "counters": [{"name": name, "labels": dict(labels), "value": value}
+                     for (name, labels), value in COUNTERS.items()],
+        "timers": [{"name": name, "labels": dict(labels), "count": count, "sum": total, "max": maximum}
+                   for (name, labels), (count, total, maximum) in TIMERS.items()]
+    })
+
+
+# The metrics are enabled in every process that inherits the environment variable.
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    configure(os.environ[ENVIRONMENT_VARIABLE])
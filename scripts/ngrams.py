@@ -0,0 +1,595 @@
+"""
+This script counts the bigrams and trigrams of the lemmas in the tokens csv file of step2.py
+and scores them as collocations (phrases) using PMI and log-likelihood.
+
+The n-grams are counted in one pass with hashed counters that are pruned when they grow
+too big, the counters of several files (shards) can be merged before scoring.
+
+The lemma counts (unigrams) and the lemma texts are not pruned. The PMI and log-likelihood
+of every n-gram need the exact counts of its lemmas, and the vocabulary grows much slower
+than the number of different bigrams and trigrams (a few hundred thousand lemmas for
+millions of comments), so they stay small next to the n-gram counters.
+"""
+
+import argparse
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import tokencorpus
+
+
+# The maximum number of different n-grams kept by each counter, the least
+# common ones are pruned when this size is reached.
+MAX_NGRAMS = 2000000
+
+# The n-grams with fewer occurrences are not scored.
+MIN_COUNT = 5
+
+NGRAM_NAMES = {2: "bigrams", 3: "trigrams"}
+
+
+def new_counters():
+    """Creates empty n-gram counters.
+
+    Returns
+    -------
+    dict
+        The empty counters.
+
+    """
+
+    return {
+        "total": 0,
+        "unigrams": pd.Series(dtype="int64"),
+        "lemmas": pd.Series(dtype="str"),
+        "bigrams": pd.Series(dtype="int64"),
+        "trigrams": pd.Series(dtype="int64"),
+        "pruned": 0
+    }
+
+
+def prune(counter, max_size=MAX_NGRAMS):
+    """Keeps the max_size // 2 most common n-grams of a counter when it is too big.
+
+    Parameters
+    ----------
+    counter : pandas.Series
+        The n-gram counts.
+
+    max_size : int
+        The maximum number of n-grams.
+
+    Returns
+    -------
+    tuple
+        The pruned counter and the highest count that was removed.
+
+    """
+
+    if len(counter) <= max_size:
+        return counter, 0
+
+    # The ties at the boundary are kept or removed by position, removing all of
+    # them would empty a counter where most n-grams were only seen once.
+    ordered = counter.sort_values(ascending=False, kind="stable")
+
+    return ordered.iloc[:max_size // 2], int(ordered.iloc[max_size // 2])
+
+
+def add_counts(left, right):
+    """Adds two Series of counts, one of them can be empty.
+
+    Parameters
+    ----------
+    left : pandas.Series
+        The first counts.
+
+    right : pandas.Series
+        The second counts.
+
+    Returns
+    -------
+    pandas.Series
+        The sum of both counts.
+
+    """
+
+    # An empty Series doesn't have the MultiIndex of the n-grams.
+    if len(left) == 0:
+        return right
+
+    if len(right) == 0:
+        return left
+
+    return left.add(right, fill_value=0).astype("int64")
+
+
+def merge_counters(left, right, max_size=MAX_NGRAMS):
+    """Merges the counters of two shards.
+
+    Parameters
+    ----------
+    left : dict
+        The first counters.
+
+    right : dict
+        The second counters.
+
+    max_size : int
+        The maximum number of n-grams of each counter.
+
+    Returns
+    -------
+    dict
+        The merged counters.
+
+    """
+
+    merged = {
+        "total": left["total"] + right["total"],
+        "unigrams": add_counts(left["unigrams"], right["unigrams"]),
+        "lemmas": left["lemmas"].combine_first(right["lemmas"]),
+        "pruned": left["pruned"] + right["pruned"]
+    }
+
+    for name in NGRAM_NAMES.values():
+
+        merged[name], threshold = prune(
+            add_counts(left[name], right[name]), max_size)
+        merged["pruned"] += threshold
+
+    return merged
+
+
+def get_ngram_counts(hashes, valid, comments, n, start):
+    """Counts the n-grams of a sequence of lemma hashes.
+
+    An n-gram can't include invalid tokens (stop words, punctuation) or
+    cross the boundary between 2 comments.
+
+    Parameters
+    ----------
+    hashes : numpy.ndarray
+        The hash of each lemma.
+
+    valid : numpy.ndarray
+        If each token can be part of an n-gram.
+
+    comments : numpy.ndarray
+        The comment code of each token.
+
+    n : int
+        The size of the n-grams.
+
+    start : int
+        The first position of the n-grams, the previous ones were counted
+        with the previous chunk.
+
+    Returns
+    -------
+    pandas.Series
+        The n-gram counts, indexed by the hashes of their lemmas.
+
+    """
+
+    length = len(hashes) - n + 1 - start
+
+    if length <= 0:
+        return pd.Series(dtype="int64")
+
+    keep = np.ones(length, dtype="bool")
+
+    for k in range(n):
+        keep &= valid[start + k:start + k + length]
+
+    for k in range(1, n):
+        keep &= comments[start + k:start + k + length] == comments[start:start + length]
+
+    columns = {k: hashes[start + k:start + k + length][keep] for k in range(n)}
+
+    return pd.DataFrame(columns).value_counts()
+
+
+def get_comment_codes(comment_ids):
+    """Gets an integer code for the comment of each token.
+
+    The tokens without a comment id can't be placed in a comment, each one
+    gets its own code so no n-gram is formed across them.
+
+    Parameters
+    ----------
+    comment_ids : pandas.Series
+        The comment_id of each token.
+
+    Returns
+    -------
+    numpy.ndarray
+        The comment code of each token.
+
+    """
+
+    codes = pd.factorize(comment_ids)[0]
+    missing = (comment_ids == "").to_numpy()
+
+    codes[missing] = -1 - np.arange(missing.sum())
+
+    return codes
+
+
+def count_ngrams(file_path, chunksize=aggregates.CHUNK_SIZE, max_size=MAX_NGRAMS):
+    """Counts the lemmas, bigrams and trigrams of a tokens csv file in one pass.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the tokens csv file.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    max_size : int
+        The maximum number of n-grams of each counter.
+
+    Returns
+    -------
+    dict
+        The counters.
+
+    """
+
+    counters = new_counters()
+
+    # The last 2 tokens of each chunk are kept, the n-grams that start
+    # in one chunk and end in the next one are not lost.
+    carry = None
+
+    reader = pd.read_csv(file_path,
+                         usecols=lambda column: column in [
+                             "lemma_lower", "is_alphabet", "is_stopword", "comment_id"],
+                         dtype={"lemma_lower": "str", "comment_id": "str"},
+                         keep_default_na=False, chunksize=chunksize)
+
+    warned = False
+
+    for df in reader:
+
+        # Older tokens files don't have the comment_id column.
+        if "comment_id" not in df.columns:
+            df["comment_id"] = ""
+
+        if not warned and (df["comment_id"] == "").any():
+            print("{} has tokens without comment_id, their bigrams and trigrams are not counted, "
+                  "run step2.py again to count them.".format(file_path))
+            warned = True
+
+        df["valid"] = (df["is_alphabet"] == True) & (df["is_stopword"] == False) & \
+            (df["lemma_lower"].str.len() > 1)
+
+        df = df[["lemma_lower", "valid", "comment_id"]]
+        new = df[df["valid"]]
+
+        chunk = new_counters()
+        chunk["total"] = len(new)
+
+        new_hashes = pd.util.hash_array(new["lemma_lower"].to_numpy(dtype="object"))
+        chunk["unigrams"] = pd.Series(new_hashes).value_counts()
+        chunk["lemmas"] = pd.Series(new["lemma_lower"].to_numpy(), index=new_hashes)
+        chunk["lemmas"] = chunk["lemmas"][~chunk["lemmas"].index.duplicated()]
+
+        start = 0
+
+        if carry is not None:
+            start = len(carry)
+            df = pd.concat([carry, df])
+
+        hashes = pd.util.hash_array(df["lemma_lower"].to_numpy(dtype="object"))
+        valid = df["valid"].to_numpy()
+        comments = get_comment_codes(df["comment_id"])
+
+        for n, name in NGRAM_NAMES.items():
+            chunk[name] = get_ngram_counts(
+                hashes, valid, comments, n, max(start - n + 1, 0))
+
+        counters = merge_counters(counters, chunk, max_size)
+        carry = df.iloc[-2:]
+
+    return counters
+
+
+def count_corpus_ngrams(directory, chunksize=aggregates.CHUNK_SIZE, max_size=MAX_NGRAMS):
+    """Counts the lemmas, bigrams and trigrams of a binary corpus (see tokencorpus.py).
+
+    The chunks end where a comment ends, no tokens are carried between them.
+
+    Parameters
+    ----------
+    directory : str
+        The folder of the corpus.
+
+    chunksize : int
+        The minimum number of tokens of each chunk.
+
+    max_size : int
+        The maximum number of n-grams of each counter.
+
+    Returns
+    -------
+    dict
+        The counters, the same as the ones from the tokens csv file.
+
+    """
+
+    corpus = tokencorpus.load_corpus(directory)
+
+    # The lemmas are only hashed once, the tokens get their hash from their lemma id.
+    vocabulary = corpus["vocabulary"]["lemmas"]
+    vocabulary_hashes = pd.util.hash_array(vocabulary.to_numpy(dtype="object"))
+
+    valid = tokencorpus.get_word_mask(corpus)
+    offsets = np.asarray(corpus["offsets"])
+
+    counters = new_counters()
+    start = 0
+
+    while start < offsets[-1]:
+
+        end = offsets[min(np.searchsorted(offsets, start + chunksize), len(offsets) - 1)]
+
+        lemmas = np.asarray(corpus["lemmas"][start:end])
+        hashes = vocabulary_hashes[lemmas]
+        chunk_valid = valid[start:end]
+        comments = np.searchsorted(offsets, np.arange(start, end), side="right")
+
+        chunk = new_counters()
+        chunk["total"] = int(chunk_valid.sum())
+        chunk["unigrams"] = pd.Series(hashes[chunk_valid]).value_counts()
+
+        found = np.unique(lemmas[chunk_valid])
+        chunk["lemmas"] = pd.Series(vocabulary[found].to_numpy(), index=vocabulary_hashes[found])
+
+        for n, name in NGRAM_NAMES.items():
+            chunk[name] = get_ngram_counts(hashes, chunk_valid, comments, n, 0)
+
+        counters = merge_counters(counters, chunk, max_size)
+        start = end
+
+    return counters
+
+
+def get_log_likelihood(k11, left, right, total):
+    """Computes Dunning's log-likelihood ratio of many pairs at once.
+
+    Parameters
+    ----------
+    k11 : numpy.ndarray
+        How many times both parts appear together.
+
+    left : numpy.ndarray
+        How many times the left part appears.
+
+    right : numpy.ndarray
+        How many times the right part appears.
+
+    total : int
+        The total number of tokens.
+
+    Returns
+    -------
+    numpy.ndarray
+        The log-likelihood ratio of each pair.
+
+    """
+
+    # The 2x2 contingency table and its expected values if both parts were independent.
+    table = np.stack([k11, left - k11, right - k11, total - left - right + k11])
+    table = np.maximum(table, 0)
+
+    rows = np.stack([left, left, total - left, total - left])
+    cols = np.stack([right, total - right, right, total - right])
+    expected = rows * cols / total
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 2 * np.where(table > 0, table * np.log(table / expected), 0).sum(axis=0)
+
+
+def get_bigram_counts(counters, first, second, default):
+    """Gets the counts of many bigrams from their lemma hashes.
+
+    Parameters
+    ----------
+    counters : dict
+        The n-gram counters.
+
+    first : numpy.ndarray
+        The hashes of the first lemmas.
+
+    second : numpy.ndarray
+        The hashes of the second lemmas.
+
+    default : numpy.ndarray
+        The counts used for the bigrams that were pruned.
+
+    Returns
+    -------
+    numpy.ndarray
+        The count of each bigram.
+
+    """
+
+    counts = counters["bigrams"].reindex(
+        pd.MultiIndex.from_arrays([first, second])).to_numpy(dtype="float64")
+
+    return np.where(np.isnan(counts), default, counts)
+
+
+def get_collocations(counters, n=2, min_count=MIN_COUNT):
+    """Scores the n-grams as collocations.
+
+    The PMI tells how much more often the lemmas appear together than by
+    chance, the log-likelihood ratio also takes into account how much
+    evidence there is, so it doesn't favor rare n-grams.
+
+    Parameters
+    ----------
+    counters : dict
+        The n-gram counters.
+
+    n : int
+        The size of the n-grams, 2 or 3.
+
+    min_count : int
+        The n-grams with fewer occurrences are not scored.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The count, PMI and log-likelihood ratio of each phrase, sorted
+        by the log-likelihood ratio.
+
+    """
+
+    counts = counters[NGRAM_NAMES[n]]
+    counts = counts[counts >= min_count]
+
+    columns = ["count", "pmi", "llr"]
+
+    if len(counts) == 0:
+        return pd.DataFrame(columns=columns)
+
+    total = counters["total"]
+    parts = [counts.index.get_level_values(k).to_numpy() for k in range(n)]
+    frequencies = [counters["unigrams"].reindex(
+        part).to_numpy(dtype="float64") for part in parts]
+
+    k11 = counts.to_numpy(dtype="float64")
+    pmi = np.log2(k11 * total ** (n - 1) / np.prod(frequencies, axis=0))
+
+    if n == 2:
+        llr = get_log_likelihood(k11, frequencies[0], frequencies[1], total)
+    else:
+
+        # For the trigrams we test both ways of splitting them into a bigram and
+        # a lemma and keep the lowest score, a trigram that only extends a
+        # strong bigram with a random lemma gets a low score.
+        first = get_bigram_counts(counters, parts[0], parts[1], k11)
+        last = get_bigram_counts(counters, parts[1], parts[2], k11)
+
+        llr = np.minimum(get_log_likelihood(k11, first, frequencies[2], total),
+                         get_log_likelihood(k11, frequencies[0], last, total))
+
+    # The ratio is high for lemmas that avoid each other too, we make it
+    # negative for them so they are sorted last.
+    llr = np.where(pmi > 0, llr, -llr)
+
+    lemmas = counters["lemmas"]
+    phrases = [" ".join(words) for words in zip(
+        *[lemmas.reindex(part).to_numpy() for part in parts])]
+
+    df = pd.DataFrame({"count": counts.to_numpy(), "pmi": pmi, "llr": llr},
+                      index=phrases, columns=columns)
+
+    return df.sort_values("llr", ascending=False)
+
+
+def get_top_phrases(counters, top=1000, min_count=MIN_COUNT):
+    """Gets the best bigram and trigram collocations together.
+
+    Parameters
+    ----------
+    counters : dict
+        The n-gram counters.
+
+    top : int
+        The number of phrases.
+
+    min_count : int
+        The n-grams with fewer occurrences are not scored.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The best phrases sorted by the log-likelihood ratio.
+
+    """
+
+    df = pd.concat([get_collocations(counters, n, min_count)
+                    for n in NGRAM_NAMES.keys()])
+
+    return df.sort_values("llr", ascending=False)[0:top]
+
+
+def load_counters(file_path, chunksize=aggregates.CHUNK_SIZE):
+    """Counts a tokens csv file or loads the counters saved by --save.
+
+    Parameters
+    ----------
+    file_path : str
+        A tokens csv file or a .pickle file with counters.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    dict
+        The counters.
+
+    """
+
+    if file_path.endswith(".pickle"):
+        with open(file_path, "rb") as counters_file:
+            return pickle.load(counters_file)
+
+    return count_ngrams(file_path, chunksize)
+
+
+def main():
+    """Parses the command line arguments and prints the best phrases."""
+
+    parser = argparse.ArgumentParser(
+        description="Counts and scores the bigrams and trigrams of the tokens csv files.")
+
+    parser.add_argument("files", nargs="+",
+                        help="Tokens csv files or counters saved with --save, they are merged.")
+
+    parser.add_argument("--top", type=int, default=50,
+                        help="The number of phrases to print.")
+
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT,
+                        help="The n-grams with fewer occurrences are not scored.")
+
+    parser.add_argument("--sort", choices=["llr", "pmi", "count"], default="llr",
+                        help="How to sort the phrases.")
+
+    parser.add_argument("--save",
+                        help="Save the merged counters to this .pickle file.")
+
+    parser.add_argument("--chunksize", type=int, default=aggregates.CHUNK_SIZE,
+                        help="How many rows are read at a time.")
+
+    args = parser.parse_args()
+
+    counters = new_counters()
+
+    for file_path in args.files:
+        counters = merge_counters(counters, load_counters(file_path, args.chunksize))
+
+    if args.save:
+        with open(args.save, "wb") as counters_file:
+            pickle.dump(counters, counters_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if counters["pruned"] > 0:
+        print("Counts may be underestimated by up to:", counters["pruned"])
+
+    for n, name in NGRAM_NAMES.items():
+        print("\nTop {}:\n".format(name))
+        df = get_collocations(counters, n, args.min_count)
+        print(df.sort_values(args.sort, ascending=False)[0:args.top])
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,323 @@
+"""
+This script creates the authors leaderboards (the data/ranks.txt file) from the submissions
+and comments csv files in one streaming pass.
+
+It has 2 modes, the exact mode counts every author and the approximate mode only keeps
+a fixed number of candidates and estimates their counts with a Count-Min sketch, this
+allows getting the top authors of datasets that don't fit in memory.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import fileio
+
+
+# How many candidates the approximate mode keeps, it should be several times
+# bigger than the number of authors in the leaderboard.
+CAPACITY = 10000
+
+# The size of the Count-Min sketch (2 MB), the counts are overestimated by at most
+# 2 / width of the total with a probability of 1 - 0.5 ** depth. The monthly
+# leaderboards share a second sketch, their total is the one of all the months.
+SKETCH_DEPTH = 4
+SKETCH_WIDTH = 2 ** 16
+
+
+def new_summary(mode, sketch=None, prefix=""):
+    """Creates an empty summary of author counts.
+
+    Parameters
+    ----------
+    mode : str
+        Either exact or approximate.
+
+    sketch : numpy.ndarray
+        A Count-Min sketch shared with other summaries, by default a new one.
+
+    prefix : str
+        Added to the authors names before hashing them, the summaries that
+        share a sketch need different prefixes.
+
+    Returns
+    -------
+    dict
+        The empty summary.
+
+    """
+
+    summary = {"total": 0, "counts": pd.Series(dtype="int64")}
+
+    if mode == "approximate":
+
+        if sketch is None:
+            sketch = np.zeros((SKETCH_DEPTH, SKETCH_WIDTH), dtype="int64")
+
+        summary["sketch"] = sketch
+        summary["prefix"] = prefix
+
+    return summary
+
+
+def get_sketch_columns(authors, prefix=""):
+    """Hashes the authors to one column of each row of the Count-Min sketch.
+
+    Parameters
+    ----------
+    authors : pandas.Index
+        The authors names.
+
+    prefix : str
+        Added to the authors names before hashing them.
+
+    Returns
+    -------
+    numpy.ndarray
+        A (SKETCH_DEPTH, len(authors)) array of column numbers.
+
+    """
+
+    values = (prefix + authors.astype("str")).to_numpy(dtype="object")
+
+    # Each row uses a different hash key, this makes the rows independent.
+    return np.stack([
+        pd.util.hash_array(values, hash_key="ranks{:011d}".format(row)) % SKETCH_WIDTH
+        for row in range(SKETCH_DEPTH)]).astype("int64")
+
+
+def update_summary(summary, chunk_counts, capacity=CAPACITY):
+    """Adds the author counts of one chunk to the summary.
+
+    In the approximate mode the candidates are pruned with the mergeable
+    Misra-Gries rule (the counter based form of Space-Saving), an author
+    that is not kept can't have more than 'total / capacity' records.
+
+    Parameters
+    ----------
+    summary : dict
+        The summary that will be updated in place.
+
+    chunk_counts : pandas.Series
+        The counts of each author in the chunk.
+
+    capacity : int
+        How many candidates the approximate mode keeps.
+
+    """
+
+    summary["total"] += int(chunk_counts.sum())
+    counts = summary["counts"].add(chunk_counts, fill_value=0).astype("int64")
+
+    if "sketch" in summary:
+
+        columns = get_sketch_columns(chunk_counts.index, summary["prefix"])
+
+        for row in range(SKETCH_DEPTH):
+            np.add.at(summary["sketch"][row], columns[row], chunk_counts.to_numpy())
+
+        if len(counts) > capacity:
+            counts = counts.sort_values(ascending=False)
+            counts = counts.iloc[:capacity] - counts.iloc[capacity]
+            counts = counts[counts > 0]
+
+    summary["counts"] = counts
+
+
+def get_leaderboard(summary, top):
+    """Gets the top authors of a summary.
+
+    Parameters
+    ----------
+    summary : dict
+        The exact or approximate summary.
+
+    top : int
+        The number of authors in the leaderboard.
+
+    Returns
+    -------
+    pandas.Series
+        The counts of the top authors sorted from highest to lowest.
+
+    """
+
+    counts = summary["counts"]
+
+    if "sketch" in summary and len(counts) > 0:
+
+        # The pruned counts are lower bounds, we use the sketch to
+        # estimate the real counts of the remaining candidates.
+        columns = get_sketch_columns(counts.index, summary["prefix"])
+        estimates = summary["sketch"][np.arange(SKETCH_DEPTH)[:, None], columns].min(axis=0)
+        counts = pd.Series(estimates, index=counts.index)
+
+    return counts.sort_values(ascending=False, kind="stable")[0:top]
+
+
+def write_leaderboard(leaderboard, file_path):
+    """Saves a leaderboard with the same format as data/ranks.txt
+
+    Parameters
+    ----------
+    leaderboard : pandas.Series
+        The counts of the top authors sorted from highest to lowest.
+
+    file_path : str
+        The path of the leaderboard file.
+
+    """
+
+    with fileio.open_text(file_path, "w") as ranks_file:
+        for rank, (author, count) in enumerate(leaderboard.items(), 1):
+            ranks_file.write("{} {} {}\n".format(rank, author, count))
+
+
+def read_authors(file_paths, chunksize=aggregates.CHUNK_SIZE):
+    """Reads the created_utc and author columns of csv files in chunks.
+
+    Parameters
+    ----------
+    file_paths : list
+        The paths of the submissions or comments csv files.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Yields
+    ------
+    pandas.DataFrame
+        A chunk with the created_utc and author columns.
+
+    """
+
+    for file_path in file_paths:
+
+        reader = pd.read_csv(file_path,
+                             usecols=lambda column: column in [
+                                 "created_utc", "datetime", "author"],
+                             dtype={"author": "str"}, keep_default_na=False,
+                             chunksize=chunksize)
+
+        for df in reader:
+            df["created_utc"] = aggregates.read_created_utc(df)
+            yield df[["created_utc", "author"]]
+
+
+def get_summaries(file_paths, mode="exact", monthly=False, keep_deleted=False,
+                  capacity=CAPACITY, chunksize=aggregates.CHUNK_SIZE):
+    """Counts the records of each author in one pass over the csv files.
+
+    Parameters
+    ----------
+    file_paths : list
+        The paths of the submissions or comments csv files.
+
+    mode : str
+        Either exact or approximate.
+
+    monthly : bool
+        Also create a summary for each month (UTC). In the approximate mode
+        all the months share one sketch, its memory doesn't grow with the
+        date range and the files don't need to be sorted.
+
+    keep_deleted : bool
+        Keep the [deleted] user.
+
+    capacity : int
+        How many candidates the approximate mode keeps.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    dict
+        The summary of all the records keyed by None and, if requested,
+        the summary of each month keyed by 'YYYY-MM'.
+
+    """
+
+    summaries = {None: new_summary(mode)}
+
+    # The authors of each month are hashed with the month, e.g. '2019-06 author',
+    # so the months don't mix their counts in the shared sketch.
+    monthly_sketch = new_summary(mode).get("sketch") if monthly else None
+
+    for df in read_authors(file_paths, chunksize):
+
+        if not keep_deleted:
+            df = df[df["author"] != "[deleted]"]
+
+        update_summary(summaries[None], df["author"].value_counts(), capacity)
+
+        if not monthly:
+            continue
+
+        months = pd.to_datetime(
+            df["created_utc"], unit="s", utc=True).dt.strftime("%Y-%m")
+
+        for month, month_counts in df.groupby(months)["author"]:
+
+            if month not in summaries:
+                summaries[month] = new_summary(mode, monthly_sketch, month + " ")
+
+            update_summary(summaries[month], month_counts.value_counts(), capacity)
+
+    return summaries
+
+
+def main():
+    """Parses the command line arguments and saves the leaderboards."""
+
+    parser = argparse.ArgumentParser(
+        description="Creates the authors leaderboards from the submissions or comments csv files.")
+
+    parser.add_argument("files", nargs="+",
+                        help="The submissions or comments csv files.")
+
+    parser.add_argument("--output", default="ranks.txt",
+                        help="The leaderboard file, the monthly ones are saved next to it.")
+
+    parser.add_argument("--top", type=int, default=100,
+                        help="The number of authors in each leaderboard.")
+
+    parser.add_argument("--mode", choices=["exact", "approximate"], default="exact",
+                        help="The approximate mode uses bounded memory.")
+
+    parser.add_argument("--capacity", type=int, default=CAPACITY,
+                        help="How many candidates the approximate mode keeps.")
+
+    parser.add_argument("--monthly", action="store_true",
+                        help="Also create one leaderboard for each month.")
+
+    parser.add_argument("--keep-deleted", action="store_true",
+                        help="Keep the [deleted] user in the leaderboards.")
+
+    parser.add_argument("--chunksize", type=int, default=aggregates.CHUNK_SIZE,
+                        help="How many rows are read at a time.")
+
+    args = parser.parse_args()
+
+    summaries = get_summaries(args.files, args.mode, args.monthly,
+                              args.keep_deleted, args.capacity, args.chunksize)
+
+    base_path, extension = os.path.splitext(args.output)
+
+    for period, summary in sorted(summaries.items(), key=lambda item: item[0] or ""):
+
+        if period is None:
+            file_path = args.output
+        else:
+            file_path = "{}-{}{}".format(base_path, period, extension)
+
+        write_leaderboard(get_leaderboard(summary, args.top), file_path)
+        print("Saved:", file_path)
+
+
+if __name__ == "__main__":
+
+    main()
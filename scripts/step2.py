@@ -3,10 +3,53 @@ This script extracts features from the comments csv file and saves them to .csv
 so they can be used in any toolkkit.
 """
 
+import argparse
 import csv
 import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 
-import spacy
+import fileio
+import metrics
+
+
+# The default subreddit, its comments are read from ./<subreddit>-comments.csv
+SUBREDDIT = "mexico"
+
+# How many random comments are processed.
+SAMPLE_SIZE = 50000
+
+# Optional: The default of the --database option, also save the tokens and entities
+# to this SQLite database (see store.py).
+DATABASE_FILE = None
+
+# Optional: The default of the --corpus option, also save the tokens to this folder
+# as a memory-mapped corpus (see tokencorpus.py).
+CORPUS_DIR = None
+
+# Optional: The default of the --dedup option, use the duplicates report of dedup.py,
+# 'drop' only keeps the first comment of each cluster of duplicates and 'weight'
+# makes them less likely to be sampled.
+DEDUP_MODE = None
+DEDUP_FILE = "./{}-dedup.csv"
+
+# The spaCy model, see main() on how to install it.
+MODEL = "es_core_news_sm"
+
+# How many comments nlp.pipe() sends to the pipeline at a time.
+BATCH_SIZE = 1000
+
+# How many processes pass the comments into the NLP pipeline, each one loads the model once.
+NLP_WORKERS = 1
+
+# The columns of the tokens and entities csv files.
+TOKENS_COLUMNS = ["text", "text_lower", "lemma", "lemma_lower", "part_of_speech",
+                  "is_alphabet", "is_stopword", "comment_id", "created_utc"]
+
+ENTITIES_COLUMNS = ["text", "text_lower", "label", "comment_id", "created_utc"]
+
+# The models loaded by this process, spaCy is only imported when the first one is loaded.
+NLP_MODELS = dict()
 
 
 def main():
@@ -18,78 +61,381 @@ def main():
 
     """
 
+    parser = argparse.ArgumentParser(
+        description="Extracts the tokens and entities of a random sample of comments.")
+
+    parser.add_argument("--subreddit", default=SUBREDDIT,
+                        help="The subreddit, its comments are read from ./<subreddit>-comments.csv (or .csv.zst / .csv.gz)")
+
+    parser.add_argument("--tokens", default="./tokens.csv",
+                        help="The tokens csv file, .gz and .zst files are compressed.")
+
+    parser.add_argument("--entities", default="./entities.csv",
+                        help="The entities csv file, .gz and .zst files are compressed.")
+
+    parser.add_argument("--sample-size", type=int, default=SAMPLE_SIZE,
+                        help="How many random comments are processed.")
+
+    parser.add_argument("--dedup", choices=["drop", "weight"], default=DEDUP_MODE,
+                        help="Use the duplicates report of dedup.py (./<subreddit>-dedup.csv), 'drop' only keeps "
+                        "the first comment of each cluster and 'weight' makes the duplicates less likely to be sampled.")
+
+    parser.add_argument("--database", default=DATABASE_FILE,
+                        help="Also save the tokens and entities to this SQLite database (see store.py).")
+
+    parser.add_argument("--corpus", default=CORPUS_DIR,
+                        help="Also save the tokens to this folder as a memory-mapped corpus (see tokencorpus.py).")
+
+    parser.add_argument("--workers", type=int, default=NLP_WORKERS,
+                        help="How many processes pass the comments into the NLP pipeline.")
+
+    parser.add_argument("--metrics",
+                        help="Save the timings of each stage and NLP batch to this file, "
+                        ".prom files use the Prometheus text format (see metrics.py).")
+
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.configure(args.metrics)
+
     comments_list = list()
+    weights_list = list()
+
+    duplicates = dict()
+
+    # dedup.py needs pandas and numpy, they are only imported when a report is used.
+    if args.dedup:
+        import dedup
+        import numpy as np
+
+        duplicates = dedup.read_report(DEDUP_FILE.format(args.subreddit), args.dedup)
+
+    comments_file = fileio.find_file("./{}-comments.csv".format(args.subreddit))
+
+    # We keep the id and timestamp of each comment, the tokens and entities are linked to them.
+    with metrics.span("read_comments") as span, fileio.open_text(comments_file) as csv_file:
+        for row_number, row in enumerate(csv.DictReader(csv_file)):
+
+            weight = duplicates.get(row_number, 1.0)
+
+            if weight == 0:
+                continue
+
+            comments_list.append(
+                {"id": get_comment_id(row, row_number), "created_utc": get_created_utc(row),
+                 "body": row["body"]})
+            weights_list.append(weight)
+
+        span["rows"] = len(comments_list)
 
-    for row in csv.DictReader(open("./mexico-comments.csv", "r", encoding="utf-8")):
-        comments_list.append(row["body"])
+    # We take 50,000 random comments from the comments list, or all of them
+    # when the subreddit has fewer comments.
+    sample_size = min(args.sample_size, len(comments_list))
 
-    # We take 50,000 random comments from the comments list.
-    corpus = random.sample(comments_list, 50000)
-    
-    nlp = spacy.load("es_core_news_sm")
+    if args.dedup == "weight":
+        probabilities = np.array(weights_list) / sum(weights_list)
+        corpus = [comments_list[position] for position in np.random.choice(
+            len(comments_list), sample_size, replace=False, p=probabilities)]
+    else:
+        corpus = random.sample(comments_list, sample_size)
 
-    # Our corpus is bigger than the default limit, we will set
-    # a new limit.
-    nlp.max_length = 10000000
+    with metrics.span("extract"):
+        tokens, entities = extract_features(corpus, args.workers)
 
-    get_tokens(nlp, corpus)
-    get_entities(nlp, corpus)
+    connection = None
 
+    if args.database:
+        import store
 
-def get_tokens(nlp, corpus):
-    """Get the tokens and save them to .csv
+        connection = store.connect(args.database)
+
+    save_tokens(tokens, connection, args.subreddit, args.tokens, args.corpus)
+    save_entities(entities, connection, args.subreddit, args.entities)
+
+    metrics.flush()
+
+
+def get_comment_id(row, row_number):
+    """Gets the id of a comment.
+
+    The comments files downloaded before the id column was added don't have it,
+    their comments are identified by their row number instead.
 
     Parameters
     ----------
-    nlp : spacy.nlp
-        A nlp object.
+    row : dict
+        The comment row from the csv file.
+
+    row_number : int
+        The position of the row in the csv file, starting at 0.
+
+    Returns
+    -------
+    str
+        The id of the comment.
+
+    """
+
+    return row.get("id") or "row-{}".format(row_number)
+
+
+def get_created_utc(row):
+    """Gets the UTC timestamp of a comment.
+
+    Older comments files have a datetime column with ISO dates instead of
+    the created_utc column, we treat those dates as UTC like aggregates.py does.
+
+    Parameters
+    ----------
+    row : dict
+        The comment row from the csv file.
+
+    Returns
+    -------
+    int
+        The seconds since the epoch.
+
+    """
+
+    if row.get("created_utc"):
+        return int(float(row["created_utc"]))
+
+    date = datetime.fromisoformat(row["datetime"])
+
+    return int(date.replace(tzinfo=timezone.utc).timestamp())
 
-    corpus : list
-        All the comments in a list.
+
+def load_model(model=MODEL):
+    """Loads a spaCy model, it is only loaded once per process.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model.
+
+    Returns
+    -------
+    spacy.language.Language
+        The nlp object.
 
     """
 
-    data_list = [["text", "text_lower", "lemma", "lemma_lower",
-                  "part_of_speech", "is_alphabet", "is_stopword"]]
+    if model not in NLP_MODELS:
 
-    for i in range(0, len(corpus), 1000):
+        # spaCy takes seconds to import, we only pay for it when there is NLP to do.
+        import spacy
 
-        doc = nlp(" ".join(corpus[i:i+1000]))
+        with metrics.span("load_model", model=model):
+            NLP_MODELS[model] = spacy.load(model)
 
-        for token in doc:
-            data_list.append([
-                token.text, token.lower_, token.lemma_, token.lemma_.lower(),
-                token.pos_, token.is_alpha, token.is_stop
-            ])
+    return NLP_MODELS[model]
 
-    with open("./tokens.csv", "w", encoding="utf-8", newline="") as tokens_file:
-        csv.writer(tokens_file).writerows(data_list)
 
+def get_features(nlp, rows):
+    """Passes a batch of comments into the NLP pipeline and gets their tokens and entities.
 
-def get_entities(nlp, corpus):
-    """Get the entities and save them to .csv
+    Each comment is parsed once, the tokens and the entities come from the same doc.
+    Each token and entity is saved with the id and timestamp of its comment, this keeps
+    the token sequence of each comment for the n-grams (see ngrams.py) and allows
+    finding which entities are mentioned together.
 
     Parameters
     ----------
-    nlp : spacy.nlp
+    nlp : spacy.language.Language
         A nlp object.
 
+    rows : list
+        The comments, each one is a dict with their id, created_utc and body.
+
+    Returns
+    -------
+    tuple
+        The tokens rows and the entities rows.
+
+    """
+
+    tokens = list()
+    entities = list()
+
+    with metrics.span("nlp_batch") as span:
+
+        # We process one comment at a time so the n-grams don't cross comments,
+        # nlp.pipe() still sends them to the pipeline in batches of 1,000.
+        docs = nlp.pipe((row["body"] for row in rows), batch_size=BATCH_SIZE)
+
+        for row, doc in zip(rows, docs):
+
+            for token in doc:
+                tokens.append([
+                    token.text, token.lower_, token.lemma_, token.lemma_.lower(),
+                    token.pos_, token.is_alpha, token.is_stop,
+                    row["id"], row["created_utc"]
+                ])
+
+            for ent in doc.ents:
+                entities.append([ent.text, ent.lower_, ent.label_,
+                                 row["id"], row["created_utc"]])
+
+        span["items"] = len(rows)
+
+    metrics.increment("nlp_docs_total", len(rows))
+
+    return tokens, entities
+
+
+def process_batch(rows, model=MODEL):
+    """Gets the tokens and entities of a batch inside a worker process.
+
+    The model is loaded by the first batch of each worker and reused by the next ones.
+
+    Parameters
+    ----------
+    rows : list
+        The comments, each one is a dict with their id, created_utc and body.
+
+    model : str
+        The name of the model.
+
+    Returns
+    -------
+    tuple
+        The tokens rows and the entities rows.
+
+    """
+
+    return get_features(load_model(model), rows)
+
+
+def extract_features(corpus, workers=NLP_WORKERS, model=MODEL):
+    """Gets the tokens and entities of all the comments.
+
+    Parameters
+    ----------
     corpus : list
-        All the comments in a list.
+        All the comments in a list, each one is a dict with their id,
+        created_utc and body.
+
+    workers : int
+        How many processes pass the comments into the NLP pipeline,
+        with 1 everything runs in this process.
+
+    model : str
+        The name of the model.
+
+    Returns
+    -------
+    tuple
+        The tokens rows and the entities rows, in the same order as the corpus.
+
+    """
+
+    batches = [corpus[start:start + BATCH_SIZE] for start in range(0, len(corpus), BATCH_SIZE)]
+
+    tokens = list()
+    entities = list()
+
+    if workers <= 1:
+        nlp = load_model(model)
+
+        for batch in batches:
+            batch_tokens, batch_entities = get_features(nlp, batch)
+            tokens.extend(batch_tokens)
+            entities.extend(batch_entities)
+
+        return tokens, entities
+
+    # Each worker loads the model when it starts, the metrics of every
+    # batch are sent back with its result.
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_model,
+                             initargs=(model,)) as executor:
+
+        futures = [executor.submit(metrics.collect, process_batch, batch, model)
+                   for batch in batches]
+
+        for future in futures:
+            (batch_tokens, batch_entities), snapshot = future.result()
+            metrics.merge(snapshot)
+
+            tokens.extend(batch_tokens)
+            entities.extend(batch_entities)
+
+    return tokens, entities
+
+
+def save_tokens(tokens, connection=None, subreddit=SUBREDDIT, file_path="./tokens.csv",
+                corpus_dir=CORPUS_DIR):
+    """Saves the tokens to .csv
+
+    Parameters
+    ----------
+    tokens : list
+        The tokens rows from extract_features().
+
+    connection : sqlite3.Connection
+        An optional database connection that will also save the tokens.
+
+    subreddit : str
+        The subreddit of the comments.
+
+    file_path : str
+        The path of the tokens csv file.
+
+    corpus_dir : str
+        An optional folder that will also save the tokens as a binary corpus.
 
     """
 
-    data_list = [["text", "text_lower", "label"]]
-    
-    for i in range(0, len(corpus), 1000):
+    with fileio.open_text(file_path, "w") as tokens_file:
+        writer = csv.writer(tokens_file)
+        writer.writerow(TOKENS_COLUMNS)
+        writer.writerows(tokens)
+
+    # The rows of a previous run of the same subreddit are replaced, like the csv file.
+    if connection is not None:
+        import store
+
+        store.delete_rows(connection, "tokens", subreddit)
+        store.insert_rows(connection, "tokens", subreddit, tokens)
+
+    if corpus_dir is not None:
+
+        # The corpus needs pandas, it is only imported when the corpus is written.
+        import pandas as pd
+        import tokencorpus
+
+        tokencorpus.write_corpus(corpus_dir, [pd.DataFrame(tokens, columns=TOKENS_COLUMNS)])
+
+
+def save_entities(entities, connection=None, subreddit=SUBREDDIT, file_path="./entities.csv"):
+    """Saves the entities to .csv
+
+    Parameters
+    ----------
+    entities : list
+        The entities rows from extract_features().
+
+    connection : sqlite3.Connection
+        An optional database connection that will also save the entities.
+
+    subreddit : str
+        The subreddit of the comments.
+
+    file_path : str
+        The path of the entities csv file.
+
+    """
 
-        doc = nlp(" ".join(corpus[i:i+1000]))
+    with fileio.open_text(file_path, "w") as entities_file:
+        writer = csv.writer(entities_file)
+        writer.writerow(ENTITIES_COLUMNS)
+        writer.writerows(entities)
 
-        for ent in doc.ents:
-            data_list.append([ent.text, ent.lower_, ent.label_])
+    # The rows of a previous run of the same subreddit are replaced, like the csv file.
+    if connection is not None:
+        import store
 
-    with open("./entities.csv", "w", encoding="utf-8", newline="") as entities_file:
-        csv.writer(entities_file).writerows(data_list)
+        store.delete_rows(connection, "entities", subreddit)
+        store.insert_rows(connection, "entities", subreddit, entities)
 
 
 if __name__ == "__main__":
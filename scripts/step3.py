@@ -1,29 +1,21 @@
 """
 This script contains several functions that will create plots and generate insights from
 the 4 datasets (submissions, comments, tokens and entities).
+
+The datasets are read in chunks and reduced to small aggregates (see aggregates.py),
+all the plots and insights are built from those aggregates.
 """
 
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import seaborn as sns
-import wordcloud
-from pandas.plotting import register_matplotlib_converters
-from PIL import Image
-
-register_matplotlib_converters()
-
-sns.set(style="ticks",
-        rc={
-            "figure.figsize": [12, 7],
-            "text.color": "white",
-            "axes.labelcolor": "white",
-            "axes.edgecolor": "white",
-            "xtick.color": "white",
-            "ytick.color": "white",
-            "axes.facecolor": "#222222",
-            "figure.facecolor": "#222222"}
-        )
+import argparse
+import functools
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import cache
+import fileio
+import metrics
 
 
 MASK_FILE = "./assets/cloud.png"
@@ -31,75 +23,141 @@ FONT_FILE = "./assets/sofiapro-light.otf"
 EN_STOPWORDS = "./assets/stopwords-en.txt"
 ES_STOPWORDS = "./assets/stopwords-es.txt"
 
+# The default subreddit, its submissions and comments are read from
+# <subreddit>-submissions.csv and <subreddit>-comments.csv
+SUBREDDIT = "mexico"
+
+# The timezone used for the weekday and hour plots, the daily counts are always in UTC.
+DISPLAY_TIMEZONE = "UTC"
+
+# How many processes are used to render the figures.
+RENDER_WORKERS = os.cpu_count()
+
+
+@functools.lru_cache(maxsize=None)
+def get_pyplot():
+    """Imports matplotlib and seaborn and sets the style of the plots.
+
+    They take seconds to import, only the figures need them so they are
+    imported the first time a figure is rendered in each process.
+
+    Returns
+    -------
+    module
+        The matplotlib.pyplot module.
+
+    """
+
+    import matplotlib
+
+    # The figures are only saved to disk, we don't need an interactive backend.
+    matplotlib.use("Agg")
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from pandas.plotting import register_matplotlib_converters
+
+    register_matplotlib_converters()
+
+    sns.set(style="ticks",
+            rc={
+                "figure.figsize": [12, 7],
+                "text.color": "white",
+                "axes.labelcolor": "white",
+                "axes.edgecolor": "white",
+                "xtick.color": "white",
+                "ytick.color": "white",
+                "axes.facecolor": "#222222",
+                "figure.facecolor": "#222222"}
+            )
+
+    return plt
+
+
+def get_mask():
+    """Loads the mask of the word clouds from our cloud image.
+
+    Returns
+    -------
+    numpy.ndarray
+        The mask.
+
+    """
+
+    import numpy as np
+    from PIL import Image
+
+    return np.array(Image.open(MASK_FILE))
+
 
-def get_most_common_domains(df):
+def get_most_common_domains(submissions):
     """Prints the 20 most frequent domains from submissions.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The submissions DataFrame.
+    submissions : dict
+        The submissions aggregates.
 
     """
 
-    df = df["domain"].value_counts()[0:20]
+    df = submissions["domains"].sort_values(ascending=False)[0:20]
     print(df)
 
 
-def get_most_common_submitters(df):
+def get_most_common_submitters(submissions):
     """Prints the 20 most frequent submitters.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The submissions DataFrame.
+    submissions : dict
+        The submissions aggregates.
 
     """
 
     # Optional: Remove the [deleted] user.
-    df.drop(df[df["author"] == "[deleted]"].index, inplace=True)
+    df = submissions["authors"].drop("[deleted]", errors="ignore")
 
-    df = df["author"].value_counts()[0:20]
+    df = df.sort_values(ascending=False)[0:20]
     print(df)
 
 
-def get_most_common_commenters(df):
+def get_most_common_commenters(comments):
     """Prints the 20 most frequent commenters.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The comments DataFrame.
+    comments : dict
+        The comments aggregates.
 
     """
 
     # Optional: Remove the [deleted] user.
-    df.drop(df[df["author"] == "[deleted]"].index, inplace=True)
+    df = comments["authors"].drop("[deleted]", errors="ignore")
 
-    df = df["author"].value_counts()[0:20]
+    df = df.sort_values(ascending=False)[0:20]
     print(df)
 
 
-def get_insights(df, df2):
+def get_insights(submissions, comments):
     """Prints several interesting insights.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The submissions DataFrame.
+    submissions : dict
+        The submissions aggregates.
 
-    df2 : pandas.DataFrame
-        The comments DataFrame.
+    comments : dict
+        The comments aggregates.
 
     """
 
     # Get DataFrame totals.
-    print("Total submissions:", len(df))
-    print("Total comments:", len(df2))
+    print("Total submissions:", submissions["total"])
+    print("Total comments:", comments["total"])
 
     # Get unique submitters and commenters.
-    submitters_set = set(df.groupby("author").count().index.tolist())
-    commenters_set = set(df2.groupby("author").count().index.tolist())
+    submitters_set = set(submissions["authors"].index.tolist())
+    commenters_set = set(comments["authors"].index.tolist())
 
     print("Total Submitters:", len(submitters_set))
     print("Total Commenters:", len(commenters_set))
@@ -111,109 +169,124 @@ def get_insights(df, df2):
     print("Not common commenters:", len(
         commenters_set.difference(submitters_set)))
 
+    import aggregates
+
     print("\Submissions stats:\n")
-    resampled_submissions = df.resample("D").count()
-    print("Most submissions on:", resampled_submissions.idxmax()["author"])
-    print("Least submissions on:", resampled_submissions.idxmin()["author"])
+    resampled_submissions = aggregates.get_daily_counts(submissions)
+    print("Most submissions on:", resampled_submissions.idxmax())
+    print("Least submissions on:", resampled_submissions.idxmin())
     print(resampled_submissions.describe())
 
     print("\nComments stats:\n")
-    resampled_comments = df2.resample("D").count()
-    print("Most comments on:", resampled_comments.idxmax()["author"])
-    print("Least comments on:", resampled_comments.idxmin()["author"])
+    resampled_comments = aggregates.get_daily_counts(comments)
+    print("Most comments on:", resampled_comments.idxmax())
+    print("Least comments on:", resampled_comments.idxmin())
     print(resampled_comments.describe())
 
 
-def plot_submissions_and_comments_by_weekday(df, df2):
+def plot_submissions_and_comments_by_weekday(submissions, comments, timezone=DISPLAY_TIMEZONE):
     """Creates a vertical bar plot with the percentage of
     submissions and comments by weekday.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The submissions DataFrame.
+    submissions : dict
+        The submissions aggregates.
+
+    comments : dict
+        The comments aggregates.
 
-    df2 : pandas.DataFrame
-        The comments DataFrame.
+    timezone : str
+        The timezone used to get the weekdays.
 
     """
 
+    import aggregates
+
+    plt = get_pyplot()
+
     # Days of the week in English.
     labels = ["Monday", "Tuesday", "Wednesday",
               "Thursday", "Friday", "Saturday", "Sunday"]
 
     # These will be used for calculating percentages.
-    total = len(df)
-    total2 = len(df2)
-
-    # 0 to 6 (Monday to Sunday).
-    submissions_weekdays = {i: 0 for i in range(0, 7)}
-    comments_weekdays = {i: 0 for i in range(0, 7)}
+    total = submissions["total"]
+    total2 = comments["total"]
 
-    # We filter the DataFrames and set each weekday value
+    # 0 to 6 (Monday to Sunday), each weekday value is
     # equal to its number of records.
-    for k, v in submissions_weekdays.items():
-        submissions_weekdays[k] = len(df[df.index.weekday == k])
+    submissions_weekdays = aggregates.get_weekday_counts(
+        submissions, timezone).to_dict()
+    comments_weekdays = aggregates.get_weekday_counts(
+        comments, timezone).to_dict()
 
-    for k, v in comments_weekdays.items():
-        comments_weekdays[k] = len(df2[df2.index.weekday == k])
+    fig, ax = plt.subplots()
 
     # The first set of vertical bars have a little offset to the left.
     # This is so the next set of bars can fit in the same place.
-    bars = plt.bar([i - 0.2 for i in submissions_weekdays.keys()], [(i / total) * 100 for i in submissions_weekdays.values()], 0.4,
-                   color="#1565c0", linewidth=0)
+    bars = ax.bar([i - 0.2 for i in submissions_weekdays.keys()], [(i / total) * 100 for i in submissions_weekdays.values()], 0.4,
+                  color="#1565c0", linewidth=0)
 
     # This loop creates small texts with the absolute values above each bar.
     for bar in bars:
         height = bar.get_height()
         real_value = int((height * total) / 100)
 
-        plt.text(bar.get_x() + bar.get_width()/2.0, height,
-                 "{:,}".format(real_value), ha="center", va="bottom")
+        ax.text(bar.get_x() + bar.get_width()/2.0, height,
+                "{:,}".format(real_value), ha="center", va="bottom")
 
     # This set of bars have a little offset to the right so they can fit
     # with the previous ones.
-    bars2 = plt.bar([i + 0.2 for i in comments_weekdays.keys()], [(i / total2) * 100 for i in comments_weekdays.values()], 0.4,
-                    color="#f9a825", linewidth=0)
+    bars2 = ax.bar([i + 0.2 for i in comments_weekdays.keys()], [(i / total2) * 100 for i in comments_weekdays.values()], 0.4,
+                   color="#f9a825", linewidth=0)
 
     # This loop creates small texts with the absolute values above each bar (second set of bars).
     for bar2 in bars2:
         height2 = bar2.get_height()
         real_value2 = int((height2 * total2) / 100)
 
-        plt.text(bar2.get_x() + bar2.get_width()/2.0, height2,
-                 "{:,}".format(real_value2), ha="center", va="bottom")
+        ax.text(bar2.get_x() + bar2.get_width()/2.0, height2,
+                "{:,}".format(real_value2), ha="center", va="bottom")
 
     # We remove the top and right spines.
-    plt.gca().spines["top"].set_visible(False)
-    plt.gca().spines["right"].set_visible(False)
+    ax.spines["top"].set_visible(False)
+    ax.spines["right"].set_visible(False)
 
     # For the xticks we use the previously defined English weekdays.
-    plt.xticks(list(submissions_weekdays.keys()), labels)
+    ax.set_xticks(list(submissions_weekdays.keys()))
+    ax.set_xticklabels(labels)
 
     # We add final customizations.
-    plt.xlabel("Day of the Week")
-    plt.ylabel("Percentage")
-    plt.title("Submissions and Comments by Day")
-    plt.legend(["Submissions", "Comments"])
-    plt.tight_layout()
-    plt.savefig("submissionsandcommentsbyweekday.png", facecolor="#222222")
+    ax.set_xlabel("Day of the Week")
+    ax.set_ylabel("Percentage")
+    ax.set_title("Submissions and Comments by Day")
+    ax.legend(["Submissions", "Comments"])
+    fig.tight_layout()
+    fig.savefig("submissionsandcommentsbyweekday.png", facecolor="#222222")
+    plt.close(fig)
 
 
-def plot_submissions_and_comments_by_hour(df, df2):
+def plot_submissions_and_comments_by_hour(submissions, comments, timezone=DISPLAY_TIMEZONE):
     """Creates a horizontal bar plot with the percentage of
     submissions and comments by hour of the day.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The submissions DataFrame.
+    submissions : dict
+        The submissions aggregates.
+
+    comments : dict
+        The comments aggregates.
 
-    df2 : pandas.DataFrame
-        The comments DataFrame.
+    timezone : str
+        The timezone used to get the hours.
 
     """
 
+    import aggregates
+
+    plt = get_pyplot()
+
     # The hours of the day labels, from midnight to 11 pm.
     labels = ["00:00", "01:00", "02:00", "03:00", "04:00", "05:00",
               "06:00", "07:00", "08:00", "09:00", "10:00", "11:00",
@@ -221,85 +294,86 @@ def plot_submissions_and_comments_by_hour(df, df2):
               "18:00", "19:00", "20:00", "21:00", "22:00", "23:00"]
 
     # This plot will require a lot of vertical space, we increase it.
-    plt.figure(figsize=(12, 20))
+    fig, ax = plt.subplots(figsize=(12, 20))
 
     # These will be used for calculating percentages.
-    total = len(df)
-    total2 = len(df2)
+    total = submissions["total"]
+    total2 = comments["total"]
 
-    # We create dictionaries with keys from 0 to 23 (11 pm) hours.
-    submissions_hours = {i: 0 for i in range(0, 24)}
-    comments_hours = {i: 0 for i in range(0, 24)}
-
-    # We filter the DataFrames and set each hour value
-    # equal to its number of records.
-    for k, v in submissions_hours.items():
-        submissions_hours[k] = len(df[df.index.hour == k])
-
-    for k, v in comments_hours.items():
-        comments_hours[k] = len(df2[df2.index.hour == k])
+    # We use dictionaries with keys from 0 to 23 (11 pm) hours,
+    # each hour value is equal to its number of records.
+    submissions_hours = aggregates.get_hour_counts(
+        submissions, timezone).to_dict()
+    comments_hours = aggregates.get_hour_counts(
+        comments, timezone).to_dict()
 
     # The first set of horizontal bars have a little offset to the top.
     # This is so the next set of bars can fit in the same place.
-    bars = plt.barh(y=[i + 0.2 for i in submissions_hours.keys()],
-                    width=[(i / total) * 100 for i in submissions_hours.values()],
-                    height=0.4, color="#1565c0",  linewidth=0)
+    bars = ax.barh(y=[i + 0.2 for i in submissions_hours.keys()],
+                   width=[(i / total) * 100 for i in submissions_hours.values()],
+                   height=0.4, color="#1565c0",  linewidth=0)
 
     # This loop creates small texts with the absolute values next to each bar.
     for bar in bars:
         width = bar.get_width()
         real_value = int((width * total) / 100)
 
-        plt.text(width + 0.03, bar.get_y() + 0.08,
-                 "{:,}".format(real_value), ha="left", va="bottom")
+        ax.text(width + 0.03, bar.get_y() + 0.08,
+                "{:,}".format(real_value), ha="left", va="bottom")
 
     # This set of bars have a little offset to the bottom so they can fit
     # with the previous ones.
-    bars2 = plt.barh(y=[i - 0.2 for i in comments_hours.keys()],
-                     width=[(i / total2) * 100 for i in comments_hours.values()],
-                     height=0.4, color="#f9a825", linewidth=0)
+    bars2 = ax.barh(y=[i - 0.2 for i in comments_hours.keys()],
+                    width=[(i / total2) * 100 for i in comments_hours.values()],
+                    height=0.4, color="#f9a825", linewidth=0)
 
     # This loop creates small texts with the absolute values next to each bar (second set of bars).
     for bar2 in bars2:
         width2 = bar2.get_width()
         real_value2 = int((width2 * total2) / 100)
 
-        plt.text(width2 + 0.03, bar2.get_y() + 0.08,
-                 "{:,}".format(real_value2), ha="left", va="bottom")
+        ax.text(width2 + 0.03, bar2.get_y() + 0.08,
+                "{:,}".format(real_value2), ha="left", va="bottom")
 
     # We remove the top and right spines.
-    plt.gca().spines["top"].set_visible(False)
-    plt.gca().spines["right"].set_visible(False)
+    ax.spines["top"].set_visible(False)
+    ax.spines["right"].set_visible(False)
 
     # For the yticks we use the previously defined hours labels.
-    plt.yticks(list(submissions_hours.keys()), labels)
+    ax.set_yticks(list(submissions_hours.keys()))
+    ax.set_yticklabels(labels)
 
     # We add final customizations.
-    plt.xlabel("Percentage")
-    plt.ylabel("Hour of the Day")
-    plt.title("Submissions and comments by Hour")
-    plt.legend(["Submissions", "Comments"])
-    plt.tight_layout()
-    plt.savefig("submissionsandcommentsbyhour.png", facecolor="#222222")
+    ax.set_xlabel("Percentage")
+    ax.set_ylabel("Hour of the Day")
+    ax.set_title("Submissions and comments by Hour")
+    ax.legend(["Submissions", "Comments"])
+    fig.tight_layout()
+    fig.savefig("submissionsandcommentsbyhour.png", facecolor="#222222")
+    plt.close(fig)
 
 
-def plot_yearly_submissions_and_comments(df, df2):
+def plot_yearly_submissions_and_comments(submissions, comments):
     """Creates 2 line subplots with the counts of
     submissions and comments by day.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The submissions DataFrame.
+    submissions : dict
+        The submissions aggregates.
 
-    df2 : pandas.DataFrame
-        The comments DataFrame.
+    comments : dict
+        The comments aggregates.
 
     """
 
-    # we first resample both DataFrames for daily counts.
-    df = df.resample("D").count()
-    df2 = df2.resample("D").count()
+    import aggregates
+
+    plt = get_pyplot()
+
+    # we first get the daily counts of both datasets.
+    df = aggregates.get_daily_counts(submissions)
+    df2 = aggregates.get_daily_counts(comments)
 
     # We create a fig with 2 subplots that will shere their x-axis (date).
     fig, (ax1, ax2) = plt.subplots(2, sharex=True)
@@ -308,42 +382,45 @@ def plot_yearly_submissions_and_comments(df, df2):
     fig.suptitle("Daily Submissions and Comments")
 
     # We plot the first DataFrame and remove the top spine.
-    ax1.plot(df.index, df.author, color="#1565c0")
+    ax1.plot(df.index, df.values, color="#1565c0")
     ax1.spines["top"].set_visible(False)
     ax1.legend(["Submissions"])
 
     # We plot the second DataFrame.
-    ax2.plot(df2.index, df2.author, color="#f9a825")
+    ax2.plot(df2.index, df2.values, color="#f9a825")
     ax2.legend(["Comments"])
 
     # We add the final customization.
     fig.tight_layout()
-    plt.savefig("dailysubmissionsandcomments.png", facecolor="#222222")
+    fig.savefig("dailysubmissionsandcomments.png", facecolor="#222222")
+    plt.close(fig)
 
 
-def plot_submissions_by_user(df):
+def plot_submissions_by_user(submissions):
     """Plots a pie chart with the distribution
     of submissions by user groups.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The submissions DataFrame.
+    submissions : dict
+        The submissions aggregates.
 
     """
 
+    plt = get_pyplot()
+
     # We first get the total submissions by each user.
-    df = df["author"].value_counts()
+    df = submissions["authors"]
     total = len(df)
 
     # We define our custom buckets, feel free to tweak them as you need.
-    one = len(df[df.between(1, 1, inclusive=True)])
-    two_to_five = len(df[df.between(2, 5, inclusive=True)])
-    six_to_ten = len(df[df.between(6, 10, inclusive=True)])
-    eleven_to_twenty = len(df[df.between(11, 20, inclusive=True)])
-    twentyone_to_fifty = len(df[df.between(21, 50, inclusive=True)])
-    fiftyone_to_onehundred = len(df[df.between(51, 100, inclusive=True)])
-    more_than_onehundred = len(df[df.between(101, 10000, inclusive=True)])
+    one = len(df[df.between(1, 1)])
+    two_to_five = len(df[df.between(2, 5)])
+    six_to_ten = len(df[df.between(6, 10)])
+    eleven_to_twenty = len(df[df.between(11, 20)])
+    twentyone_to_fifty = len(df[df.between(21, 50)])
+    fiftyone_to_onehundred = len(df[df.between(51, 100)])
+    more_than_onehundred = len(df[df.between(101, 10000)])
 
     print("One:", one)
     print("Two to Five:", two_to_five)
@@ -368,51 +445,54 @@ def plot_submissions_by_user(df):
         final_labels.append("{} - {:.2f}% ({:,})".format(
             labels[index], item / total * 100, item))
 
-    # We eemove the lines that separate the pie sections.
-    plt.rcParams["patch.linewidth"] = 0
+    fig, ax = plt.subplots()
 
-    # We plot our values, remove labels and shadows.
-    plt.pie(values, explode=explode, labels=None, shadow=False)
+    # We plot our values, remove labels, shadows and the lines
+    # that separate the pie sections.
+    ax.pie(values, explode=explode, labels=None, shadow=False,
+           wedgeprops={"linewidth": 0})
 
     # We draw a circle in the Pie chart to make it a donut chart.
     centre_circle = plt.Circle(
         (0, 0), 0.75, color="#222222", fc="#222222", linewidth=0)
 
-    fig = plt.gcf()
-    fig.gca().add_artist(centre_circle)
+    ax.add_artist(centre_circle)
 
     # We add the final customization.
-    plt.axis("equal")
-    plt.legend(final_labels)
-    plt.savefig("submissionsbyuser.png", facecolor="#222222")
+    ax.axis("equal")
+    ax.legend(final_labels)
+    fig.savefig("submissionsbyuser.png", facecolor="#222222")
+    plt.close(fig)
 
 
-def plot_comments_by_user(df):
+def plot_comments_by_user(comments):
     """Plots a pie chart with the distribution
     of comments by user groups.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The comments DataFrame.
+    comments : dict
+        The comments aggregates.
 
     """
 
+    plt = get_pyplot()
+
     # We first get the total comments by each user.
-    df = df["author"].value_counts()
+    df = comments["authors"]
     total = len(df)
 
     # We define our custom buckets, feel free to tweak them as you need.
-    one = len(df[df.between(1, 1, inclusive=True)])
-    two_to_ten = len(df[df.between(2, 10, inclusive=True)])
-    eleven_to_twenty = len(df[df.between(11, 20, inclusive=True)])
-    twentyone_to_fifty = len(df[df.between(21, 50, inclusive=True)])
-    fiftyone_to_onehundred = len(df[df.between(51, 100, inclusive=True)])
+    one = len(df[df.between(1, 1)])
+    two_to_ten = len(df[df.between(2, 10)])
+    eleven_to_twenty = len(df[df.between(11, 20)])
+    twentyone_to_fifty = len(df[df.between(21, 50)])
+    fiftyone_to_onehundred = len(df[df.between(51, 100)])
     onehundredone_to_fivehundred = len(
-        df[df.between(101, 500, inclusive=True)])
+        df[df.between(101, 500)])
     fivehundredone_to_onethousand = len(
-        df[df.between(501, 1000, inclusive=True)])
-    morethanonethousand = len(df[df.between(1001, 100000, inclusive=True)])
+        df[df.between(501, 1000)])
+    morethanonethousand = len(df[df.between(1001, 100000)])
 
     print("One:", one)
     print("Two to Ten:", two_to_ten)
@@ -440,35 +520,38 @@ def plot_comments_by_user(df):
         final_labels.append(
             "{} - {:.2f}% ({:,})".format(labels[index], item / total * 100, item))
 
-    # We eemove the lines that separate the pie sections.
-    plt.rcParams["patch.linewidth"] = 0
+    fig, ax = plt.subplots()
 
-    # We plot our values, remove labels and shadows.
-    plt.pie(values, explode=explode, labels=None, shadow=False)
+    # We plot our values, remove labels, shadows and the lines
+    # that separate the pie sections.
+    ax.pie(values, explode=explode, labels=None, shadow=False,
+           wedgeprops={"linewidth": 0})
 
     # We draw a circle in the Pie chart to make it a donut chart.
     centre_circle = plt.Circle(
         (0, 0), 0.75, color="#222222", fc="#222222", linewidth=0)
 
-    fig = plt.gcf()
-    fig.gca().add_artist(centre_circle)
+    ax.add_artist(centre_circle)
 
     # We add the final customization.
-    plt.axis("equal")
-    plt.legend(final_labels)
-    plt.savefig("commentsbyuser.png", facecolor="#222222")
+    ax.axis("equal")
+    ax.legend(final_labels)
+    fig.savefig("commentsbyuser.png", facecolor="#222222")
+    plt.close(fig)
 
 
-def generate_most_common_words_word_cloud(df):
+def generate_most_common_words_word_cloud(tokens):
     """Generates a word cloud with the most used tokens.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The tokens DataFrame.
+    tokens : dict
+        The tokens aggregates.
 
     """
 
+    import wordcloud
+
     # We load English and Spanish stop words that will be
     # get better results in our word cloud.
     stopwords = list()
@@ -479,27 +562,17 @@ def generate_most_common_words_word_cloud(df):
     stopwords.extend(
         open(ES_STOPWORDS, "r", encoding="utf-8").read().splitlines())
 
-    # We remove all the rows that are in our stopwords list.
-    df = df[~df["lemma_lower"].isin(stopwords)]
-
-    # We only take into account the top 1,000 words that are not numbers
-    # are not stop words and are longer than one character.
-    words = df[
-        (df["is_alphabet"] == True) &
-        (df["is_stopword"] == False) &
-        (df["lemma_lower"].str.len() > 1)
-    ]["lemma_lower"].value_counts()[:1000]
+    # We remove all the lemmas that are in our stopwords list.
+    df = tokens["lemmas"]
+    df = df[~df.index.isin(stopwords)]
 
-    # Now that we have the words and their counts we will create a list
-    # with the words repeated equally to their counts.
-    words_list = list()
-
-    for index, value in words.items():
-        for _ in range(value):
-            words_list.append(index)
+    # We only take into account the top 1,000 words, the aggregates only
+    # contain words that are not numbers, are not stop words and are
+    # longer than one character.
+    words = df.sort_values(ascending=False)[:1000]
 
     # We create the mask from our cloud image.
-    mask = np.array(Image.open(MASK_FILE))
+    mask = get_mask()
 
     # We prepare our word cloud object and save it to disk.
     wc = wordcloud.WordCloud(background_color="#222222",
@@ -511,20 +584,22 @@ def generate_most_common_words_word_cloud(df):
                              contour_color="white",
                              collocations=False)
 
-    wc.generate(" ".join(words_list))
+    wc.generate_from_frequencies(words.to_dict())
     wc.to_file("mostusedwords.png")
 
 
-def generate_most_common_entities_word_cloud(df):
+def generate_most_common_entities_word_cloud(entities):
     """Generates a word cloud with the most used entities.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The entities DataFrame.
+    entities : dict
+        The entities aggregates.
 
     """
 
+    import wordcloud
+
     # We load English and Spanish stop words that will be
     # get better results in our word cloud.
     stopwords = list()
@@ -535,52 +610,437 @@ def generate_most_common_entities_word_cloud(df):
     stopwords.extend(
         open(ES_STOPWORDS, "r", encoding="utf-8").read().splitlines())
 
-    # We remove all the rows that are in our stopwords list.
-    df = df[~df["text_lower"].isin(stopwords)]
+    # We remove all the entities that are in our stopwords list.
+    df = entities["entities"]
+    df = df[~df.index.str.lower().isin(stopwords)]
 
-    # We only take into account the top 1,000 entities that are longer than one character
-    # and are in the the Location, Organization or Person categories.
-    entities = df[
-        (df["label"].isin(["LOC", "ORG", "PER"])) &
-        (df["text"].str.len() > 1)]["text"].value_counts()[:1000]
+    # This is specific to my dataset, feel free to remove it.
+    df = df.rename(index={"Mexico": "México"})
+    df = df.groupby(level=0).sum()
 
-    # Now that we have the entities and their counts we will create a list
-    # with the entities repeated equally to their counts.
-    entities_list = list()
+    # We only take into account the top 1,000 entities, the aggregates only
+    # contain entities that are longer than one character and are in the
+    # Location, Organization or Person categories.
+    entities = df.sort_values(ascending=False)[:1000]
 
-    for index, value in entities.items():
+    # We create the mask from our cloud image.
+    mask = get_mask()
+
+    # We prepare our word cloud object and save it to disk.
+    wc = wordcloud.WordCloud(background_color="#222222",
+                             max_words=1000,
+                             mask=mask,
+                             contour_width=2,
+                             colormap="spring",
+                             font_path=FONT_FILE,
+                             contour_color="white",
+                             collocations=False)
+
+    wc.generate_from_frequencies(entities.to_dict())
+    wc.to_file("mostusedentities.png")
+
+
+def get_most_common_phrases(counters):
+    """Prints the 20 best bigram and trigram collocations.
+
+    Parameters
+    ----------
+    counters : dict
+        The n-gram counters.
+
+    """
+
+    import ngrams
+
+    df = ngrams.get_top_phrases(counters, 20)
+    print(df)
 
-        # This is specific to my dataset, feel free to remove it.
-        if index == "Mexico":
-            index = "México"
 
-        for _ in range(value):
-            entities_list.append(index)
+def generate_most_common_phrases_word_cloud(counters):
+    """Generates a word cloud with the most used phrases.
+
+    Parameters
+    ----------
+    counters : dict
+        The n-gram counters.
+
+    """
+
+    import ngrams
+    import wordcloud
+
+    # We only take into account the top 1,000 bigrams and trigrams
+    # with the highest log-likelihood ratio.
+    phrases = ngrams.get_top_phrases(counters, 1000)["count"]
 
     # We create the mask from our cloud image.
-    mask = np.array(Image.open(MASK_FILE))
+    mask = get_mask()
 
     # We prepare our word cloud object and save it to disk.
     wc = wordcloud.WordCloud(background_color="#222222",
                              max_words=1000,
                              mask=mask,
                              contour_width=2,
-                             colormap="spring",
+                             colormap="autumn",
                              font_path=FONT_FILE,
                              contour_color="white",
                              collocations=False)
 
-    wc.generate(" ".join(entities_list))
-    wc.to_file("mostusedentities.png")
+    wc.generate_from_frequencies(phrases.to_dict())
+    wc.to_file("mostusedphrases.png")
+
+
+# The functions of the other modules are written as 'module.function', the
+# modules need pandas and scipy and are only imported when they are used.
+
+# The datasets, the function that aggregates each one of them and their default files,
+# {} is replaced by the subreddit.
+DATASETS = {
+    "submissions": ("aggregates.read_activity_aggregates", "{}-submissions.csv"),
+    "comments": ("aggregates.read_activity_aggregates", "{}-comments.csv"),
+    "tokens": ("aggregates.read_tokens_aggregates", "tokens.csv"),
+    "entities": ("aggregates.read_entities_aggregates", "entities.csv"),
+    "ngrams": ("ngrams.count_ngrams", "tokens.csv"),
+    "links": ("links.build_index", "{}-submissions.csv")
+}
+
+# The functions that aggregate a binary corpus (see tokencorpus.py), they are
+# used when the tokens or ngrams file is a folder.
+CORPUS_READERS = {
+    "tokens": "tokencorpus.read_tokens_aggregates",
+    "ngrams": "ngrams.count_corpus_ngrams"
+}
+
+# The functions that aggregate the tokens and entities inside the database.
+DATABASE_READERS = {
+    "tokens": "store.read_tokens_aggregates",
+    "entities": "store.read_entities_aggregates"
+}
+
+# The printed reports and the aggregates that each one of them needs.
+REPORTS = {
+    "insights": (get_insights, ["submissions", "comments"]),
+    "spikes": ("bursts.print_spikes_report", ["submissions", "comments", "term_files",
+                                              "chunksize", "cache_dir"]),
+    "domains": (get_most_common_domains, ["submissions"]),
+    "submitters": (get_most_common_submitters, ["submissions"]),
+    "commenters": (get_most_common_commenters, ["comments"]),
+    "collocations": (get_most_common_phrases, ["ngrams"]),
+    "links": ("links.get_links_report", ["links"])
+}
+
+# The figures that can be rendered and the aggregates that each one of them needs,
+# the weekday and hour plots also need the display timezone.
+FIGURES = {
+    "weekday": (plot_submissions_and_comments_by_weekday, ["submissions", "comments", "timezone"]),
+    "hour": (plot_submissions_and_comments_by_hour, ["submissions", "comments", "timezone"]),
+    "daily": (plot_yearly_submissions_and_comments, ["submissions", "comments"]),
+    "submissionsbyuser": (plot_submissions_by_user, ["submissions"]),
+    "commentsbyuser": (plot_comments_by_user, ["comments"]),
+    "words": (generate_most_common_words_word_cloud, ["tokens"]),
+    "entities": (generate_most_common_entities_word_cloud, ["entities"]),
+    "phrases": (generate_most_common_phrases_word_cloud, ["ngrams"])
+}
+
+
+def get_function(function):
+    """Gets a function of DATASETS, CORPUS_READERS, DATABASE_READERS or REPORTS.
+
+    Parameters
+    ----------
+    function : callable or str
+        The function, or its 'module.function' name, the module is imported now.
 
+    Returns
+    -------
+    callable
+        The function.
 
-if __name__ == "__main__":
+    """
+
+    if callable(function):
+        return function
+
+    module, name = function.rsplit(".", 1)
+
+    return getattr(importlib.import_module(module), name)
+
+
+def load_data(names, files, chunksize=None, cache_dir=cache.CACHE_DIR,
+              database=None, filters=None):
+    """Loads the aggregates of the requested datasets.
+
+    The aggregates are memoized on disk, they are only computed again
+    when their csv file or the database changes.
+
+    Parameters
+    ----------
+    names : list
+        The names of the datasets.
+
+    files : dict
+        The csv file of each dataset.
 
-    submissions_df = pd.read_csv("mexico-submissions.csv",
-                           parse_dates=["datetime"], index_col=0)
+    chunksize : int
+        How many rows are read at a time, by default aggregates.CHUNK_SIZE.
 
-    comments_df = pd.read_csv("mexico-comments.csv",
-                              parse_dates=["datetime"], index_col=0)
+    cache_dir : str
+        The folder where the aggregates are memoized, None disables the cache.
+
+    database : str
+        An optional SQLite database (see store.py), when set the aggregations
+        are done inside the database instead of reading the csv files.
+
+    filters : dict
+        The subreddit, start, end and author filters for the database.
+
+    Returns
+    -------
+    dict
+        The aggregates of each dataset, keyed by the dataset name.
+
+    """
+
+    import aggregates
+
+    data = dict()
+
+    if chunksize is None:
+        chunksize = aggregates.CHUNK_SIZE
+
+    if filters is None:
+        filters = dict()
+
+    for name in names:
+
+        # The n-grams and the links are always counted from the csv files.
+        if database is None or name in ["ngrams", "links"]:
+            function = get_function(DATASETS[name][0])
+            file_path = files[name]
+            file_paths = [file_path]
+
+            if name in CORPUS_READERS and os.path.isdir(file_path):
+                import tokencorpus
+
+                function = get_function(CORPUS_READERS[name])
+                file_paths = tokencorpus.get_corpus_files(file_path)
+
+            with metrics.span("load_dataset", dataset=name):
+                data[name] = cache.load_or_compute(
+                    name, file_paths, lambda: function(file_path, chunksize),
+                    cache_dir=cache_dir)
+
+            continue
+
+        # The recent writes of the database may only be in its write-ahead log.
+        file_paths = [path for path in [database, database + "-wal"]
+                      if os.path.exists(path)]
+
+        import store
+
+        if name in ["submissions", "comments"]:
+            params = filters
+            function = lambda: store.read_activity_aggregates(
+                database, name, **filters)
+        else:
+            params = {"subreddit": filters.get("subreddit")}
+            function = lambda: get_function(DATABASE_READERS[name])(
+                database, params["subreddit"])
+
+        with metrics.span("load_dataset", dataset=name, source="database"):
+            data[name] = cache.load_or_compute(
+                "database-" + name, file_paths, function, params, cache_dir)
+
+    return data
+
+
+def render_figure(name, *args):
+    """Renders one figure, it runs inside the worker processes.
+
+    Parameters
+    ----------
+    name : str
+        The name of the figure.
+
+    args : list
+        The aggregates that the figure needs.
+
+    """
+
+    with metrics.span("figure", output=name):
+        FIGURES[name][0](*args)
+
+
+def render_figures(data, names=None, workers=RENDER_WORKERS):
+    """Renders the figures in parallel using a pool of processes.
+
+    Each figure only receives the aggregates it needs, the aggregation
+    step is done once before calling this function.
+
+    Parameters
+    ----------
+    data : dict
+        The aggregates of each dataset keyed by the dataset name, and the
+        display timezone keyed by 'timezone'.
+
+    names : list
+        The names of the figures to render, by default all of them.
+
+    workers : int
+        The number of processes to use.
+
+    """
+
+    if names is None:
+        names = list(FIGURES.keys())
+
+    if len(names) == 0:
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        futures = list()
+
+        # The metrics recorded by each worker are sent back with its result.
+        for name in names:
+            futures.append(executor.submit(
+                metrics.collect, render_figure, name, *[data[key] for key in FIGURES[name][1]]))
+
+        # We wait for all the figures, this also raises any error from the workers.
+        for future in futures:
+            metrics.merge(future.result()[1])
+
+
+def get_utc_timestamp(date):
+    """Converts a YYYY-MM-DD date to a UTC timestamp.
+
+    Parameters
+    ----------
+    date : str
+        The date, it can be None.
+
+    Returns
+    -------
+    int
+        The seconds since the epoch or None.
+
+    """
+
+    if date is None:
+        return None
+
+    return int(datetime.fromisoformat(date).replace(tzinfo=timezone.utc).timestamp())
+
+
+def main():
+    """Parses the command line arguments and generates the requested outputs."""
+
+    outputs = list(REPORTS.keys()) + list(FIGURES.keys())
+
+    parser = argparse.ArgumentParser(
+        description="Generates insights and plots from the subreddit datasets.")
+
+    parser.add_argument("outputs", nargs="*", metavar="output",
+                        help="The outputs to generate, by default all of them: " + ", ".join(outputs))
+
+    for name, (_, file_path) in DATASETS.items():
+        parser.add_argument("--" + name,
+                            help="The {} csv file, by default {}.".format(
+                                name, file_path.format("<subreddit>")) + (
+                                " It can also be a corpus folder (see tokencorpus.py)."
+                                if name in CORPUS_READERS else ""))
+
+    parser.add_argument("--database",
+                        help="Read the datasets from this SQLite database instead of the csv files.")
+
+    parser.add_argument("--subreddit",
+                        help="The subreddit of the default csv files ({} if not set), with --database only use this subreddit.".format(SUBREDDIT))
+
+    parser.add_argument("--start",
+                        help="Only use the records created at or after this UTC date (YYYY-MM-DD), requires --database.")
+
+    parser.add_argument("--end",
+                        help="Only use the records created before this UTC date (YYYY-MM-DD), requires --database.")
+
+    parser.add_argument("--author",
+                        help="Only use the submissions and comments of this author, requires --database.")
+
+    parser.add_argument("--chunksize", type=int,
+                        help="How many rows are read at a time, 500,000 by default (see aggregates.py).")
+
+    parser.add_argument("--timezone", default=DISPLAY_TIMEZONE,
+                        help="The timezone used for the weekday and hour plots, e.g. America/Mexico_City.")
+
+    parser.add_argument("--workers", type=int, default=RENDER_WORKERS,
+                        help="How many processes are used to render the figures.")
+
+    parser.add_argument("--cache-dir", default=cache.CACHE_DIR,
+                        help="The folder where the aggregates are memoized.")
+
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always read the csv files.")
+
+    parser.add_argument("--metrics",
+                        help="Save the timings of each dataset, report and figure to this file, "
+                        ".prom files use the Prometheus text format (see metrics.py).")
+
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.configure(args.metrics)
+
+    if len(args.outputs) == 0:
+        args.outputs = outputs
+
+    for name in args.outputs:
+        if name not in outputs:
+            parser.error("invalid output: {}".format(name))
+
+    reports = [name for name in args.outputs if name in REPORTS]
+    figures = [name for name in args.outputs if name in FIGURES]
+
+    # We only load the datasets that the requested outputs need.
+    needed = set()
+
+    for name in reports:
+        needed.update(REPORTS[name][1])
+
+    for name in figures:
+        needed.update(FIGURES[name][1])
+
+    # The default files can also be compressed, e.g. mexico-comments.csv.zst
+    files = {name: getattr(args, name) or fileio.find_file(file_path.format(args.subreddit or SUBREDDIT))
+             for name, (_, file_path) in DATASETS.items()}
+    cache_dir = None if args.no_cache else args.cache_dir
+
+    # The dates are converted to UTC timestamps, the same as the created_utc column.
+    filters = {"subreddit": args.subreddit, "author": args.author,
+               "start": get_utc_timestamp(args.start), "end": get_utc_timestamp(args.end)}
+
+    if args.database is None and any(filters[key] is not None for key in ["start", "end", "author"]):
+        parser.error("--start, --end and --author require --database")
+
+    data = load_data([name for name in DATASETS.keys() if name in needed],
+                     files, args.chunksize, cache_dir, args.database, filters)
+
+    data["timezone"] = args.timezone
+
+    # The spikes report also finds the bursting lemmas and entities when their files exist.
+    data["term_files"] = {"lemmas": files["tokens"], "entities": files["entities"]}
+    data["chunksize"] = args.chunksize
+    data["cache_dir"] = cache_dir
+
+    for name in reports:
+        function, keys = REPORTS[name]
+
+        with metrics.span("report", output=name):
+            get_function(function)(*[data[key] for key in keys])
+
+    render_figures(data, figures, args.workers)
+
+    metrics.flush()
+
+
+if __name__ == "__main__":
 
-    tokens_df = pd.read_csv("tokens.csv")
-    entities_df = pd.read_csv("entities.csv")
+    main()
@@ -0,0 +1,335 @@
+"""
+This script contains the functions of the optional SQLite database, a single local file
+that holds the submissions, comments, tokens and entities datasets.
+
+The downloaders and step2.py replace the rows of each subreddit in bulk and step3.py can push its
+aggregations down to SQL, the indexes on subreddit, author, created time and lemma
+allow time range and per author queries without scanning the whole dataset.
+"""
+
+import sqlite3
+
+import pandas as pd
+
+from aggregates import HOUR, ENTITY_LABELS
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    subreddit TEXT NOT NULL,
+    created_utc INTEGER NOT NULL,
+    author TEXT,
+    title TEXT,
+    url TEXT,
+    domain TEXT
+);
+
+CREATE TABLE IF NOT EXISTS comments (
+    subreddit TEXT NOT NULL,
+    created_utc INTEGER NOT NULL,
+    author TEXT,
+    body TEXT,
+    id TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tokens (
+    subreddit TEXT NOT NULL,
+    text TEXT,
+    text_lower TEXT,
+    lemma TEXT,
+    lemma_lower TEXT,
+    part_of_speech TEXT,
+    is_alphabet INTEGER,
+    is_stopword INTEGER,
+    comment_id TEXT,
+    created_utc INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS entities (
+    subreddit TEXT NOT NULL,
+    text TEXT,
+    text_lower TEXT,
+    label TEXT,
+    comment_id TEXT,
+    created_utc INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS submissions_subreddit_created ON submissions (subreddit, created_utc);
+CREATE INDEX IF NOT EXISTS submissions_author_created ON submissions (author, created_utc);
+CREATE INDEX IF NOT EXISTS comments_subreddit_created ON comments (subreddit, created_utc);
+CREATE INDEX IF NOT EXISTS comments_author_created ON comments (author, created_utc);
+CREATE INDEX IF NOT EXISTS tokens_subreddit_lemma ON tokens (subreddit, lemma_lower);
+CREATE INDEX IF NOT EXISTS entities_subreddit_label ON entities (subreddit, label, text);
+"""
+
+
+def connect(file_path):
+    """Opens the database and creates its tables and indexes if needed.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the database file.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The database connection.
+
+    """
+
+    connection = sqlite3.connect(file_path)
+
+    # The write-ahead log makes bulk inserts much faster and allows
+    # reading while a downloader is still writing.
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+def delete_rows(connection, table, subreddit):
+    """Deletes the rows of a subreddit before it is saved again.
+
+    The csv files are overwritten on every run, this does the same in the
+    database so running a downloader or step2.py twice doesn't count the
+    same rows twice.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The database connection.
+
+    table : str
+        One of submissions, comments, tokens or entities.
+
+    subreddit : str
+        The subreddit whose rows are deleted.
+
+    """
+
+    with connection:
+        connection.execute("DELETE FROM {} WHERE subreddit = ?".format(table), [subreddit])
+
+
+def insert_rows(connection, table, subreddit, rows):
+    """Inserts rows in bulk using a single transaction.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The database connection.
+
+    table : str
+        One of submissions, comments, tokens or entities.
+
+    subreddit : str
+        The subreddit the rows belong to.
+
+    rows : list
+        The rows in the same order as the csv files columns.
+
+    """
+
+    columns = [row[1] for row in connection.execute(
+        "PRAGMA table_info({})".format(table))]
+
+    query = "INSERT INTO {} ({}) VALUES ({})".format(
+        table, ", ".join(columns), ", ".join(["?"] * len(columns)))
+
+    with connection:
+        connection.executemany(query, ([subreddit] + list(row) for row in rows))
+
+
+def get_filters(subreddit=None, start=None, end=None, author=None):
+    """Builds the WHERE clause for the submissions and comments queries.
+
+    Parameters
+    ----------
+    subreddit : str
+        Only count this subreddit.
+
+    start : int
+        Only count the records created at or after this UTC timestamp.
+
+    end : int
+        Only count the records created before this UTC timestamp.
+
+    author : str
+        Only count this author.
+
+    Returns
+    -------
+    tuple
+        The WHERE clause and its parameters.
+
+    """
+
+    conditions = list()
+    params = list()
+
+    for condition, value in [("subreddit = ?", subreddit), ("created_utc >= ?", start),
+                             ("created_utc < ?", end), ("author = ?", author)]:
+
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+
+    if len(conditions) == 0:
+        return "", params
+
+    return "WHERE " + " AND ".join(conditions), params
+
+
+def query_counts(connection, query, params, index_name=None):
+    """Runs a query that returns (key, count) rows and converts it to a Series.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The database connection.
+
+    query : str
+        The SQL query.
+
+    params : list
+        The query parameters.
+
+    index_name : str
+        The name of the index, the same as the csv column.
+
+    Returns
+    -------
+    pandas.Series
+        The counts indexed by their key.
+
+    """
+
+    rows = connection.execute(query, params).fetchall()
+
+    return pd.Series([row[1] for row in rows], dtype="int64",
+                     index=pd.Index([row[0] for row in rows], name=index_name))
+
+
+def read_activity_aggregates(file_path, table, subreddit=None, start=None, end=None, author=None):
+    """Aggregates the submissions or comments inside the database.
+
+    The returned aggregates are the same as the ones from the csv files.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the database file.
+
+    table : str
+        Either submissions or comments.
+
+    subreddit : str
+        Only count this subreddit.
+
+    start : int
+        Only count the records created at or after this UTC timestamp.
+
+    end : int
+        Only count the records created before this UTC timestamp.
+
+    author : str
+        Only count this author.
+
+    Returns
+    -------
+    dict
+        The aggregates of the matching records.
+
+    """
+
+    connection = connect(file_path)
+    where, params = get_filters(subreddit, start, end, author)
+
+    hourly = query_counts(connection, "SELECT created_utc / {0} AS hour, COUNT(*) FROM {1} {2} GROUP BY hour".format(
+        HOUR, table, where), params)
+
+    authors = query_counts(connection, "SELECT author, COUNT(*) FROM {} {} GROUP BY author".format(
+        table, where), params, "author")
+
+    if table == "submissions":
+        domains = query_counts(connection, "SELECT domain, COUNT(*) FROM submissions {} GROUP BY domain".format(
+            where), params, "domain")
+    else:
+        domains = pd.Series(dtype="int64")
+
+    connection.close()
+
+    return {"total": int(hourly.sum()), "hourly": hourly,
+            "authors": authors, "domains": domains}
+
+
+def read_tokens_aggregates(file_path, subreddit=None):
+    """Counts the lemmas inside the database.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the database file.
+
+    subreddit : str
+        Only count this subreddit.
+
+    Returns
+    -------
+    dict
+        The aggregates with the lemma counts.
+
+    """
+
+    connection = connect(file_path)
+    where, params = get_filters(subreddit)
+
+    total = connection.execute(
+        "SELECT COUNT(*) FROM tokens {}".format(where), params).fetchone()[0]
+
+    where = "WHERE is_alphabet = 1 AND is_stopword = 0 AND length(lemma_lower) > 1" + \
+        where.replace("WHERE", " AND")
+
+    lemmas = query_counts(connection, "SELECT lemma_lower, COUNT(*) FROM tokens {} GROUP BY lemma_lower".format(
+        where), params, "lemma_lower")
+
+    connection.close()
+
+    return {"total": total, "lemmas": lemmas}
+
+
+def read_entities_aggregates(file_path, subreddit=None):
+    """Counts the Location, Organization and Person entities inside the database.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the database file.
+
+    subreddit : str
+        Only count this subreddit.
+
+    Returns
+    -------
+    dict
+        The aggregates with the entity counts.
+
+    """
+
+    connection = connect(file_path)
+    where, params = get_filters(subreddit)
+
+    total = connection.execute(
+        "SELECT COUNT(*) FROM entities {}".format(where), params).fetchone()[0]
+
+    where = "WHERE label IN ({}) AND length(text) > 1".format(", ".join(["?"] * len(ENTITY_LABELS))) + \
+        where.replace("WHERE", " AND")
+
+    entities = query_counts(connection, "SELECT text, COUNT(*) FROM entities {} GROUP BY text".format(
+        where), ENTITY_LABELS + params, "text")
+
+    connection.close()
+
+    return {"total": total, "entities": entities}
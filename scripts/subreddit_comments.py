@@ -5,39 +5,75 @@ By default it downloads 10,000 comments starting from the newest one.
 
 import csv
 import time
-from datetime import datetime
 
 import requests
 
+import fileio
+import metrics
+
 
 SUBREDDITS = ["mexico"]
 
+# Any Pushshift compatible API can be used.
+BASE_URL = "https://api.pushshift.io/reddit"
+
 HEADERS = {"User-Agent": "Comments Downloader v0.1"}
 COMMENTS_LIST = list()
 
 MAX_COMMENTS = 10000
 
+# The csv files are compressed when this is .csv.gz or .csv.zst (see fileio.py).
+FILE_EXTENSION = ".csv"
+
+# Optional: Also save the comments to this SQLite database (see store.py).
+DATABASE_FILE = None
+
+# Optional: Save the request latencies, rate limit waits and item counts to this file,
+# .prom files use the Prometheus text format (see metrics.py).
+METRICS_FILE = None
+
 
 def init():
 
+    connection = None
+
+    # store.py needs pandas, it is only imported when the database is used.
+    if DATABASE_FILE:
+        import store
+
+        connection = store.connect(DATABASE_FILE)
+
+    if METRICS_FILE is not None:
+        metrics.configure(METRICS_FILE)
+
     for subreddit in SUBREDDITS:
 
-        writer = csv.writer(open("./{}-comments.csv".format(subreddit),
-                                 "w", newline="", encoding="utf-8"))
+        file_path = "./{}-comments{}".format(subreddit, FILE_EXTENSION)
 
-        # Adding the header.
-        writer.writerow(["datetime", "author", "body"])
+        with fileio.open_text(file_path, "w") as csv_file:
 
-        print("Downloading:", subreddit)
-        load_comments(subreddit=subreddit)
-        writer.writerows(COMMENTS_LIST)
+            writer = csv.writer(csv_file)
 
-        COMMENTS_LIST.clear()
+            # Adding the header.
+            writer.writerow(["created_utc", "author", "body", "id"])
 
+            # The csv file is overwritten, the rows of the subreddit in the database too.
+            if connection is not None:
+                store.delete_rows(connection, "comments", subreddit)
 
-def load_comments(subreddit, latest_timestamp=None):
+            print("Downloading:", subreddit)
+            load_comments(subreddit=subreddit)
+            writer.writerows(COMMENTS_LIST)
+
+            if connection is not None:
+                store.insert_rows(connection, "comments", subreddit, COMMENTS_LIST)
+
+            COMMENTS_LIST.clear()
 
-    base_url = "https://api.pushshift.io/reddit/comment/search/"
+        metrics.flush()
+
+
+def load_comments(subreddit, latest_timestamp=None):
 
     params = {"subreddit": subreddit, "sort": "desc",
               "sort_type": "created_utc", "size": 500}
@@ -46,35 +82,78 @@ def load_comments(subreddit, latest_timestamp=None):
     if latest_timestamp != None:
         params["before"] = latest_timestamp
 
-    with requests.get(base_url, params=params, headers=HEADERS) as response:
-
-        json_data = response.json()
-        total_comments = len(json_data["data"])
-        latest_timestamp = 0
+    page = get_page(params)
 
-        print("Downloading: {} comments".format(total_comments))
+    total_comments = len(page)
+    latest_timestamp = 0
 
-        for item in json_data["data"]:
+    print("Downloading: {} comments".format(total_comments))
+    metrics.increment("downloaded_items_total", total_comments, kind="comments")
 
-            # We will only take 3 properties, the timestamp, author and body.
+    for item in page:
 
-            latest_timestamp = item["created_utc"]
+        latest_timestamp = item["created_utc"]
 
-            iso_date = datetime.fromtimestamp(latest_timestamp)
-            
-            COMMENTS_LIST.append(
-                [iso_date, item["author"], item["body"]])
+        COMMENTS_LIST.append(parse_comment(item))
 
-            if len(COMMENTS_LIST) >= MAX_COMMENTS:
-                break
+        if len(COMMENTS_LIST) >= MAX_COMMENTS:
+            break
 
-        if total_comments < 500:
-            print("No more results.")
-        elif len(COMMENTS_LIST) >= MAX_COMMENTS:
-            print("Download complete.")
-        else:
+    if total_comments < 500:
+        print("No more results.")
+    elif len(COMMENTS_LIST) >= MAX_COMMENTS:
+        print("Download complete.")
+    else:
+        with metrics.span("rate_limit_wait", endpoint="comment"):
             time.sleep(1.2)
-            load_comments(subreddit, latest_timestamp)
+
+        load_comments(subreddit, latest_timestamp)
+
+
+def get_page(params, base_url=BASE_URL, headers=HEADERS):
+    """Requests a page of comments from the API, live.py uses it too.
+
+    Parameters
+    ----------
+    params : dict
+        The query parameters.
+
+    base_url : str
+        The base url of the API.
+
+    headers : dict
+        The headers of the request, the _alt downloaders send their own User-Agent.
+
+    Returns
+    -------
+    list
+        The comments of the page.
+
+    """
+
+    with metrics.span("http_request", endpoint="comment") as span:
+        with requests.get(base_url + "/comment/search/", params=params, headers=headers, timeout=30) as response:
+            span["status"] = response.status_code
+            response.raise_for_status()
+            return response.json()["data"]
+
+
+def parse_comment(item):
+    """Converts a comment from the API to a csv row.
+
+    Parameters
+    ----------
+    item : dict
+        The comment from the API.
+
+    Returns
+    -------
+    list
+        We will only take 4 properties, the UTC timestamp, author, body and id.
+
+    """
+
+    return [item["created_utc"], item["author"], item["body"], item["id"]]
 
 
 if __name__ == "__main__":
@@ -6,9 +6,11 @@ By default it downloads all the comments from the newest one to the first one of
 import csv
 import sys
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 
-import requests
+import fileio
+import metrics
+import subreddit_comments
 
 # 10,000 should cover at least 3 years of comments.
 sys.setrecursionlimit(10000)
@@ -22,25 +24,57 @@ COMMENTS_LIST = list()
 # Year month and day.
 TARGET_DATE = "2019-01-01"
 
-TARGET_TIMESTAMP = datetime.fromisoformat(TARGET_DATE).timestamp()
+# The target date is in UTC, the same as the 'created_utc' field.
+TARGET_TIMESTAMP = datetime.fromisoformat(
+    TARGET_DATE).replace(tzinfo=timezone.utc).timestamp()
+
+# The csv files are compressed when this is .csv.gz or .csv.zst (see fileio.py).
+FILE_EXTENSION = ".csv"
+
+# Optional: Also save the comments to this SQLite database (see store.py).
+DATABASE_FILE = None
+
+# Optional: Save the request latencies, rate limit waits and item counts to this file,
+# .prom files use the Prometheus text format (see metrics.py).
+METRICS_FILE = None
 
 
 def init():
     """Iterates over all the subreddits and creates their csv files."""
 
+    connection = None
+
+    # store.py needs pandas, it is only imported when the database is used.
+    if DATABASE_FILE:
+        import store
+
+        connection = store.connect(DATABASE_FILE)
+
+    if METRICS_FILE is not None:
+        metrics.configure(METRICS_FILE)
+
     for subreddit in SUBREDDITS:
 
-        writer = csv.writer(open("./{}-comments.csv".format(subreddit),
-                                 "w", newline="", encoding="utf-8"))
+        file_path = "./{}-comments{}".format(subreddit, FILE_EXTENSION)
+
+        with fileio.open_text(file_path, "w") as csv_file:
 
-        # Adding the header.
-        writer.writerow(["datetime", "author", "body"])
+            writer = csv.writer(csv_file)
 
-        print("Downloading:", subreddit)
-        load_comments(subreddit, writer)
+            # Adding the header.
+            writer.writerow(["created_utc", "author", "body", "id"])
 
+            # The csv file is overwritten, the rows of the subreddit in the database too.
+            if connection is not None:
+                store.delete_rows(connection, "comments", subreddit)
 
-def load_comments(subreddit, writer, latest_timestamp=None):
+            print("Downloading:", subreddit)
+            load_comments(subreddit, writer, connection)
+
+        metrics.flush()
+
+
+def load_comments(subreddit, writer, connection=None, latest_timestamp=None):
     """Keeps downloading comments using recursion, it saves them 500 at a time.
 
     Parameters
@@ -51,13 +85,14 @@ def load_comments(subreddit, writer, latest_timestamp=None):
     write: csv.writer
         A writer object that will save the comments to disk.
 
+    connection: sqlite3.Connection
+        An optional database connection that will also save the comments.
+
     latest_timestamp: int
         The timestampf of the latest comment.
 
     """
 
-    base_url = "https://api.pushshift.io/reddit/comment/search/"
-
     params = {"subreddit": subreddit, "sort": "desc",
               "sort_type": "created_utc", "size": 500}
 
@@ -67,39 +102,46 @@ def load_comments(subreddit, writer, latest_timestamp=None):
     if latest_timestamp != None:
         params["before"] = latest_timestamp
 
-    with requests.get(base_url, params=params, headers=HEADERS) as response:
+    # The same request as subreddit_comments.py, with a timeout and a status check.
+    page = subreddit_comments.get_page(params, headers=HEADERS)
+
+    total_comments = len(page)
+    latest_timestamp = 0
 
-        json_data = response.json()
-        total_comments = len(json_data["data"])
-        latest_timestamp = 0
+    print("Downloading: {} comments".format(total_comments))
+    metrics.increment("downloaded_items_total", total_comments, kind="comments")
 
-        print("Downloading: {} comments".format(total_comments))
+    for item in page:
 
-        for item in json_data["data"]:
+        # We will only take 4 properties, the UTC timestamp, author, body and id.
 
-            # We will only take 3 properties, the timestamp, author and body.
+        latest_timestamp = item["created_utc"]
 
-            latest_timestamp = item["created_utc"]
+        if latest_timestamp <= TARGET_TIMESTAMP:
+            stop_loading = True
+            break
 
-            iso_date = datetime.fromtimestamp(latest_timestamp)
+        COMMENTS_LIST.append(
+            [latest_timestamp, item["author"], item["body"], item["id"]])
 
-            if latest_timestamp <= TARGET_TIMESTAMP:
-                stop_loading = True
-                break
+    writer.writerows(COMMENTS_LIST)
 
-            COMMENTS_LIST.append(
-                [iso_date, item["author"], item["body"]])
+    if connection is not None:
+        import store
 
-        writer.writerows(COMMENTS_LIST)
-        COMMENTS_LIST.clear()
+        store.insert_rows(connection, "comments", subreddit, COMMENTS_LIST)
 
-        if total_comments < 500:
-            print("No more r○esults.")
-        elif stop_loading:
-            print("Download complete.")
-        else:
+    COMMENTS_LIST.clear()
+
+    if total_comments < 500:
+        print("No more r○esults.")
+    elif stop_loading:
+        print("Download complete.")
+    else:
+        with metrics.span("rate_limit_wait", endpoint="comment"):
             time.sleep(1.2)
-            load_comments(subreddit, writer, latest_timestamp)
+
+        load_comments(subreddit, writer, connection, latest_timestamp)
 
 
 if __name__ == "__main__":
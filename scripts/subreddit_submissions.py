@@ -5,35 +5,74 @@ By default it downloads 10,000 posts starting from the newest one.
 
 import csv
 import time
-from datetime import datetime
 
 import requests
 import tldextract
 
+import fileio
+import metrics
+
 SUBREDDITS = ["mexico"]
 
+# Any Pushshift compatible API can be used.
+BASE_URL = "https://api.pushshift.io/reddit"
+
 HEADERS = {"User-Agent": "Submissions Downloader v0.2"}
 SUBMISSIONS_LIST = list()
 
 MAX_SUBMISSIONS = 10000
 
+# The csv files are compressed when this is .csv.gz or .csv.zst (see fileio.py).
+FILE_EXTENSION = ".csv"
+
+# Optional: Also save the submissions to this SQLite database (see store.py).
+DATABASE_FILE = None
+
+# Optional: Save the request latencies, rate limit waits and item counts to this file,
+# .prom files use the Prometheus text format (see metrics.py).
+METRICS_FILE = None
+
 
 def init():
     """Iterates over all the subreddits and creates their csv files."""
 
+    connection = None
+
+    # store.py needs pandas, it is only imported when the database is used.
+    if DATABASE_FILE:
+        import store
+
+        connection = store.connect(DATABASE_FILE)
+
+    if METRICS_FILE is not None:
+        metrics.configure(METRICS_FILE)
+
     for subreddit in SUBREDDITS:
 
-        writer = csv.writer(open("./{}-submissions.csv".format(subreddit),
-                                 "w", newline="", encoding="utf-8"))
+        file_path = "./{}-submissions{}".format(subreddit, FILE_EXTENSION)
+
+        with fileio.open_text(file_path, "w") as csv_file:
 
-        # Adding the header.
-        writer.writerow(["datetime", "author", "title", "url", "domain"])
+            writer = csv.writer(csv_file)
 
-        print("Downloading:", subreddit)
-        download_submissions(subreddit=subreddit)
-        writer.writerows(SUBMISSIONS_LIST)
+            # Adding the header.
+            writer.writerow(["created_utc", "author", "title", "url", "domain"])
 
-        SUBMISSIONS_LIST.clear()
+            # The csv file is overwritten, the rows of the subreddit in the database too.
+            if connection is not None:
+                store.delete_rows(connection, "submissions", subreddit)
+
+            print("Downloading:", subreddit)
+            download_submissions(subreddit=subreddit)
+            writer.writerows(SUBMISSIONS_LIST)
+
+            if connection is not None:
+                store.insert_rows(connection, "submissions",
+                                  subreddit, SUBMISSIONS_LIST)
+
+            SUBMISSIONS_LIST.clear()
+
+        metrics.flush()
 
 
 def download_submissions(subreddit, latest_timestamp=None):
@@ -49,8 +88,6 @@ def download_submissions(subreddit, latest_timestamp=None):
 
     """
 
-    base_url = "https://api.pushshift.io/reddit/submission/search/"
-
     params = {"subreddit": subreddit, "sort": "desc",
               "sort_type": "created_utc", "size": 500}
 
@@ -58,46 +95,91 @@ def download_submissions(subreddit, latest_timestamp=None):
     if latest_timestamp != None:
         params["before"] = latest_timestamp
 
-    with requests.get(base_url, params=params, headers=HEADERS) as response:
+    page = get_page(params)
 
-        json_data = response.json()
-        total_submissions = len(json_data["data"])
-        latest_timestamp = 0
+    total_submissions = len(page)
+    latest_timestamp = 0
 
-        print("Downloading: {} submissions".format(total_submissions))
+    print("Downloading: {} submissions".format(total_submissions))
+    metrics.increment("downloaded_items_total", total_submissions, kind="submissions")
 
-        for item in json_data["data"]:
+    for item in page:
 
-            # We will only take 3 properties, the timestamp, author and url.
+        latest_timestamp = item["created_utc"]
 
-            latest_timestamp = item["created_utc"]
+        SUBMISSIONS_LIST.append(parse_submission(item))
 
-            iso_date = datetime.fromtimestamp(latest_timestamp)
-            tld = tldextract.extract(item["url"])
-            domain = tld.domain + "." + tld.suffix
+        if len(SUBMISSIONS_LIST) >= MAX_SUBMISSIONS:
+            break
 
-            if item["is_self"] == True:
-                domain = "self-post"
+    if total_submissions < 500:
+        print("No more results.")
+    elif len(SUBMISSIONS_LIST) >= MAX_SUBMISSIONS:
+        print("Download complete.")
+    else:
+        with metrics.span("rate_limit_wait", endpoint="submission"):
+            time.sleep(1.2)
 
-            if domain == "youtu.be":
-                domain = "youtube.com"
+        download_submissions(subreddit, latest_timestamp)
 
-            if domain == "redd.it":
-                domain = "reddit.com"
 
-            SUBMISSIONS_LIST.append(
-                [iso_date, item["author"], item["title"], item["url"], domain])
+def get_page(params, base_url=BASE_URL, headers=HEADERS):
+    """Requests a page of submissions from the API, live.py uses it too.
 
-            if len(SUBMISSIONS_LIST) >= MAX_SUBMISSIONS:
-                break
+    Parameters
+    ----------
+    params : dict
+        The query parameters.
 
-        if total_submissions < 500:
-            print("No more results.")
-        elif len(SUBMISSIONS_LIST) >= MAX_SUBMISSIONS:
-            print("Download complete.")
-        else:
-            time.sleep(1.2)
-            download_submissions(subreddit, latest_timestamp)
+    base_url : str
+        The base url of the API.
+
+    headers : dict
+        The headers of the request, the _alt downloaders send their own User-Agent.
+
+    Returns
+    -------
+    list
+        The submissions of the page.
+
+    """
+
+    with metrics.span("http_request", endpoint="submission") as span:
+        with requests.get(base_url + "/submission/search/", params=params, headers=headers, timeout=30) as response:
+            span["status"] = response.status_code
+            response.raise_for_status()
+            return response.json()["data"]
+
+
+def parse_submission(item):
+    """Converts a submission from the API to a csv row.
+
+    Parameters
+    ----------
+    item : dict
+        The submission from the API.
+
+    Returns
+    -------
+    list
+        We will only take 3 properties, the UTC timestamp, author and url,
+        plus the title and the domain of the url.
+
+    """
+
+    tld = tldextract.extract(item["url"])
+    domain = tld.domain + "." + tld.suffix
+
+    if item["is_self"] == True:
+        domain = "self-post"
+
+    if domain == "youtu.be":
+        domain = "youtube.com"
+
+    if domain == "redd.it":
+        domain = "reddit.com"
+
+    return [item["created_utc"], item["author"], item["title"], item["url"], domain]
 
 
 if __name__ == "__main__":
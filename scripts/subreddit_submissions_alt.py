@@ -6,11 +6,14 @@ By default it downloads all the submissions from the newest one to the first one
 import csv
 import time
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
 
-import requests
 import tldextract
 
+import fileio
+import metrics
+import subreddit_submissions
+
 # 10,000 should cover at least 2 years of submissions.
 sys.setrecursionlimit(10000)
 
@@ -22,25 +25,61 @@ SUBMISSIONS_LIST = list()
 # Year month and day.
 TARGET_DATE = "2019-01-01"
 
-TARGET_TIMESTAMP = datetime.fromisoformat(TARGET_DATE).timestamp()
+# The target date is in UTC, the same as the 'created_utc' field.
+TARGET_TIMESTAMP = datetime.fromisoformat(
+    TARGET_DATE).replace(tzinfo=timezone.utc).timestamp()
+
+# The csv files are compressed when this is .csv.gz or .csv.zst (see fileio.py).
+FILE_EXTENSION = ".csv"
+
+# Optional: Also save the submissions to this SQLite database (see store.py).
+DATABASE_FILE = None
+
+# Optional: Save the request latencies, rate limit waits and item counts to this file,
+# .prom files use the Prometheus text format (see metrics.py).
+METRICS_FILE = None
 
 
 def init():
     """Iterates over all the subreddits and creates their csv files."""
 
+    connection = None
+
+    # store.py needs pandas, it is only imported when the database is used.
+    if DATABASE_FILE:
+        import store
+
+        connection = store.connect(DATABASE_FILE)
+
+    if METRICS_FILE is not None:
+        metrics.configure(METRICS_FILE)
+
     for subreddit in SUBREDDITS:
 
-        writer = csv.writer(open("./{}-submissions.csv".format(subreddit),
-                                 "w", newline="", encoding="utf-8"))
+        file_path = "./{}-submissions{}".format(subreddit, FILE_EXTENSION)
 
-        # Adding the header.
-        writer.writerow(["datetime", "author", "title", "url", "domain"])
+        with fileio.open_text(file_path, "w") as csv_file:
 
-        print("Downloading:", subreddit)
-        download_submissions(subreddit=subreddit)
-        writer.writerows(SUBMISSIONS_LIST)
+            writer = csv.writer(csv_file)
 
-        SUBMISSIONS_LIST.clear()
+            # Adding the header.
+            writer.writerow(["created_utc", "author", "title", "url", "domain"])
+
+            # The csv file is overwritten, the rows of the subreddit in the database too.
+            if connection is not None:
+                store.delete_rows(connection, "submissions", subreddit)
+
+            print("Downloading:", subreddit)
+            download_submissions(subreddit=subreddit)
+            writer.writerows(SUBMISSIONS_LIST)
+
+            if connection is not None:
+                store.insert_rows(connection, "submissions",
+                                  subreddit, SUBMISSIONS_LIST)
+
+            SUBMISSIONS_LIST.clear()
+
+        metrics.flush()
 
 
 def download_submissions(subreddit, latest_timestamp=None):
@@ -56,8 +95,6 @@ def download_submissions(subreddit, latest_timestamp=None):
 
     """
 
-    base_url = "https://api.pushshift.io/reddit/submission/search/"
-
     params = {"subreddit": subreddit, "sort": "desc",
               "sort_type": "created_utc", "size": 500}
 
@@ -67,47 +104,49 @@ def download_submissions(subreddit, latest_timestamp=None):
     if latest_timestamp != None:
         params["before"] = latest_timestamp
 
-    with requests.get(base_url, params=params, headers=HEADERS) as response:
+    # The same request as subreddit_submissions.py, with a timeout and a status check.
+    page = subreddit_submissions.get_page(params, headers=HEADERS)
 
-        json_data = response.json()
-        total_submissions = len(json_data["data"])
-        latest_timestamp = 0
+    total_submissions = len(page)
+    latest_timestamp = 0
 
-        print("Downloading: {} submissions".format(total_submissions))
+    print("Downloading: {} submissions".format(total_submissions))
+    metrics.increment("downloaded_items_total", total_submissions, kind="submissions")
 
-        for item in json_data["data"]:
+    for item in page:
 
-            # We will only take 3 properties, the timestamp, author and url.
+        # We will only take 3 properties, the UTC timestamp, author and url.
 
-            latest_timestamp = item["created_utc"]
+        latest_timestamp = item["created_utc"]
 
-            iso_date = datetime.fromtimestamp(latest_timestamp)
-            tld = tldextract.extract(item["url"])
-            domain = tld.domain + "." + tld.suffix
+        tld = tldextract.extract(item["url"])
+        domain = tld.domain + "." + tld.suffix
 
-            if item["is_self"] == True:
-                domain = "self-post"
+        if item["is_self"] == True:
+            domain = "self-post"
 
-            if domain == "youtu.be":
-                domain = "youtube.com"
+        if domain == "youtu.be":
+            domain = "youtube.com"
 
-            if domain == "redd.it":
-                domain = "reddit.com"
+        if domain == "redd.it":
+            domain = "reddit.com"
 
-            if latest_timestamp <= TARGET_TIMESTAMP:
-                stop_loading = True
-                break
+        if latest_timestamp <= TARGET_TIMESTAMP:
+            stop_loading = True
+            break
 
-            SUBMISSIONS_LIST.append(
-                [iso_date, item["author"], item["title"], item["url"], domain])
+        SUBMISSIONS_LIST.append(
+            [latest_timestamp, item["author"], item["title"], item["url"], domain])
 
-        if total_submissions < 500:
-            print("No more results.")
-        elif stop_loading:
-            print("Download complete.")
-        else:
+    if total_submissions < 500:
+        print("No more results.")
+    elif stop_loading:
+        print("Download complete.")
+    else:
+        with metrics.span("rate_limit_wait", endpoint="submission"):
             time.sleep(1.2)
-            download_submissions(subreddit, latest_timestamp)
+
+        download_submissions(subreddit, latest_timestamp)
 
 
 if __name__ == "__main__":
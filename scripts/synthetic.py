@@ -0,0 +1,406 @@
+"""
+This script generates synthetic submissions, comments and tokens csv files with the same
+columns as the downloaders and step2.py, they are used by benchmark.py.
+
+The authors and words follow Zipf distributions, the timestamps have a daily cycle and
+the texts mix Spanish and English words. The rows are generated and written in chunks,
+so any scale (from 10 thousand to 100 million rows) uses the same memory, the files are
+compressed when their names end in .gz or .zst (see fileio.py).
+"""
+
+import argparse
+import csv
+
+import numpy as np
+import pandas as pd
+
+import fileio
+
+
+# The Zipf exponents of the authors and the words.
+AUTHORS_EXPONENT = 1.1
+WORDS_EXPONENT = 1.05
+
+# The share of comments and titles written in Spanish and of deleted authors.
+SPANISH_SHARE = 0.8
+DELETED_SHARE = 0.03
+
+# The generated period, in UTC.
+START_DATE = "2019-01-01"
+DAYS = 365
+
+# The relative activity of each hour of the day (UTC), it peaks in the evening
+# of the Mexico City timezone.
+HOUR_WEIGHTS = 1.2 + np.cos((np.arange(24) - 2) / 24 * 2 * np.pi)
+
+# The words of each language, the stop words are the ones in the assets lists.
+SPANISH_WORDS = (
+    "de la que el en y a los se del las un por con no una su para es al lo como más o pero "
+    "sus le ya fue este ha sí porque esta son entre cuando muy sin sobre también me hasta hay "
+    "méxico gobierno país ciudad gente trabajo dinero presidente años vida mundo agua calle "
+    "norte sur carro casa comida tacos perro gato policía elección partido ley salario peso "
+    "dólar precio gasolina metro futbol equipo partido escuela universidad salud hospital "
+    "2019 2020 100"
+).split()
+
+ENGLISH_WORDS = (
+    "the of and to in is that it for you was on are with as be this have not but they at "
+    "from or by one what all we can there an your which their if do will about so people "
+    "time year work money government country city water food street car house police "
+    "election law price market school health music game team world news video"
+).split()
+
+# Some texts include one of these phrases, this way the n-grams have collocations.
+PHRASES = ["ciudad de méxico", "andrés manuel lópez obrador", "tipo de cambio", "copa mundial",
+           "guardia nacional", "new york", "social media", "climate change"]
+
+# The share of texts with a phrase.
+PHRASES_SHARE = 0.3
+
+PARTS_OF_SPEECH = ["NOUN", "VERB", "ADJ", "ADP", "DET", "PRON", "ADV", "PROPN", "NUM", "PUNCT"]
+
+# The domains of the link submissions, from the most common to the least common.
+DOMAINS = ["youtube.com", "imgur.com", "reddit.com", "eluniversal.com.mx", "milenio.com",
+           "animalpolitico.com", "twitter.com", "eleconomista.com.mx", "jornada.com.mx",
+           "excelsior.com.mx", "nytimes.com", "bbc.com", "elpais.com", "proceso.com.mx"]
+
+
+def get_zipf_cdf(size, exponent):
+    """Gets the cumulative distribution of a Zipf distribution over ranks.
+
+    Parameters
+    ----------
+    size : int
+        The number of ranks.
+
+    exponent : float
+        The exponent of the distribution.
+
+    Returns
+    -------
+    numpy.ndarray
+        The cumulative probability of each rank.
+
+    """
+
+    weights = 1 / np.arange(1, size + 1) ** exponent
+
+    return np.cumsum(weights / weights.sum())
+
+
+def sample_zipf(rng, cdf, size):
+    """Samples ranks (starting at 0) from a Zipf distribution.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        The random generator.
+
+    cdf : numpy.ndarray
+        The cumulative distribution from get_zipf_cdf().
+
+    size : int
+        The number of samples.
+
+    Returns
+    -------
+    numpy.ndarray
+        The sampled ranks.
+
+    """
+
+    return np.minimum(np.searchsorted(cdf, rng.random(size)), len(cdf) - 1)
+
+
+def get_authors(rng, cdf, size):
+    """Samples author names, a few of them are deleted.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        The random generator.
+
+    cdf : numpy.ndarray
+        The cumulative distribution of the authors.
+
+    size : int
+        The number of authors.
+
+    Returns
+    -------
+    numpy.ndarray
+        The author names.
+
+    """
+
+    authors = np.char.add("user", sample_zipf(rng, cdf, size).astype("str")).astype("object")
+    authors[rng.random(size) < DELETED_SHARE] = "[deleted]"
+
+    return authors
+
+
+def get_timestamps(rng, size):
+    """Samples UTC timestamps with a daily cycle.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        The random generator.
+
+    size : int
+        The number of timestamps.
+
+    Returns
+    -------
+    numpy.ndarray
+        The timestamps, in seconds since the epoch.
+
+    """
+
+    start = int(pd.Timestamp(START_DATE, tz="UTC").timestamp())
+
+    days = rng.integers(0, DAYS, size)
+    hours = rng.choice(24, size, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    seconds = rng.integers(0, 3600, size)
+
+    return start + days * 86400 + hours * 3600 + seconds
+
+
+def get_texts(rng, size, mean_words):
+    """Generates texts with Spanish and English words.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        The random generator.
+
+    size : int
+        The number of texts.
+
+    mean_words : int
+        The average number of words of each text.
+
+    Returns
+    -------
+    list
+        The texts.
+
+    """
+
+    lengths = rng.poisson(mean_words - 1, size) + 1
+    spanish = rng.random(size) < SPANISH_SHARE
+
+    texts = [None] * size
+
+    # All the words of each language are sampled at once.
+    for words, is_language in [(SPANISH_WORDS, spanish), (ENGLISH_WORDS, ~spanish)]:
+
+        words = np.array(words, dtype="object")
+        positions = np.flatnonzero(is_language)
+        ends = np.cumsum(lengths[positions])
+
+        total = int(ends[-1]) if len(ends) > 0 else 0
+        sampled = words[sample_zipf(rng, get_zipf_cdf(len(words), WORDS_EXPONENT), total)]
+
+        for position, start, end in zip(positions, ends - lengths[positions], ends):
+            texts[position] = " ".join(sampled[start:end])
+
+    phrases = np.array(PHRASES, dtype="object")
+
+    for position in np.flatnonzero(rng.random(size) < PHRASES_SHARE):
+        texts[position] += " " + phrases[rng.integers(len(phrases))]
+
+    return texts
+
+
+def get_ids(first, size):
+    """Gets base 36 ids like the ones from reddit.
+
+    Parameters
+    ----------
+    first : int
+        The number of the first id.
+
+    size : int
+        The number of ids.
+
+    Returns
+    -------
+    list
+        The ids.
+
+    """
+
+    return [np.base_repr(number, 36).lower() for number in range(first, first + size)]
+
+
+def generate_comments(file_path, rows, seed=0, chunksize=100000):
+    """Writes a synthetic comments csv file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the comments csv file.
+
+    rows : int
+        The number of comments.
+
+    seed : int
+        The random seed.
+
+    chunksize : int
+        How many rows are generated at a time.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    cdf = get_zipf_cdf(max(100, rows // 20), AUTHORS_EXPONENT)
+
+    with fileio.open_text(file_path, "w") as csv_file:
+
+        writer = csv.writer(csv_file)
+        writer.writerow(["created_utc", "author", "body", "id"])
+
+        for first in range(0, rows, chunksize):
+
+            size = min(chunksize, rows - first)
+
+            writer.writerows(zip(get_timestamps(rng, size).tolist(), get_authors(rng, cdf, size),
+                                 get_texts(rng, size, 15), get_ids(first, size)))
+
+
+def generate_submissions(file_path, rows, seed=0, chunksize=100000):
+    """Writes a synthetic submissions csv file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the submissions csv file.
+
+    rows : int
+        The number of submissions.
+
+    seed : int
+        The random seed.
+
+    chunksize : int
+        How many rows are generated at a time.
+
+    """
+
+    rng = np.random.default_rng(seed + 1)
+    cdf = get_zipf_cdf(max(100, rows // 10), AUTHORS_EXPONENT)
+
+    domains = np.array(DOMAINS, dtype="object")
+    domains_cdf = get_zipf_cdf(len(DOMAINS), 1.0)
+
+    with fileio.open_text(file_path, "w") as csv_file:
+
+        writer = csv.writer(csv_file)
+        writer.writerow(["created_utc", "author", "title", "url", "domain"])
+
+        for first in range(0, rows, chunksize):
+
+            size = min(chunksize, rows - first)
+            ids = get_ids(first, size)
+
+            # A third of the submissions are self posts.
+            domain = domains[sample_zipf(rng, domains_cdf, size)]
+            domain[rng.random(size) < 1 / 3] = "self-post"
+
+            urls = ["https://www.reddit.com/r/mexico/comments/{}/".format(id_) if name == "self-post"
+                    else "https://{}/{}".format(name, id_) for name, id_ in zip(domain, ids)]
+
+            writer.writerows(zip(get_timestamps(rng, size).tolist(), get_authors(rng, cdf, size),
+                                 get_texts(rng, size, 8), urls, domain))
+
+
+def generate_tokens(comments_file, file_path, comments=50000, seed=0, stopwords=None):
+    """Writes a synthetic tokens csv file from the first comments of a comments file.
+
+    The words are not lemmatized, each word is its own lemma.
+
+    Parameters
+    ----------
+    comments_file : str
+        The path of the comments csv file.
+
+    file_path : str
+        The path of the tokens csv file.
+
+    comments : int
+        How many comments are tokenized, the same as the step2.py sample.
+
+    seed : int
+        The random seed.
+
+    stopwords : set
+        The stop words, by default the ones in the assets folder.
+
+    """
+
+    rng = np.random.default_rng(seed + 2)
+
+    if stopwords is None:
+        stopwords = set()
+
+        for stopwords_file in ["./assets/stopwords-es.txt", "./assets/stopwords-en.txt"]:
+            with open(stopwords_file, "r", encoding="utf-8") as words_file:
+                stopwords.update(words_file.read().splitlines())
+
+    df = pd.read_csv(comments_file, nrows=comments, dtype={"body": "str", "id": "str"},
+                     keep_default_na=False)
+
+    with fileio.open_text(file_path, "w") as csv_file:
+
+        writer = csv.writer(csv_file)
+        writer.writerow(["text", "text_lower", "lemma", "lemma_lower", "part_of_speech",
+                         "is_alphabet", "is_stopword", "comment_id", "created_utc"])
+
+        for body, comment_id, created_utc in zip(df["body"], df["id"], df["created_utc"]):
+
+            words = body.split()
+            parts_of_speech = rng.choice(PARTS_OF_SPEECH, len(words))
+
+            writer.writerows([word, word, word, word, part_of_speech, word.isalpha(),
+                              word in stopwords, comment_id, created_utc]
+                             for word, part_of_speech in zip(words, parts_of_speech))
+
+
+def main():
+    """Parses the command line arguments and generates the files."""
+
+    parser = argparse.ArgumentParser(
+        description="Generates synthetic submissions, comments and tokens csv files.")
+
+    parser.add_argument("--rows", type=int, default=100000,
+                        help="The number of comments, there are 10 times fewer submissions.")
+
+    parser.add_argument("--prefix", default="synthetic",
+                        help="The files are <prefix>-submissions.csv, <prefix>-comments.csv and <prefix>-tokens.csv")
+
+    parser.add_argument("--extension", default=".csv",
+                        help="The extension of the files, .csv.gz and .csv.zst are compressed.")
+
+    parser.add_argument("--tokens-comments", type=int, default=50000,
+                        help="How many comments are tokenized.")
+
+    parser.add_argument("--seed", type=int, default=0,
+                        help="The random seed.")
+
+    args = parser.parse_args()
+
+    files = {name: "{}-{}{}".format(args.prefix, name, args.extension)
+             for name in ["submissions", "comments", "tokens"]}
+
+    generate_submissions(files["submissions"], max(1, args.rows // 10), args.seed)
+    generate_comments(files["comments"], args.rows, args.seed)
+    generate_tokens(files["comments"], files["tokens"], args.tokens_comments, args.seed)
+
+    for file_path in files.values():
+        print("Saved:", file_path)
+
+
+if __name__ == "__main__":
+
+    main()
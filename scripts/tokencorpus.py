@@ -0,0 +1,406 @@
+"""
+This script converts the tokens of step2.py into a binary corpus, a folder with a
+vocabulary file and flat integer arrays that are opened with numpy.memmap.
+
+Each token is stored as its lemma id, part of speech id and flags (1 byte), the tokens
+of each comment are contiguous and the offsets array tells where each comment starts.
+Loading the corpus is almost instant and the word counts, the stop words filter and
+the daily counts are done with numpy.bincount() instead of parsing the tokens csv file.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+from aggregates import DAY, intern
+
+
+VOCABULARY_FILE = "vocabulary.json"
+
+# The arrays of the corpus and their types, the first 3 have one value per token,
+# offsets has one value per comment plus the total of tokens and created_utc
+# has one value per comment.
+ARRAYS = {
+    "lemmas": "int32",
+    "parts_of_speech": "uint8",
+    "flags": "uint8",
+    "offsets": "int64",
+    "created_utc": "int64"
+}
+
+# The bits of the flags array.
+ALPHABET = 1
+STOPWORD = 2
+
+
+def write_corpus(directory, chunks):
+    """Writes the tokens to a binary corpus.
+
+    Parameters
+    ----------
+    directory : str
+        The folder of the corpus, it is created if needed.
+
+    chunks : iterable
+        DataFrames with the columns of the tokens csv file, the tokens
+        of each comment must be contiguous.
+
+    Returns
+    -------
+    int
+        The number of tokens written.
+
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    lemmas = dict()
+    parts_of_speech = dict()
+
+    files = {name: open(os.path.join(directory, name + "." + dtype), "wb")
+             for name, dtype in ARRAYS.items()}
+
+    total = 0
+    previous_comment = None
+
+    for df in chunks:
+
+        if len(df) == 0:
+            continue
+
+        # Older tokens files don't have the comment columns, all
+        # their tokens belong to the same comment.
+        comments = df["comment_id"].astype("str").to_numpy(dtype="object") \
+            if "comment_id" in df.columns else np.full(len(df), "", dtype="object")
+
+        created_utc = pd.to_numeric(df["created_utc"], errors="coerce").fillna(0).to_numpy(dtype="int64") \
+            if "created_utc" in df.columns else np.zeros(len(df), dtype="int64")
+
+        # A new comment starts where the comment id changes.
+        starts = np.flatnonzero(
+            np.r_[comments[0] != previous_comment, comments[1:] != comments[:-1]])
+
+        (total + starts).astype("int64").tofile(files["offsets"])
+        created_utc[starts].tofile(files["created_utc"])
+
+        intern(df["lemma_lower"].astype("str"), lemmas).astype(
+            "int32").tofile(files["lemmas"])
+
+        intern(df["part_of_speech"].astype("str"), parts_of_speech).astype(
+            "uint8").tofile(files["parts_of_speech"])
+
+        flags = np.where(df["is_alphabet"] == True, ALPHABET, 0) | \
+            np.where(df["is_stopword"] == True, STOPWORD, 0)
+
+        flags.astype("uint8").tofile(files["flags"])
+
+        total += len(df)
+        previous_comment = comments[-1]
+
+    # The last offset is the end of the last comment.
+    np.array([total], dtype="int64").tofile(files["offsets"])
+
+    for corpus_file in files.values():
+        corpus_file.close()
+
+    with open(os.path.join(directory, VOCABULARY_FILE), "w", encoding="utf-8") as vocabulary_file:
+        json.dump({"lemmas": list(lemmas.keys()),
+                   "parts_of_speech": list(parts_of_speech.keys())},
+                  vocabulary_file, ensure_ascii=False)
+
+    return total
+
+
+def convert_tokens(file_path, directory, chunksize=aggregates.CHUNK_SIZE):
+    """Converts a tokens csv file to a binary corpus.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the tokens csv file.
+
+    directory : str
+        The folder of the corpus.
+
+    chunksize : int
+        How many rows are read at a time.
+
+    Returns
+    -------
+    int
+        The number of tokens written.
+
+    """
+
+    reader = pd.read_csv(file_path,
+                         usecols=lambda column: column in [
+                             "lemma_lower", "part_of_speech", "is_alphabet",
+                             "is_stopword", "comment_id", "created_utc"],
+                         dtype={"lemma_lower": "str", "part_of_speech": "str",
+                                "comment_id": "str"},
+                         keep_default_na=False, chunksize=chunksize)
+
+    return write_corpus(directory, reader)
+
+
+def get_corpus_files(directory):
+    """Gets the paths of the files of a binary corpus.
+
+    Parameters
+    ----------
+    directory : str
+        The folder of the corpus.
+
+    Returns
+    -------
+    list
+        The vocabulary file and the arrays files.
+
+    """
+
+    return [os.path.join(directory, VOCABULARY_FILE)] + \
+        [os.path.join(directory, name + "." + dtype) for name, dtype in ARRAYS.items()]
+
+
+def load_corpus(directory):
+    """Opens a binary corpus, the arrays are memory-mapped and not read.
+
+    Parameters
+    ----------
+    directory : str
+        The folder of the corpus.
+
+    Returns
+    -------
+    dict
+        The vocabularies (as pandas.Index) and the arrays of the corpus.
+
+    """
+
+    with open(os.path.join(directory, VOCABULARY_FILE), "r", encoding="utf-8") as vocabulary_file:
+        vocabulary = json.load(vocabulary_file)
+
+    # The corpora written by older versions also have the comment ids, they are not used.
+    corpus = {"vocabulary": {name: pd.Index(vocabulary[name], dtype="object")
+                             for name in ["lemmas", "parts_of_speech"]}}
+
+    for name, dtype in ARRAYS.items():
+
+        file_path = os.path.join(directory, name + "." + dtype)
+
+        # numpy.memmap() can't open empty files.
+        if os.path.getsize(file_path) == 0:
+            corpus[name] = np.empty(0, dtype=dtype)
+        else:
+            corpus[name] = np.memmap(file_path, dtype=dtype, mode="r")
+
+    return corpus
+
+
+def get_word_mask(corpus):
+    """Gets which tokens are words, the same filter as the tokens aggregates.
+
+    Parameters
+    ----------
+    corpus : dict
+        The binary corpus.
+
+    Returns
+    -------
+    numpy.ndarray
+        True for the tokens that are not numbers, are not stop words
+        and whose lemma is longer than one character.
+
+    """
+
+    long_enough = corpus["vocabulary"]["lemmas"].str.len().to_numpy() > 1
+    flags = corpus["flags"]
+
+    return ((flags & ALPHABET) != 0) & ((flags & STOPWORD) == 0) & \
+        long_enough[corpus["lemmas"]]
+
+
+def get_lemma_counts(corpus, mask=None):
+    """Counts the tokens of each lemma.
+
+    Parameters
+    ----------
+    corpus : dict
+        The binary corpus.
+
+    mask : numpy.ndarray
+        Only count these tokens.
+
+    Returns
+    -------
+    pandas.Series
+        The counts of the lemmas that appear at least once.
+
+    """
+
+    lemmas = corpus["lemmas"] if mask is None else corpus["lemmas"][mask]
+    counts = np.bincount(lemmas, minlength=len(corpus["vocabulary"]["lemmas"]))
+
+    found = np.flatnonzero(counts)
+
+    return pd.Series(counts[found], dtype="int64",
+                     index=corpus["vocabulary"]["lemmas"][found].rename("lemma_lower"))
+
+
+def get_token_days(corpus, positions):
+    """Gets the UTC day of some tokens from the timestamps of their comments.
+
+    Parameters
+    ----------
+    corpus : dict
+        The binary corpus.
+
+    positions : numpy.ndarray
+        The positions of the tokens.
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of days since the epoch of each token.
+
+    """
+
+    # The offsets are sorted, the comment of each token is found with a binary search.
+    comments = np.searchsorted(corpus["offsets"], positions, side="right") - 1
+
+    return corpus["created_utc"][comments] // DAY
+
+
+def get_daily_counts(corpus, lemmas=None, mask=None):
+    """Counts the tokens of each UTC day, optionally only of some lemmas.
+
+    Parameters
+    ----------
+    corpus : dict
+        The binary corpus.
+
+    lemmas : list
+        The lemmas to count, by default the counts of all the tokens are summed.
+
+    mask : numpy.ndarray
+        Only count these tokens.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One column for each lemma (or a single 'tokens' column) and
+        one row for each day, including the days without tokens.
+
+    """
+
+    if lemmas is None:
+        columns = pd.Index(["tokens"])
+        selected = np.ones(len(corpus["lemmas"]), dtype="bool")
+        lemma_columns = np.zeros(len(corpus["lemmas"]), dtype="int64")
+    else:
+        columns = pd.Index(lemmas)
+
+        # We map each lemma id to its column, -1 for the lemmas we don't count.
+        lookup = np.full(len(corpus["vocabulary"]["lemmas"]), -1, dtype="int64")
+        found = corpus["vocabulary"]["lemmas"].get_indexer(columns)
+        lookup[found[found >= 0]] = np.flatnonzero(found >= 0)
+
+        lemma_columns = lookup[corpus["lemmas"]]
+        selected = lemma_columns >= 0
+
+    if mask is not None:
+        selected &= mask
+
+    positions = np.flatnonzero(selected)
+    days = get_token_days(corpus, positions)
+
+    if len(days) == 0:
+        return pd.DataFrame(columns=columns, dtype="int64")
+
+    first_day = int(days.min())
+    number_of_days = int(days.max()) - first_day + 1
+
+    # A single bincount() counts every (day, lemma) pair.
+    keys = (days - first_day) * len(columns) + lemma_columns[positions]
+    counts = np.bincount(keys, minlength=number_of_days * len(columns))
+
+    dates = pd.to_datetime((first_day + np.arange(number_of_days)) * DAY,
+                           unit="s", utc=True)
+
+    return pd.DataFrame(counts.reshape(number_of_days, len(columns)),
+                        index=dates, columns=columns)
+
+
+def read_tokens_aggregates(directory, chunksize=None):
+    """Counts the lemmas of a binary corpus.
+
+    The returned aggregates are the same as the ones from the tokens csv file.
+
+    Parameters
+    ----------
+    directory : str
+        The folder of the corpus.
+
+    chunksize : int
+        Not used, the corpus is not read in chunks.
+
+    Returns
+    -------
+    dict
+        The aggregates with the lemma counts.
+
+    """
+
+    corpus = load_corpus(directory)
+
+    return {"total": len(corpus["lemmas"]),
+            "lemmas": get_lemma_counts(corpus, get_word_mask(corpus))}
+
+
+def main():
+    """Parses the command line arguments, converts and queries the corpus."""
+
+    parser = argparse.ArgumentParser(
+        description="Converts the tokens csv file to a memory-mapped corpus and counts its words.")
+
+    parser.add_argument("corpus", nargs="?", default="corpus",
+                        help="The folder of the corpus.")
+
+    parser.add_argument("--convert", metavar="TOKENS_FILE",
+                        help="First convert this tokens csv file.")
+
+    parser.add_argument("--top", type=int, default=20,
+                        help="Print the most common words.")
+
+    parser.add_argument("--lemmas", nargs="+",
+                        help="Print the counts of these lemmas for each period.")
+
+    parser.add_argument("--period", default="D",
+                        help="The period of the counts, a pandas frequency such as D, W or MS.")
+
+    parser.add_argument("--chunksize", type=int, default=aggregates.CHUNK_SIZE,
+                        help="How many rows are read at a time when converting.")
+
+    args = parser.parse_args()
+
+    if args.convert is not None:
+        total = convert_tokens(args.convert, args.corpus, args.chunksize)
+        print("Saved: {} ({:,} tokens)".format(args.corpus, total))
+
+    corpus = load_corpus(args.corpus)
+    mask = get_word_mask(corpus)
+
+    print(get_lemma_counts(corpus, mask).sort_values(ascending=False)[0:args.top])
+
+    if args.lemmas is not None:
+        lemmas = [lemma.lower() for lemma in args.lemmas]
+        print(get_daily_counts(corpus, lemmas, mask).resample(args.period).sum().to_string())
+
+
+if __name__ == "__main__":
+
+    main()